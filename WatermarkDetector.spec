@@ -2,12 +2,15 @@
 # -*- mode: python ; coding: utf-8 -*-
 
 import sys
+from PyInstaller.utils.hooks import collect_dynamic_libs
 block_cipher = None
 
 a = Analysis(
     ['watermark_detector_app.py'],
     pathex=[],
-    binaries=[],
+    binaries=collect_dynamic_libs(
+        'torchvision', search_patterns=['*.so', '*.pyd', '*.dylib']
+    ),
     datas=[('watermark_detector.pth', '.')],
     hiddenimports=[],
     hookspath=[],
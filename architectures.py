@@ -0,0 +1,67 @@
+"""Network architectures the detector can run.
+
+The shipped checkpoint is a ResNet-18. Distilled students are a slim
+ResNet-10 (one basic block per stage) and MobileNetV3-Small. Every
+architecture has the ResNet layout the rest of the application relies
+on: stages ``conv1`` to ``layer4`` down to a 7x7 map (for Grad-CAM),
+``avgpool``, and a linear ``fc`` classifier whose input are the features
+stored as embeddings. Checkpoints are plain state dicts; the architecture
+is recognised from their keys.
+"""
+
+import torch
+from torchvision import models
+from torchvision.models.resnet import BasicBlock, ResNet
+
+ARCHITECTURES = ("resnet18", "resnet10", "mobilenet_v3_small")
+
+
+class MobileNetStudent(torch.nn.Module):
+    """MobileNetV3-Small with its blocks grouped into ResNet-style stages"""
+
+    def __init__(self, features=None):
+        super().__init__()
+        # Pass the features of a pretrained MobileNetV3-Small to start from them
+        if features is None:
+            features = models.mobilenet_v3_small().features
+        # The stem convolution includes its batch norm and activation
+        self.conv1 = features[0]
+        self.bn1 = torch.nn.Identity()
+        self.relu = torch.nn.Identity()
+        self.maxpool = torch.nn.Identity()
+        # Stages ending at strides 4, 8, 16 and 32, like the ResNet layers
+        self.layer1 = features[1]
+        self.layer2 = features[2:4]
+        self.layer3 = features[4:9]
+        self.layer4 = features[9:]
+        self.avgpool = torch.nn.AdaptiveAvgPool2d(1)
+        self.fc = torch.nn.Linear(features[-1].out_channels, 2)
+
+    def forward(self, x):
+        x = self.maxpool(self.relu(self.bn1(self.conv1(x))))
+        x = self.layer4(self.layer3(self.layer2(self.layer1(x))))
+        return self.fc(torch.flatten(self.avgpool(x), 1))
+
+
+def build_model(architecture):
+    """An untrained two-class network of the given architecture"""
+    if architecture == "resnet18":
+        model = models.resnet18()
+        model.fc = torch.nn.Linear(model.fc.in_features, 2)
+    elif architecture == "resnet10":
+        model = ResNet(BasicBlock, [1, 1, 1, 1], num_classes=2)
+    elif architecture == "mobilenet_v3_small":
+        model = MobileNetStudent()
+    else:
+        raise ValueError(f"Unknown architecture {architecture!r}")
+    return model
+
+
+def architecture_of(state_dict):
+    """Recognise the architecture of a checkpoint from its keys"""
+    # The MobileNet stem is a conv, batch norm, activation sequence
+    if "conv1.0.weight" in state_dict:
+        return "mobilenet_v3_small"
+    if "layer1.1.conv1.weight" in state_dict:
+        return "resnet18"
+    return "resnet10"
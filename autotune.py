@@ -0,0 +1,235 @@
+"""Per-machine autotuning of batch size, worker processes and threads.
+
+A short calibration runs the real detection pipeline on a sample of the
+input set for a handful of configurations and keeps the fastest one whose
+peak memory stays under a ceiling. The choice is stored in a JSON file,
+keyed by a fingerprint of the hardware and of the model checkpoint, so a
+new model file or different hardware gets tuned again.
+"""
+
+import hashlib
+import json
+import os
+import platform
+import threading
+import time
+
+import torch
+
+from memory_stats import resident_memory
+
+DEFAULT_TUNING_PATH = os.path.join(
+    os.path.expanduser("~"), ".cache", "watermark_detector", "autotune.json"
+)
+
+# Images from the input set used for each calibration run
+SAMPLE_SIZE = 128
+
+BATCH_SIZES = (8, 16, 32, 64)
+
+# Default memory ceiling as a share of physical memory
+MEMORY_FRACTION = 0.5
+
+# Seconds between memory samples during a calibration run
+_SAMPLE_INTERVAL = 0.05
+
+
+def physical_memory():
+    """Total physical memory in bytes, or None when it cannot be read"""
+    try:
+        return os.sysconf("SC_PAGE_SIZE") * os.sysconf("SC_PHYS_PAGES")
+    except (AttributeError, OSError, ValueError):
+        return None
+
+
+def machine_fingerprint():
+    """Describe the hardware and runtime that throughput depends on"""
+    fingerprint = {
+        "machine": platform.machine(),
+        "processor": platform.processor(),
+        "system": platform.system(),
+        "cpu_count": os.cpu_count(),
+        "memory": physical_memory(),
+        "torch": torch.__version__,
+    }
+    if torch.cuda.is_available():
+        fingerprint["gpu"] = torch.cuda.get_device_name(0)
+    return fingerprint
+
+
+def tuning_key(model_key):
+    """Key of the stored tuning for this machine and model checkpoint"""
+    key = json.dumps([machine_fingerprint(), model_key], sort_keys=True)
+    return hashlib.sha1(key.encode("utf-8")).hexdigest()[:16]
+
+
+def _load_all(path):
+    try:
+        with open(path) as f:
+            return json.load(f)
+    except (OSError, ValueError):
+        return {}
+
+
+def load_tuning(model_key, path=DEFAULT_TUNING_PATH):
+    """Return the stored tuning for this machine and model, or None"""
+    return _load_all(path).get(tuning_key(model_key))
+
+
+def save_tuning(model_key, tuning, path=DEFAULT_TUNING_PATH):
+    """Store a tuning for this machine and model"""
+    tunings = _load_all(path)
+    tunings[tuning_key(model_key)] = tuning
+
+    os.makedirs(os.path.dirname(path), exist_ok=True)
+    tmp_path = path + ".tmp"
+    with open(tmp_path, "w") as f:
+        json.dump(tunings, f, indent=2)
+    os.replace(tmp_path, path)
+
+
+def _child_pids(pid):
+    """Direct children of a process, found through /proc"""
+    children = []
+    try:
+        entries = os.listdir("/proc")
+    except OSError:
+        return children
+
+    for entry in entries:
+        if not entry.isdigit():
+            continue
+        try:
+            with open("/proc/{}/stat".format(entry)) as f:
+                # The parent pid follows the parenthesised command name
+                fields = f.read().rsplit(")", 1)[1].split()
+        except (OSError, IndexError):
+            continue
+        if int(fields[1]) == pid:
+            children.append(int(entry))
+    return children
+
+
+class MemorySampler:
+    """Track the peak resident memory of this process and its workers
+
+    Worker processes are included, since pool workers hold their own
+    decoded images and activations. Memory is only measured on Linux;
+    elsewhere ``peak`` stays 0 and no ceiling is applied.
+    """
+
+    def __init__(self):
+        self.peak = 0
+        self._stop = threading.Event()
+        self._thread = None
+
+    def sample(self):
+        pid = os.getpid()
+        total = resident_memory(pid) + sum(
+            resident_memory(child) for child in _child_pids(pid)
+        )
+        self.peak = max(self.peak, total)
+
+    def _run(self):
+        while not self._stop.wait(_SAMPLE_INTERVAL):
+            self.sample()
+
+    def __enter__(self):
+        self.sample()
+        self._thread = threading.Thread(target=self._run, daemon=True)
+        self._thread.start()
+        return self
+
+    def __exit__(self, *exc_info):
+        self._stop.set()
+        self._thread.join()
+
+
+def _thread_counts(cpu_count):
+    """Intra-op thread counts to try: all cores, then halving down to one"""
+    counts = []
+    count = cpu_count
+    while count >= 1:
+        counts.append(count)
+        count //= 2
+    return counts
+
+
+def _worker_counts(cpu_count):
+    """Worker process counts to try: none, then doubling up to the cores"""
+    counts = [0]
+    count = 2
+    while count <= cpu_count:
+        counts.append(count)
+        count *= 2
+    return counts
+
+
+def autotune(run_trial, cpu_count=None, memory_limit=None, log=print):
+    """Find the fastest configuration that fits under ``memory_limit`` bytes
+
+    ``run_trial(config)`` runs detection on the calibration sample with a
+    config dict of ``batch_size``, ``workers`` and ``threads`` and returns
+    the number of images processed. The search tunes one setting at a time
+    (threads, then worker processes, then batch size) starting from the
+    defaults, which keeps calibration to about a dozen short runs.
+    """
+    cpu_count = cpu_count or os.cpu_count() or 1
+    if memory_limit is None and physical_memory() is not None:
+        memory_limit = int(physical_memory() * MEMORY_FRACTION)
+
+    best = {"batch_size": 32, "workers": 0, "threads": cpu_count}
+    best_rate = 0.0
+    best_peak = 0
+    trials = []
+
+    # Warm the file cache and model so the first timed run is not penalised
+    run_trial(dict(best))
+
+    measured = {}
+
+    def measure(config):
+        key = (config["batch_size"], config["workers"], config["threads"])
+        if key in measured:
+            return measured[key]
+
+        with MemorySampler() as sampler:
+            start = time.perf_counter()
+            count = run_trial(config)
+            elapsed = time.perf_counter() - start
+        rate = count / elapsed if elapsed > 0 else 0.0
+        trials.append(dict(config, images_per_second=rate, peak_rss=sampler.peak))
+        log(
+            "batch {batch_size:>3}, workers {workers:>2}, threads {threads:>2}: "
+            "{rate:.1f} images/s, peak {peak:.0f} MB".format(
+                rate=rate, peak=sampler.peak / 2**20, **config
+            )
+        )
+        measured[key] = rate, sampler.peak
+        return measured[key]
+
+    stages = [
+        ("threads", _thread_counts(cpu_count)),
+        ("workers", _worker_counts(cpu_count)),
+        ("batch_size", BATCH_SIZES),
+    ]
+    for setting, values in stages:
+        for value in values:
+            config = dict(best, **{setting: value})
+            if setting == "workers" and value > 0:
+                # Pool workers split the cores between them (see inference_pool)
+                config["threads"] = max(1, cpu_count // value)
+            rate, peak = measure(config)
+            if memory_limit is not None and peak > memory_limit:
+                continue
+            if rate > best_rate:
+                best, best_rate, best_peak = config, rate, peak
+
+    return dict(
+        best,
+        images_per_second=best_rate,
+        peak_rss=best_peak,
+        memory_limit=memory_limit,
+        trials=trials,
+        tuned_at=time.strftime("%Y-%m-%dT%H:%M:%S"),
+    )
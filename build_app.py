@@ -1,24 +1,142 @@
+import argparse
 import os
 import sys
 import platform
 import subprocess
+import time
 
+# Modules the application never imports; leaving them out of the lean build
+# keeps the bundle small and the import graph short
+LEAN_EXCLUDES = [
+    # Development and plotting tools pulled in by optional imports
+    "tkinter",
+    "matplotlib",
+    "IPython",
+    "jupyter",
+    "notebook",
+    "pytest",
+    "pandas",
+    "scipy",
+    "tensorboard",
+    "torch.utils.tensorboard",
+    # Parquet export is not available in the lean build
+    "pyarrow",
+    # Qt modules the window does not use
+    "PyQt5.QtBluetooth",
+    "PyQt5.QtDBus",
+    "PyQt5.QtDesigner",
+    "PyQt5.QtHelp",
+    "PyQt5.QtLocation",
+    "PyQt5.QtMultimedia",
+    "PyQt5.QtMultimediaWidgets",
+    "PyQt5.QtNetwork",
+    "PyQt5.QtNfc",
+    "PyQt5.QtOpenGL",
+    "PyQt5.QtPositioning",
+    "PyQt5.QtQml",
+    "PyQt5.QtQuick",
+    "PyQt5.QtQuickWidgets",
+    "PyQt5.QtSensors",
+    "PyQt5.QtSerialPort",
+    "PyQt5.QtSql",
+    "PyQt5.QtTest",
+    "PyQt5.QtWebChannel",
+    "PyQt5.QtWebEngineCore",
+    "PyQt5.QtWebEngineWidgets",
+    "PyQt5.QtWebSockets",
+    "PyQt5.QtXmlPatterns",
+]
 
-def build_executable():
+SPEC_FILES = {
+    "default": "WatermarkDetector.spec",
+    "lean": "WatermarkDetector-lean.spec",
+}
+
+# Built executable of each profile on Linux
+LINUX_EXECUTABLES = {
+    "default": os.path.join("dist", "WatermarkDetector"),
+    "lean": os.path.join("dist", "WatermarkDetector-lean", "WatermarkDetector"),
+}
+
+
+def lean_spec():
+    """Spec of the lean Linux profile: onedir output, no UPX, unused modules excluded"""
+    # A onedir build starts straight from the unpacked files instead of
+    # extracting the whole torch/Qt payload to a temp dir on every launch
+    return """
+# -*- mode: python ; coding: utf-8 -*-
+
+from PyInstaller.utils.hooks import collect_dynamic_libs
+
+a = Analysis(
+    ['watermark_detector_app.py'],
+    pathex=[],
+    # Newer torchvision builds name their ops library _C_stable, which the
+    # torchvision hook does not pick up
+    binaries=collect_dynamic_libs(
+        'torchvision', search_patterns=['*.so', '*.pyd', '*.dylib']
+    ),
+    datas=[('watermark_detector.pth', '.')],
+    hiddenimports=[],
+    hookspath=[],
+    hooksconfig={{}},
+    runtime_hooks=[],
+    excludes={excludes!r},
+    noarchive=False,
+)
+pyz = PYZ(a.pure, a.zipped_data)
+
+exe = EXE(
+    pyz,
+    a.scripts,
+    [],
+    exclude_binaries=True,
+    name='WatermarkDetector',
+    debug=False,
+    bootloader_ignore_signals=False,
+    strip=False,
+    upx=False,
+    console=False,
+)
+
+coll = COLLECT(
+    exe,
+    a.binaries,
+    a.zipfiles,
+    a.datas,
+    strip=False,
+    upx=False,
+    name='WatermarkDetector-lean',
+)
+""".format(
+        excludes=LEAN_EXCLUDES
+    )
+
+
+def build_executable(profile="default"):
     """Build the executable for the current platform"""
-    print(f"Building executable for {platform.system()}...")
+    print(f"Building {profile} executable for {platform.system()}...")
 
-    # Create a spec file with additional options
-    spec_content = """
+    if profile == "lean":
+        if platform.system() != "Linux":
+            print("The lean profile is only available on Linux")
+            return False
+        spec_content = lean_spec()
+    else:
+        # Create a spec file with additional options
+        spec_content = """
 # -*- mode: python ; coding: utf-8 -*-
 
 import sys
+from PyInstaller.utils.hooks import collect_dynamic_libs
 block_cipher = None
 
 a = Analysis(
     ['watermark_detector_app.py'],
     pathex=[],
-    binaries=[],
+    binaries=collect_dynamic_libs(
+        'torchvision', search_patterns=['*.so', '*.pyd', '*.dylib']
+    ),
     datas=[('watermark_detector.pth', '.')],
     hiddenimports=[],
     hookspath=[],
@@ -75,11 +193,12 @@ if sys.platform == 'darwin':
 """
 
     # Write the spec file
-    with open("WatermarkDetector.spec", "w") as f:
+    spec_file = SPEC_FILES[profile]
+    with open(spec_file, "w") as f:
         f.write(spec_content)
 
     # Determine the PyInstaller command based on the platform
-    cmd = ["pyinstaller", "WatermarkDetector.spec"]
+    cmd = ["pyinstaller", "--noconfirm", spec_file]
 
     # Run PyInstaller
     try:
@@ -91,10 +210,76 @@ if sys.platform == 'darwin':
             print("Executable location: dist/WatermarkDetector.app")
         elif platform.system() == "Windows":
             print("Executable location: dist/WatermarkDetector.exe")
+        else:
+            print(f"Executable location: {LINUX_EXECUTABLES[profile]}")
+        return True
 
     except subprocess.CalledProcessError as e:
         print(f"Build failed with error: {e}")
+        return False
+
+
+def time_until_output(cmd, marker=None, timeout=300):
+    """Seconds from launching cmd until it prints a line (containing marker)"""
+    start = time.perf_counter()
+    process = subprocess.Popen(
+        cmd, stdout=subprocess.PIPE, stderr=subprocess.DEVNULL, text=True
+    )
+    try:
+        for line in process.stdout:
+            if marker is None or marker in line:
+                return time.perf_counter() - start
+    finally:
+        process.kill()
+        process.wait(timeout=timeout)
+    raise RuntimeError("{} exited without output".format(cmd[0]))
+
+
+def benchmark_startup(image_path, profiles=("default", "lean"), runs=3):
+    """Compare launch-to-window and launch-to-first-result between builds"""
+    print(f"{'profile':<10} {'window (s)':>12} {'first result (s)':>18}")
+    for profile in profiles:
+        executable = LINUX_EXECUTABLES[profile]
+        if not os.path.exists(executable):
+            print(f"{profile:<10} not built")
+            continue
+
+        # The best of several launches; the first one also warms the disk cache
+        window_times = []
+        result_times = []
+        for _ in range(runs):
+            window_times.append(
+                time_until_output([executable, "--startup-benchmark"], "window ready")
+            )
+            result_times.append(
+                time_until_output([executable, "--headless", image_path])
+            )
+        print(f"{profile:<10} {min(window_times):>12.2f} {min(result_times):>18.2f}")
+
+
+def parse_args(argv):
+    parser = argparse.ArgumentParser(description="Build the Watermark Detector app.")
+    parser.add_argument(
+        "--profile",
+        choices=sorted(SPEC_FILES),
+        default="default",
+        help="default: single-file executable; lean: onedir Linux build "
+        "without unused modules",
+    )
+    parser.add_argument(
+        "--benchmark",
+        metavar="IMAGE",
+        help="instead of building, time the startup of the built profiles on IMAGE",
+    )
+    parser.add_argument(
+        "--runs", type=int, default=3, help="launches per benchmark measurement"
+    )
+    return parser.parse_args(argv)
 
 
 if __name__ == "__main__":
-    build_executable()
+    args = parse_args(sys.argv[1:])
+    if args.benchmark:
+        benchmark_startup(args.benchmark, runs=args.runs)
+    elif not build_executable(args.profile):
+        sys.exit(1)
@@ -0,0 +1,246 @@
+"""Killable decoder processes with a per-image time budget.
+
+A truncated or pathological file can make an image decoder hang or spin
+for a long time, or crash the process it runs in. Images are therefore
+decoded in worker processes, one image per process at a time, and a
+watchdog stops a decoder that runs over its budget. That image is reported
+as timed out (or crashed), a fresh decoder takes the stopped one's place,
+and the images decoding in the other processes carry on.
+"""
+
+import functools
+import time
+from multiprocessing import connection
+
+import torch
+import torch.multiprocessing as mp
+
+from inference_pool import _predict, _start_method, decode_payload
+from large_images import DEFAULT_MEMORY_LIMIT, ImageTooLarge
+from multiframe import FRAME_BUDGET
+
+# Seconds one image may take to decode, when the watchdog is switched on
+DECODE_TIMEOUT = 30.0
+
+# Decoder processes (at least; a worker pool gets one per worker)
+DECODER_PROCESSES = 2
+
+
+class DecodeTimeout(Exception):
+    """An image took longer to decode than its time budget"""
+
+
+def _predict_frames(model, conn, inputs):
+    """Classify a chunk of frames, first telling the watchdog how many"""
+    conn.send(("frames", len(inputs)))
+    return _predict(model, inputs)
+
+
+def _decoder_main(model, options, conn):
+    """Decoder process loop: decode payloads until a None task arrives"""
+    # Decoders run next to the inference threads; one thread each is enough
+    torch.set_num_threads(1)
+    predict = functools.partial(_predict_frames, model, conn)
+
+    while True:
+        payload = conn.recv()
+        if payload is None:
+            break
+
+        decode_start = time.perf_counter()
+        try:
+            decoded = decode_payload(predict, payload, options)
+        except ImageTooLarge as e:
+            decoded = e
+        except Exception as e:
+            # Sent as a plain error, whatever its type
+            decoded = RuntimeError(str(e))
+        decode_ms = (time.perf_counter() - decode_start) * 1000
+        conn.send(("done", decoded, decode_ms))
+
+
+class _Decoder:
+    """A decoder process and the image it is working on"""
+
+    def __init__(self, process, conn):
+        self.process = process
+        self.conn = conn
+        self.image_path = None
+        self.started = None
+        self.deadline = None
+
+
+class DecoderPool:
+    """Decoder processes turning image sources into model inputs
+
+    ``decode`` yields what the detection thread decodes in-process: an
+    input tensor (or RGB array for the fast preprocessing), a prediction
+    tuple for an animated or multi-page image, or the exception to report.
+    Frames of animated images are classified in the decoder, and each
+    chunk of frames extends the image's deadline by ``inference_timeout``
+    per frame, so decoding and inference are budgeted separately.
+    """
+
+    def __init__(
+        self,
+        model,
+        transform,
+        processes=DECODER_PROCESSES,
+        fast_preprocess=False,
+        frame_sampling=(None, FRAME_BUDGET),
+        image_memory_limit=DEFAULT_MEMORY_LIMIT,
+        timeout=DECODE_TIMEOUT,
+        inference_timeout=None,
+    ):
+        self.timeout = timeout
+        self.inference_timeout = inference_timeout
+
+        start_method = _start_method()
+        if start_method == "spawn":
+            model.share_memory()
+
+        self.model = model
+        self.context = mp.get_context(start_method)
+        # Same layout as the inference pool options; decoding reads only
+        # the transform, preprocessing, frame sampling and memory limit
+        self.options = (
+            transform,
+            fast_preprocess,
+            False,
+            False,
+            frame_sampling,
+            image_memory_limit,
+        )
+        self.decoders = [self._start_decoder() for _ in range(processes)]
+
+    def _start_decoder(self):
+        conn, decoder_conn = self.context.Pipe()
+        process = self.context.Process(
+            target=_decoder_main,
+            args=(self.model, self.options, decoder_conn),
+            daemon=True,
+        )
+        process.start()
+        # Only the decoder holds its end, so its exit reads as EOF
+        decoder_conn.close()
+        return _Decoder(process, conn)
+
+    def decode(self, sources):
+        """Yield (image_path, decoded, decode_ms) as images finish decoding
+
+        ``sources`` yields (image_path, source, read_error) like
+        iter_image_sources. Results come in the order images finish.
+        """
+        sources = iter(sources)
+        exhausted = False
+
+        while True:
+            # Give every idle decoder an image
+            for decoder in self.decoders:
+                while not exhausted and decoder.image_path is None:
+                    try:
+                        image_path, source, read_error = next(sources)
+                    except StopIteration:
+                        exhausted = True
+                        break
+                    if read_error is not None:
+                        yield image_path, read_error, None
+                        continue
+                    self._start(decoder, image_path, source)
+
+            busy = [decoder for decoder in self.decoders if decoder.image_path]
+            if not busy:
+                return
+
+            ready = connection.wait(
+                [decoder.conn for decoder in busy], self._time_left(busy)
+            )
+            for decoder in busy:
+                if decoder.conn in ready:
+                    finished = self._receive(decoder)
+                elif self._overdue(decoder):
+                    finished = self._stop(
+                        decoder,
+                        DecodeTimeout(
+                            "Decoding timed out after {:.0f} s".format(self.timeout)
+                        ),
+                    )
+                else:
+                    continue
+                if finished is not None:
+                    yield finished
+
+    def _start(self, decoder, image_path, source):
+        """Send an image to an idle decoder and start its clock"""
+        # Archive members arrive as in-memory buffers, plain files as paths
+        payload = source if isinstance(source, str) else source.getvalue()
+        decoder.conn.send(payload)
+        decoder.image_path = image_path
+        decoder.started = time.perf_counter()
+        decoder.deadline = None
+        if self.timeout:
+            decoder.deadline = decoder.started + self.timeout
+
+    def _receive(self, decoder):
+        """Read a decoder message; return the finished image, if any"""
+        try:
+            message = decoder.conn.recv()
+        except (EOFError, OSError):
+            decoder.process.join(timeout=1)
+            return self._stop(
+                decoder,
+                RuntimeError(
+                    "Decoder process crashed (exit code {})".format(
+                        decoder.process.exitcode
+                    )
+                ),
+            )
+
+        if message[0] == "frames":
+            # Classifying frames is inference; it has a budget of its own
+            if decoder.deadline is not None and self.inference_timeout:
+                decoder.deadline += self.inference_timeout * message[1]
+            return None
+
+        _, decoded, decode_ms = message
+        image_path = decoder.image_path
+        decoder.image_path = None
+        return image_path, decoded, decode_ms
+
+    def _overdue(self, decoder):
+        if decoder.deadline is None or time.perf_counter() < decoder.deadline:
+            return False
+        # The consumer may have been busy; a message sent meanwhile counts
+        return not decoder.conn.poll()
+
+    def _time_left(self, busy):
+        """Seconds until the next decoder deadline (None: no deadline)"""
+        deadlines = [decoder.deadline for decoder in busy if decoder.deadline]
+        if not deadlines:
+            return None
+        return max(0.0, min(deadlines) - time.perf_counter())
+
+    def _stop(self, decoder, error):
+        """Replace a stuck or crashed decoder; return its image as failed"""
+        decoder.process.kill()
+        decoder.process.join()
+        decoder.conn.close()
+        self.decoders[self.decoders.index(decoder)] = self._start_decoder()
+
+        decode_ms = (time.perf_counter() - decoder.started) * 1000
+        return decoder.image_path, error, decode_ms
+
+    def close(self):
+        """Stop the decoders"""
+        for decoder in self.decoders:
+            if decoder.image_path is None:
+                try:
+                    decoder.conn.send(None)
+                except OSError:
+                    pass
+        for decoder in self.decoders:
+            decoder.process.join(timeout=1)
+            if decoder.process.is_alive():
+                decoder.process.kill()
+                decoder.process.join()
+            decoder.conn.close()
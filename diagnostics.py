@@ -0,0 +1,153 @@
+"""Leak diagnostics across repeated detection jobs.
+
+With diagnostics on, the window records the resources in use before and
+after every detection job: resident memory, the Python heap as traced by
+tracemalloc, live Qt objects and pixmaps, and the torch allocator. Each
+job's snapshot is compared with the one after the previous job, so in a
+session that repeats similar work anything that keeps growing stands out,
+along with the source lines that allocated the new Python memory.
+"""
+
+import collections
+import gc
+import sys
+import tracemalloc
+
+import torch
+from PyQt5.QtCore import QObject, QThread
+from PyQt5.QtGui import QPixmap
+from PyQt5.QtWidgets import QApplication
+
+from memory_stats import resident_memory
+
+# Frames kept per traced allocation
+TRACE_DEPTH = 10
+
+# Growth between jobs that is reported as a possible leak
+RSS_TOLERANCE = 16 * 2**20
+HEAP_TOLERANCE = 4 * 2**20
+
+# Source lines listed for the Python heap growth of a job
+TOP_ALLOCATIONS = 8
+
+ResourceSnapshot = collections.namedtuple(
+    "ResourceSnapshot",
+    "rss python_heap qobjects widgets pixmaps threads torch_allocated heap_trace",
+)
+
+
+def count_live(types):
+    """Count the live Python objects of each type among the given ones"""
+    counts = dict.fromkeys(types, 0)
+    for obj in gc.get_objects():
+        # type() rather than isinstance(), which reads __class__ and trips
+        # deprecation shims of some torch objects
+        obj_type = type(obj)
+        for cls in types:
+            if issubclass(obj_type, cls):
+                counts[cls] += 1
+    return counts
+
+
+def torch_allocated():
+    """Bytes held by the torch CUDA allocator, or None on the CPU"""
+    if torch.cuda.is_available():
+        return torch.cuda.memory_allocated()
+    return None
+
+
+def take_snapshot():
+    """Record the resources in use by this process now"""
+    # Collect first, so only reachable objects are counted
+    gc.collect()
+    live = count_live((QObject, QPixmap, QThread))
+    heap_trace = tracemalloc.take_snapshot() if tracemalloc.is_tracing() else None
+    app = QApplication.instance()
+    return ResourceSnapshot(
+        rss=resident_memory(),
+        python_heap=tracemalloc.get_traced_memory()[0] if heap_trace else None,
+        qobjects=live[QObject],
+        widgets=len(app.allWidgets()) if app is not None else 0,
+        pixmaps=live[QPixmap],
+        threads=live[QThread],
+        torch_allocated=torch_allocated(),
+        heap_trace=heap_trace,
+    )
+
+
+def _format_bytes(value):
+    return "{:+.1f} MB".format(value / 2**20)
+
+
+class LeakTracker:
+    """Snapshot resources around each detection job and report growth"""
+
+    def __init__(self, log=None):
+        self.log = log or (lambda message: print(message, file=sys.stderr))
+        self.jobs = 0
+        self.before = None
+        self.previous = None
+        if not tracemalloc.is_tracing():
+            tracemalloc.start(TRACE_DEPTH)
+
+    def before_job(self):
+        self.before = take_snapshot()
+
+    def after_job(self):
+        """Report what the job left behind and flag growth since the last job"""
+        after = take_snapshot()
+        self.jobs += 1
+        self.log(
+            "Job {}: {:.0f} MB resident, {} QObjects, {} widgets, {} pixmaps, "
+            "{} threads{}".format(
+                self.jobs,
+                after.rss / 2**20,
+                after.qobjects,
+                after.widgets,
+                after.pixmaps,
+                after.threads,
+                (
+                    ", {:.0f} MB Python heap".format(after.python_heap / 2**20)
+                    if after.python_heap is not None
+                    else ""
+                ),
+            )
+        )
+        if self.before is not None:
+            self.log(
+                "  during the job: RSS {}".format(
+                    _format_bytes(after.rss - self.before.rss)
+                )
+            )
+
+        if self.previous is not None:
+            for warning in self.growth_warnings(self.previous, after):
+                self.log("  possible leak: " + warning)
+        self.previous = after
+
+    def growth_warnings(self, previous, current):
+        """Describe what grew beyond tolerance between two after-job snapshots"""
+        warnings = []
+        rss_growth = current.rss - previous.rss
+        if rss_growth > RSS_TOLERANCE:
+            warnings.append("resident memory " + _format_bytes(rss_growth))
+        for name in ("qobjects", "widgets", "pixmaps", "threads"):
+            growth = getattr(current, name) - getattr(previous, name)
+            if growth > 0:
+                warnings.append("{} {:+d}".format(name, growth))
+        if previous.torch_allocated is not None:
+            growth = current.torch_allocated - previous.torch_allocated
+            if growth > 0:
+                warnings.append("torch allocator " + _format_bytes(growth))
+
+        if current.heap_trace is not None and previous.heap_trace is not None:
+            heap_growth = current.python_heap - previous.python_heap
+            if heap_growth > HEAP_TOLERANCE:
+                warnings.append("Python heap " + _format_bytes(heap_growth))
+                statistics = current.heap_trace.compare_to(
+                    previous.heap_trace, "lineno"
+                )
+                for stat in statistics[:TOP_ALLOCATIONS]:
+                    if stat.size_diff > 0:
+                        warnings.append("  {}".format(stat))
+        return warnings
@@ -0,0 +1,368 @@
+"""Distil the detector into a smaller, faster student model.
+
+The student learns to reproduce the teacher's soft labels (its class
+probabilities softened by a temperature) on a folder of unlabeled images,
+so no annotation is needed. Both see the same randomly cropped, flipped and
+colour-jittered view of every image. Training runs on the CPU.
+
+Every tenth image is held out. On those, the student's labels and watermark
+probabilities are compared with the teacher's, and the throughput of both
+is measured. The student is saved as a plain state dict; run the app with
+``WATERMARK_DETECTOR_MODEL=student.pth`` to use it in place of the teacher.
+
+    python distill.py photos/ -o student.pth --architecture resnet10
+"""
+
+import argparse
+import io
+import os
+import sys
+import time
+
+import torch
+from torchvision import models, transforms
+
+from architectures import (
+    ARCHITECTURES,
+    MobileNetStudent,
+    architecture_of,
+    build_model,
+)
+from image_sources import (
+    is_archive,
+    is_zip_member,
+    iter_folder_images,
+    read_zip_member,
+)
+from large_images import load_rgb, open_image
+from model_weights import load_weights
+from parity import compare
+
+TEACHER_PATH = "watermark_detector.pth"
+DEFAULT_ARCHITECTURE = "mobilenet_v3_small"
+
+EPOCHS = 5
+BATCH_SIZE = 32
+LEARNING_RATE = 1e-3
+
+# Softens the teacher's probabilities so the student also learns how sure
+# it is, not only its labels
+TEMPERATURE = 4.0
+
+# Every HOLDOUT_EVERY-th image is kept out of training, at most MAX_HOLDOUT
+HOLDOUT_EVERY = 10
+MAX_HOLDOUT = 512
+
+# Processes decoding training images, next to the training threads
+LOADER_WORKERS = min(2, os.cpu_count() or 1)
+
+# Same as the transform of the app
+EVAL_TRANSFORM = transforms.Compose(
+    [
+        transforms.Resize((224, 224)),
+        transforms.ToTensor(),
+    ]
+)
+
+TRAIN_TRANSFORM = transforms.Compose(
+    [
+        transforms.RandomResizedCrop(224, scale=(0.6, 1.0)),
+        transforms.RandomHorizontalFlip(),
+        transforms.ColorJitter(0.2, 0.2, 0.2),
+        transforms.ToTensor(),
+    ]
+)
+
+
+def load_model(path):
+    """Load a checkpoint into the architecture it was saved from"""
+    state_dict, _ = load_weights(path)
+    with torch.device("meta"):
+        model = build_model(architecture_of(state_dict))
+    model.load_state_dict(state_dict, assign=True)
+    return model.eval()
+
+
+def init_student(architecture, teacher, imagenet=False):
+    """A student network with the best starting weights available offline
+
+    A ResNet-10 starts from the first block of every teacher stage, which
+    are shaped alike. MobileNetV3-Small starts from scratch, or from the
+    torchvision ImageNet weights (downloaded once) with ``imagenet``.
+    """
+    if architecture == "mobilenet_v3_small" and imagenet:
+        weights = models.MobileNet_V3_Small_Weights.DEFAULT
+        return MobileNetStudent(models.mobilenet_v3_small(weights=weights).features)
+
+    student = build_model(architecture)
+    if architecture == "resnet10":
+        student_state = student.state_dict()
+        student.load_state_dict(
+            {
+                key: value
+                for key, value in teacher.state_dict().items()
+                if key in student_state and value.shape == student_state[key].shape
+            },
+            strict=False,
+        )
+    return student
+
+
+def list_images(inputs):
+    """Images under the inputs, in a stable order (tar archives are skipped)"""
+    image_paths = []
+    for root in inputs:
+        for image_path in iter_folder_images(root):
+            # Tar members cannot be read one at a time in random order
+            if is_zip_member(image_path) or not is_archive(image_path):
+                image_paths.append(image_path)
+    return sorted(image_paths)
+
+
+def split_holdout(image_paths):
+    """Split paths into (training, held out)"""
+    holdout = image_paths[::HOLDOUT_EVERY][:MAX_HOLDOUT]
+    held_out = set(holdout)
+    return [path for path in image_paths if path not in held_out], holdout
+
+
+def open_path(image_path):
+    if is_zip_member(image_path):
+        return open_image(io.BytesIO(read_zip_member(image_path)))
+    return open_image(image_path)
+
+
+class ImageDataset(torch.utils.data.Dataset):
+    """Images decoded and transformed on demand; unreadable ones are None"""
+
+    def __init__(self, image_paths, transform):
+        self.image_paths = image_paths
+        self.transform = transform
+
+    def __len__(self):
+        return len(self.image_paths)
+
+    def __getitem__(self, index):
+        try:
+            with open_path(self.image_paths[index]) as image:
+                return self.transform(load_rgb(image))
+        except Exception:
+            return None
+
+
+def _collate(tensors):
+    tensors = [tensor for tensor in tensors if tensor is not None]
+    return torch.stack(tensors) if tensors else None
+
+
+def distillation_loss(student_logits, teacher_logits, temperature=TEMPERATURE):
+    """KL divergence between the softened teacher and student distributions"""
+    teacher_probabilities = torch.softmax(teacher_logits / temperature, dim=1)
+    student_log_probabilities = torch.log_softmax(student_logits / temperature, dim=1)
+    # Scaled by T^2 so the gradients keep their size across temperatures
+    return (
+        torch.nn.functional.kl_div(
+            student_log_probabilities, teacher_probabilities, reduction="batchmean"
+        )
+        * temperature**2
+    )
+
+
+def train(student, teacher, loader, epochs, learning_rate, temperature, log):
+    """Fit the student to the teacher's soft labels"""
+    optimizer = torch.optim.AdamW(student.parameters(), lr=learning_rate)
+    scheduler = torch.optim.lr_scheduler.CosineAnnealingLR(
+        optimizer, max(1, epochs * len(loader))
+    )
+    for epoch in range(epochs):
+        student.train()
+        total_loss = 0.0
+        batches = 0
+        start = time.perf_counter()
+        for inputs in loader:
+            if inputs is None:
+                continue
+            with torch.no_grad():
+                teacher_logits = teacher(inputs)
+            loss = distillation_loss(student(inputs), teacher_logits, temperature)
+            optimizer.zero_grad()
+            loss.backward()
+            optimizer.step()
+            scheduler.step()
+            total_loss += loss.item()
+            batches += 1
+        log(
+            "Epoch {}/{}: loss {:.4f} ({:.0f} s)".format(
+                epoch + 1,
+                epochs,
+                total_loss / max(1, batches),
+                time.perf_counter() - start,
+            )
+        )
+    return student.eval()
+
+
+def predict_timed(model, batches):
+    """Predictions as (has_watermark, confidence) and seconds of forward passes"""
+    predictions = []
+    seconds = 0.0
+    with torch.no_grad():
+        # Warm up, so neither model pays for the first pass
+        model(batches[0][:1])
+        for batch in batches:
+            start = time.perf_counter()
+            probabilities = torch.softmax(model(batch), dim=1)
+            seconds += time.perf_counter() - start
+            confidence, predicted = torch.max(probabilities, 1)
+            predictions.extend(zip((predicted == 1).tolist(), confidence.tolist()))
+    return predictions, seconds
+
+
+def evaluate(teacher, student, image_paths, batch_size=BATCH_SIZE):
+    """Compare the student with the teacher on held-out images"""
+    dataset = ImageDataset(image_paths, EVAL_TRANSFORM)
+    readable = []
+    inputs = []
+    for index, image_path in enumerate(image_paths):
+        tensor = dataset[index]
+        if tensor is not None:
+            readable.append(image_path)
+            inputs.append(tensor)
+    if not inputs:
+        raise ValueError(f"None of the {len(image_paths)} held-out images is readable")
+    batches = [
+        torch.stack(inputs[start : start + batch_size])
+        for start in range(0, len(inputs), batch_size)
+    ]
+
+    teacher_predictions, teacher_seconds = predict_timed(teacher, batches)
+    student_predictions, student_seconds = predict_timed(student, batches)
+    return compare(
+        dict(zip(readable, teacher_predictions)),
+        dict(zip(readable, student_predictions)),
+        teacher_seconds,
+        student_seconds,
+    )
+
+
+def save_student(student, path):
+    tmp_path = path + ".tmp"
+    torch.save(student.state_dict(), tmp_path)
+    os.replace(tmp_path, path)
+
+
+def parse_args(argv):
+    parser = argparse.ArgumentParser(
+        description="Distil the watermark detector into a smaller student model."
+    )
+    parser.add_argument(
+        "inputs", nargs="+", help="folders (or zip archives) of unlabeled images"
+    )
+    parser.add_argument(
+        "-o", "--output", default="student.pth", help="student checkpoint to write"
+    )
+    parser.add_argument(
+        "--teacher",
+        default=TEACHER_PATH,
+        help="teacher checkpoint (default: %(default)s)",
+    )
+    parser.add_argument(
+        "--architecture",
+        choices=[name for name in ARCHITECTURES if name != "resnet18"],
+        default=DEFAULT_ARCHITECTURE,
+        help="student network (default: %(default)s)",
+    )
+    parser.add_argument(
+        "--imagenet",
+        action="store_true",
+        help="start MobileNetV3-Small from the torchvision ImageNet weights "
+        "(downloaded once)",
+    )
+    parser.add_argument("--epochs", type=int, default=EPOCHS)
+    parser.add_argument("--batch-size", type=int, default=BATCH_SIZE)
+    parser.add_argument("--learning-rate", type=float, default=LEARNING_RATE)
+    parser.add_argument(
+        "--temperature",
+        type=float,
+        default=TEMPERATURE,
+        help="softening of the teacher probabilities (default: %(default)s)",
+    )
+    parser.add_argument(
+        "--loader-workers",
+        type=int,
+        default=LOADER_WORKERS,
+        help="processes decoding training images (default: %(default)s)",
+    )
+    return parser.parse_args(argv)
+
+
+def main(argv):
+    args = parse_args(argv)
+
+    def log(message):
+        print(message, file=sys.stderr)
+
+    teacher = load_model(args.teacher)
+    image_paths = list_images(args.inputs)
+    if len(image_paths) < HOLDOUT_EVERY:
+        log(f"Found {len(image_paths)} images; distillation needs more")
+        return 1
+    training_paths, holdout_paths = split_holdout(image_paths)
+    log(
+        f"Distilling {architecture_of(teacher.state_dict())} into "
+        f"{args.architecture} on {len(training_paths)} images "
+        f"({len(holdout_paths)} held out)"
+    )
+
+    student = init_student(args.architecture, teacher, args.imagenet)
+    loader = torch.utils.data.DataLoader(
+        ImageDataset(training_paths, TRAIN_TRANSFORM),
+        batch_size=args.batch_size,
+        shuffle=True,
+        num_workers=args.loader_workers,
+        collate_fn=_collate,
+    )
+    student = train(
+        student,
+        teacher,
+        loader,
+        args.epochs,
+        args.learning_rate,
+        args.temperature,
+        log,
+    )
+    save_student(student, args.output)
+
+    try:
+        report = evaluate(teacher, student, holdout_paths, args.batch_size)
+    except ValueError as e:
+        log(f"Saved {args.output} but cannot compare it with the teacher: {e}")
+        return 1
+    images = report["images"]
+    print(
+        "Agreement with the teacher: {:.2%} of {} held-out images".format(
+            1 - report["flip_rate"], images
+        )
+    )
+    print(
+        "Watermark probability delta: {:.4f} max, {:.4f} mean".format(
+            report["max_delta"], report["mean_delta"]
+        )
+    )
+    print(
+        "Throughput: teacher {:.1f} images/s, student {:.1f} images/s "
+        "({:.2f}x)".format(
+            images / report["reference_seconds"],
+            images / report["candidate_seconds"],
+            report["speedup"],
+        )
+    )
+    log(
+        f"Saved {args.output}; run the app with WATERMARK_DETECTOR_MODEL="
+        f"{args.output} to use it"
+    )
+    return 0
+
+
+if __name__ == "__main__":
+    sys.exit(main(sys.argv[1:]))
@@ -0,0 +1,159 @@
+"""Persistent store of image embeddings with nearest-neighbour search.
+
+Embeddings are the 512-d penultimate-layer features of the detector. They
+are L2-normalised and kept as float16 rows of one memory-mapped array file,
+with a JSON list of the image path of each row. Cosine similarity is then a
+plain dot product, computed in vectorized chunks over the memmap.
+"""
+
+import hashlib
+import json
+import os
+
+import numpy as np
+
+DEFAULT_STORE_DIR = os.path.join(
+    os.path.expanduser("~"), ".cache", "watermark_detector", "embeddings"
+)
+EMBEDDING_DIM = 512
+
+# Rows are added in chunks so the data file is not resized for every image
+_GROW_ROWS = 4096
+
+# Rows compared per matrix product during a search
+_SEARCH_CHUNK = 65536
+
+
+def model_fingerprint(model_path):
+    """Identify a model checkpoint by path, size and modification time"""
+    stat = os.stat(model_path)
+    key = "{}|{}|{}".format(os.path.abspath(model_path), stat.st_size, stat.st_mtime_ns)
+    return hashlib.sha1(key.encode("utf-8")).hexdigest()[:16]
+
+
+class EmbeddingStore:
+    """Float16 memory-mapped embeddings keyed by image path"""
+
+    def __init__(self, model_key, store_dir=DEFAULT_STORE_DIR, dim=EMBEDDING_DIM):
+        # Embeddings from different checkpoints are not comparable
+        self.dim = dim
+        self.directory = os.path.join(store_dir, model_key)
+        self.data_path = os.path.join(self.directory, "embeddings.f16")
+        self.index_path = os.path.join(self.directory, "paths.json")
+        os.makedirs(self.directory, exist_ok=True)
+
+        self.paths = []
+        if os.path.exists(self.index_path):
+            try:
+                with open(self.index_path) as f:
+                    self.paths = json.load(f)
+            except (OSError, ValueError):
+                self.paths = []
+        self.rows = {path: row for row, path in enumerate(self.paths)}
+
+        self._data = None
+        self._open(max(len(self.paths), _GROW_ROWS))
+        self._dirty = False
+
+    def __len__(self):
+        return len(self.paths)
+
+    def __contains__(self, path):
+        return path in self.rows
+
+    def _open(self, capacity):
+        """Open (and grow if needed) the memory-mapped data file"""
+        row_bytes = self.dim * 2
+        if self._data is not None:
+            self._data.flush()
+            self._data = None
+
+        # Extend the file without touching existing contents
+        mode = "r+b" if os.path.exists(self.data_path) else "w+b"
+        with open(self.data_path, mode) as f:
+            f.seek(0, os.SEEK_END)
+            if f.tell() < capacity * row_bytes:
+                f.truncate(capacity * row_bytes)
+
+        self.capacity = os.path.getsize(self.data_path) // row_bytes
+        self._data = np.memmap(
+            self.data_path, dtype=np.float16, mode="r+", shape=(self.capacity, self.dim)
+        )
+
+    def add(self, paths, embeddings):
+        """Store a batch of embeddings (an N x dim array) for the given paths"""
+        embeddings = np.asarray(embeddings, dtype=np.float32)
+        norms = np.linalg.norm(embeddings, axis=1, keepdims=True)
+        embeddings = embeddings / np.maximum(norms, 1e-12)
+
+        for path, embedding in zip(paths, embeddings):
+            row = self.rows.get(path)
+            if row is None:
+                row = len(self.paths)
+                if row >= self.capacity:
+                    self._open(self.capacity + _GROW_ROWS)
+                self.paths.append(path)
+                self.rows[path] = row
+            self._data[row] = embedding
+
+        self._dirty = True
+
+    def get(self, path):
+        """Return the stored (normalised) embedding of a path, or None"""
+        row = self.rows.get(path)
+        if row is None:
+            return None
+        return np.array(self._data[row], dtype=np.float32)
+
+    def search(self, query, k=20, min_similarity=0.0):
+        """Find the stored images most similar to a path or an embedding
+
+        Returns a list of (path, similarity) pairs, most similar first. When
+        the query is a stored path, that image itself is left out.
+        """
+        exclude = None
+        if isinstance(query, str):
+            exclude = self.rows.get(query)
+            query = self.get(query)
+            if query is None:
+                return []
+        query = np.asarray(query, dtype=np.float32)
+        query = query / max(np.linalg.norm(query), 1e-12)
+
+        count = len(self.paths)
+        similarities = np.empty(count, dtype=np.float32)
+        for start in range(0, count, _SEARCH_CHUNK):
+            chunk = self._data[start : min(start + _SEARCH_CHUNK, count)]
+            similarities[start : start + len(chunk)] = chunk.astype(np.float32) @ query
+        if exclude is not None:
+            similarities[exclude] = -np.inf
+
+        # Partial sort: only the top k need ordering
+        k = min(k, count)
+        if k <= 0:
+            return []
+        top = np.argpartition(-similarities, k - 1)[:k]
+        top = top[np.argsort(-similarities[top])]
+        return [
+            (self.paths[row], float(similarities[row]))
+            for row in top
+            if similarities[row] >= min_similarity
+        ]
+
+    def flush(self):
+        """Write pending data and the path index to disk"""
+        if self._data is not None:
+            self._data.flush()
+        if not self._dirty:
+            return
+
+        tmp_path = self.index_path + ".tmp"
+        with open(tmp_path, "w") as f:
+            json.dump(self.paths, f)
+        os.replace(tmp_path, self.index_path)
+        self._dirty = False
+
+    def close(self):
+        """Flush and release the memory map"""
+        self.flush()
+        self._data = None
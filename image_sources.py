@@ -0,0 +1,512 @@
+"""Helpers for reading images from plain files and from zip/tar archives.
+
+Archive members are addressed as ``archive.zip!/member.jpg`` so they can flow
+through the rest of the application like ordinary paths. Member bytes are
+streamed into in-memory buffers and never extracted to disk. Listing the
+members of a compressed tar means decompressing all of it, so a tar stays a
+single path until detection reads it, and its members are listed by that
+same pass.
+
+Plain files can be read ahead the same way: on network filesystems every
+open costs a round trip, so several files are read whole, in parallel and
+ahead of decoding, and decoders work from the in-memory buffers.
+"""
+
+import io
+import itertools
+import os
+import queue
+import tarfile
+import threading
+import time
+import zipfile
+from collections import deque
+from concurrent.futures import ThreadPoolExecutor
+
+IMAGE_EXTENSIONS = (
+    ".png",
+    ".jpg",
+    ".jpeg",
+    ".bmp",
+    ".webp",
+    ".gif",
+    ".tif",
+    ".tiff",
+)
+ARCHIVE_EXTENSIONS = (
+    ".zip",
+    ".tar",
+    ".tar.gz",
+    ".tgz",
+    ".tar.bz2",
+    ".tbz2",
+    ".tar.xz",
+    ".txz",
+)
+MEMBER_SEPARATOR = "!/"
+
+# Number of threads reading zip members in parallel
+DEFAULT_ZIP_WORKERS = 4
+
+# Paths buffered between a folder walk and the detection loop
+DEFAULT_WALK_QUEUE_SIZE = 1024
+
+# Bytes read ahead of decoding (and not decoded yet) at most
+DEFAULT_READ_AHEAD_BYTES = 256 * 2**20
+
+
+def is_image_file(name):
+    """Check whether a file or member name has a supported image extension"""
+    return name.lower().endswith(IMAGE_EXTENSIONS)
+
+
+def is_archive(path):
+    """Check whether a path points to a supported archive"""
+    return path.lower().endswith(ARCHIVE_EXTENSIONS)
+
+
+def is_tar_archive(path):
+    """Check whether a path points to a tar archive (compressed or not)"""
+    return is_archive(path) and not path.lower().endswith(".zip")
+
+
+def member_path(archive_path, member_name):
+    """Build the display path for a member inside an archive"""
+    return "{}{}{}".format(archive_path, MEMBER_SEPARATOR, member_name)
+
+
+def split_member_path(path):
+    """Split an archive member path into (archive_path, member_name)
+
+    Plain file paths are returned as (path, None).
+    """
+    archive_path, sep, member_name = path.partition(MEMBER_SEPARATOR)
+    if sep and is_archive(archive_path):
+        return archive_path, member_name
+    return path, None
+
+
+def is_member_path(path):
+    """Check whether a path addresses a member inside an archive"""
+    return split_member_path(path)[1] is not None
+
+
+def is_zip_member(path):
+    """Check whether a path addresses a member inside a zip archive"""
+    archive_path, member_name = split_member_path(path)
+    return member_name is not None and archive_path.lower().endswith(".zip")
+
+
+def display_name(path):
+    """Short name for lists and labels (``archive.zip!/member.jpg`` for members)"""
+    archive_path, member_name = split_member_path(path)
+    if member_name is None:
+        return os.path.basename(path)
+    return member_path(os.path.basename(archive_path), member_name)
+
+
+def list_archive_images(archive_path):
+    """List the image members of an archive as member paths"""
+    if archive_path.lower().endswith(".zip"):
+        with zipfile.ZipFile(archive_path) as zf:
+            names = [info.filename for info in zf.infolist() if not info.is_dir()]
+    else:
+        # Stream mode never seeks, so compressed tars are read in one pass
+        with tarfile.open(archive_path, "r|*") as tf:
+            names = [info.name for info in tf if info.isfile()]
+
+    return [member_path(archive_path, name) for name in names if is_image_file(name)]
+
+
+def expand_paths(paths):
+    """Replace zip archives in a list of paths by their image members
+
+    Tar archives are kept whole; see iter_image_sources.
+    """
+    expanded = []
+    for path in paths:
+        if is_archive(path) and not is_tar_archive(path):
+            expanded.extend(list_archive_images(path))
+        else:
+            expanded.append(path)
+    return expanded
+
+
+def read_zip_member(path):
+    """Read the bytes of a single zip member"""
+    archive_path, member_name = split_member_path(path)
+    with zipfile.ZipFile(archive_path) as zf:
+        return zf.read(member_name)
+
+
+class _ZipReaderPool:
+    """Per-thread zip handles so workers never contend on one file position"""
+
+    def __init__(self):
+        self._local = threading.local()
+        self._handles = []
+        self._lock = threading.Lock()
+
+    def read(self, path):
+        archive_path, member_name = split_member_path(path)
+        handles = getattr(self._local, "handles", None)
+        if handles is None:
+            handles = self._local.handles = {}
+
+        zf = handles.get(archive_path)
+        if zf is None:
+            zf = handles[archive_path] = zipfile.ZipFile(archive_path)
+            with self._lock:
+                self._handles.append(zf)
+
+        return io.BytesIO(zf.read(member_name))
+
+    def close(self):
+        with self._lock:
+            for zf in self._handles:
+                zf.close()
+            self._handles.clear()
+
+
+def _iter_zip_members(paths, workers):
+    """Read zip members on a thread pool, keeping a bounded number in flight"""
+    pool = _ZipReaderPool()
+    pending = deque()
+    paths = iter(paths)
+
+    try:
+        with ThreadPoolExecutor(max_workers=workers) as executor:
+            # Prime the window, then top it up as results are consumed
+            for path in paths:
+                pending.append((path, executor.submit(pool.read, path)))
+                if len(pending) >= workers * 2:
+                    break
+
+            while pending:
+                path, future = pending.popleft()
+                try:
+                    yield path, future.result(), None
+                except Exception as e:
+                    yield path, None, e
+
+                next_path = next(paths, None)
+                if next_path is not None:
+                    pending.append((next_path, executor.submit(pool.read, next_path)))
+    finally:
+        pool.close()
+
+
+class ReadAhead:
+    """Read plain files whole on a thread pool, ahead of decoding
+
+    At most ``workers`` files are read at once, and a read only starts once
+    the file's size fits in ``byte_budget`` next to the bytes of the reads
+    in flight and those read but not yet taken by the decoder. Files larger
+    than the budget are left to the decoder. The bytes and time spent
+    reading are counted for ``mb_per_second``.
+    """
+
+    def __init__(self, workers, byte_budget=DEFAULT_READ_AHEAD_BYTES):
+        self.workers = workers
+        self.byte_budget = byte_budget
+        self.buffered = 0
+        self.bytes_read = 0
+        self.files_read = 0
+        self.first_start = None
+        self.last_end = None
+        self._lock = threading.Lock()
+
+    def reserve(self, size):
+        """Count ``size`` bytes against the budget if they fit
+
+        The first reservation always fits, so a file no larger than the
+        budget is read even when it would not fit next to nothing else.
+        """
+        with self._lock:
+            if self.buffered and self.buffered + size > self.byte_budget:
+                return False
+            self.buffered += size
+            return True
+
+    def read(self, path):
+        """Bytes of a file, or None if it is too large to read ahead"""
+        start = time.perf_counter()
+        with open(path, "rb", buffering=0) as f:
+            if os.fstat(f.fileno()).st_size > self.byte_budget:
+                return None
+            if hasattr(os, "posix_fadvise"):
+                # Let the kernel read ahead in large requests
+                os.posix_fadvise(f.fileno(), 0, 0, os.POSIX_FADV_SEQUENTIAL)
+            # One pass of large reads sized from the file size
+            data = f.readall()
+
+        end = time.perf_counter()
+        with self._lock:
+            self.bytes_read += len(data)
+            self.files_read += 1
+            if self.first_start is None:
+                self.first_start = start
+            self.last_end = end
+        return data
+
+    def release(self, size):
+        """Return reserved bytes once the decoder has taken them"""
+        with self._lock:
+            self.buffered -= size
+
+    @property
+    def mb_per_second(self):
+        """Effective read throughput from the first read to the last"""
+        if self.first_start is None or self.last_end <= self.first_start:
+            return 0.0
+        return self.bytes_read / 2**20 / (self.last_end - self.first_start)
+
+
+def _file_size(path):
+    try:
+        return os.stat(path).st_size
+    except OSError:
+        # The read reports the error
+        return 0
+
+
+def _iter_read_ahead(paths, read_ahead):
+    """Read plain files ahead of decoding, yielding them in order"""
+    pending = deque()
+    waiting = []
+    paths = iter(paths)
+
+    with ThreadPoolExecutor(max_workers=read_ahead.workers) as executor:
+
+        def fill():
+            # Keep every reader busy and one round queued, within the budget
+            while len(pending) < read_ahead.workers * 2:
+                if waiting:
+                    path, size = waiting.pop()
+                else:
+                    path = next(paths, None)
+                    if path is None:
+                        return
+                    size = _file_size(path)
+                if size > read_ahead.byte_budget:
+                    pending.append((path, None, 0))
+                elif read_ahead.reserve(size):
+                    future = executor.submit(read_ahead.read, path)
+                    pending.append((path, future, size))
+                else:
+                    waiting.append((path, size))
+                    return
+
+        try:
+            fill()
+            while pending:
+                path, future, size = pending.popleft()
+                if future is None:
+                    yield path, path, None
+                    fill()
+                    continue
+                try:
+                    data = future.result()
+                except Exception as e:
+                    read_ahead.release(size)
+                    yield path, None, e
+                else:
+                    read_ahead.release(size)
+                    if data is None:
+                        yield path, path, None
+                    else:
+                        yield path, io.BytesIO(data), None
+                fill()
+        finally:
+            # Reads abandoned by a consumer that stopped early
+            for _, future, size in pending:
+                if future is not None:
+                    future.cancel()
+                read_ahead.release(size)
+
+
+def _iter_tar_members(archive_path, paths):
+    """Read the requested members of a tar in a single sequential pass
+
+    The archive path itself requests every image member, which is yielded
+    under its member path as the pass comes across it.
+    """
+    whole = archive_path in paths
+    wanted = {
+        split_member_path(path)[1]: path for path in paths if path != archive_path
+    }
+    listed = 0
+
+    try:
+        with tarfile.open(archive_path, "r|*") as tf:
+            for info in tf:
+                path = wanted.pop(info.name, None)
+                if path is None and whole and info.isfile():
+                    if is_image_file(info.name):
+                        path = member_path(archive_path, info.name)
+                        listed += 1
+                if path is None:
+                    continue
+                try:
+                    yield path, io.BytesIO(tf.extractfile(info).read()), None
+                except Exception as e:
+                    yield path, None, e
+                if not wanted and not whole:
+                    break
+    except Exception as e:
+        # An unreadable or cut-off archive is reported as a whole
+        if whole:
+            yield archive_path, None, e
+        for path in wanted.values():
+            yield path, None, e
+        return
+
+    if whole and not listed:
+        yield archive_path, None, ValueError("No images found in archive")
+    # Anything left was not found in the archive
+    for path in wanted.values():
+        yield path, None, KeyError("Member not found in archive")
+
+
+def _source_kind(path):
+    """Grouping key: plain files, zip members, or members of one tar archive"""
+    archive_path, member_name = split_member_path(path)
+    if member_name is None:
+        return ("tar", path) if is_tar_archive(path) else ("file", None)
+    if archive_path.lower().endswith(".zip"):
+        return ("zip", None)
+    return ("tar", archive_path)
+
+
+def iter_image_sources(paths, zip_workers=DEFAULT_ZIP_WORKERS, read_ahead=None):
+    """Yield (path, source, error) for each path, ready for ``Image.open``
+
+    ``source`` is the file path for plain files and an in-memory buffer for
+    archive members. ``paths`` may be any iterable and is consumed lazily.
+    Consecutive zip members are read in parallel, and consecutive members of
+    the same tar are read together in one sequential pass over the archive.
+    A tar archive path yields all its image members, listed by that pass.
+    With a ``read_ahead``, plain files are read into buffers by it as well.
+    """
+    for (kind, archive_path), group in itertools.groupby(paths, key=_source_kind):
+        if kind == "file" and read_ahead is not None:
+            yield from _iter_read_ahead(group, read_ahead)
+        elif kind == "file":
+            for path in group:
+                yield path, path, None
+        elif kind == "zip":
+            yield from _iter_zip_members(group, zip_workers)
+        else:
+            yield from _iter_tar_members(archive_path, list(group))
+
+
+def _iter_entry_images(path, list_tars=False):
+    """Yield the image (or archive members) found at a single file path"""
+    if is_image_file(path):
+        yield path
+    elif is_tar_archive(path) and not list_tars:
+        # Listed by the detection pass that reads it
+        yield path
+    elif is_archive(path):
+        try:
+            yield from list_archive_images(path)
+        except Exception:
+            # Let detection report the unreadable archive
+            yield path
+
+
+def iter_folder_images(root, list_tars=False):
+    """Lazily walk a folder tree and yield image files and archive members
+
+    Directories are read with ``os.scandir`` one at a time, so nothing
+    proportional to the size of the whole tree is kept in memory. A root
+    that is a plain file is yielded as is. Tar archives are yielded whole
+    unless ``list_tars``, which reads each one through to list its members.
+    """
+    if not os.path.isdir(root):
+        yield from _iter_entry_images(root, list_tars)
+        return
+
+    pending_dirs = [root]
+    while pending_dirs:
+        directory = pending_dirs.pop()
+        try:
+            entries = os.scandir(directory)
+        except OSError:
+            continue
+
+        with entries:
+            for entry in entries:
+                try:
+                    if entry.is_dir(follow_symlinks=False):
+                        pending_dirs.append(entry.path)
+                    elif entry.is_file():
+                        yield from _iter_entry_images(entry.path, list_tars)
+                except OSError:
+                    continue
+
+
+class FolderWalker:
+    """Enumerate images under folders (or files) on a background thread
+
+    Iterating the walker yields paths as soon as they are found, so
+    detection can start while the walk continues. The queue in between is
+    bounded, which keeps memory flat for arbitrarily large trees. With a
+    ``select(path, root)`` function, such as a sharding.ShardPartition,
+    only the paths it accepts are yielded.
+    """
+
+    _DONE = object()
+
+    def __init__(self, roots, maxsize=DEFAULT_WALK_QUEUE_SIZE, select=None):
+        self.roots = list(roots)
+        self.select = select
+        self.found = 0
+        self._queue = queue.Queue(maxsize)
+        self._stopped = threading.Event()
+        self._thread = threading.Thread(target=self._walk, daemon=True)
+        self._thread.start()
+
+    @property
+    def queued(self):
+        """Paths found but not taken yet"""
+        return self._queue.qsize()
+
+    def _put(self, item):
+        """Block until there is room in the queue or the walk is stopped"""
+        while not self._stopped.is_set():
+            try:
+                self._queue.put(item, timeout=0.1)
+                return True
+            except queue.Full:
+                continue
+        return False
+
+    def _walk(self):
+        try:
+            for root in self.roots:
+                for path in iter_folder_images(root):
+                    if self.select is not None and not self.select(path, root):
+                        continue
+                    if not self._put(path):
+                        return
+                    self.found += 1
+        finally:
+            self._put(self._DONE)
+
+    def __iter__(self):
+        while True:
+            try:
+                item = self._queue.get(timeout=0.1)
+            except queue.Empty:
+                if self._stopped.is_set():
+                    return
+                continue
+            if item is self._DONE:
+                return
+            yield item
+
+    def stop(self):
+        """Stop the walk and release the background thread"""
+        self._stopped.set()
+        self._thread.join()
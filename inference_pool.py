@@ -0,0 +1,395 @@
+"""Process-pool inference for large detection jobs.
+
+Each worker process holds the detector model. Forked workers share the
+parent's weight pages; spawned workers get the weights through shared
+memory, so all processes read one copy of them. Workers take batches of
+images from their task queue, decode, preprocess and classify them, and
+send results back as soon as a batch is done, in whatever order the
+batches finish. Intra-op threads are split between the workers so that
+together they use about one thread per core.
+
+Each worker warms the model up at the batch size before taking its first
+batch, while the producer is still decoding it.
+
+A worker that dies, or runs longer on a batch than the inference budget
+allows, is stopped and replaced. Only the batch it was running fails; the
+batches queued behind it go to the replacement.
+"""
+
+import collections
+import functools
+import io
+import os
+import sys
+import time
+from multiprocessing import connection
+
+import numpy as np
+import torch
+import torch.multiprocessing as mp
+
+from batch_preprocess import preprocess_batch
+from large_images import DEFAULT_MEMORY_LIMIT, ImageTooLarge, load_rgb, open_image
+from multiframe import FRAME_BUDGET, classify_frames, is_multiframe
+from warmup import warm_up
+
+# Batches queued or running per worker before the producer waits
+BATCHES_PER_WORKER = 2
+
+# Seconds of inference each image of a batch may take before its worker is
+# stopped (used with the decode watchdog, see decoder_pool)
+INFERENCE_TIMEOUT = 10.0
+
+# Result of one batch. Embeddings and inputs only have rows for the images
+# that went through the batched forward pass, listed in batched_paths.
+# Animated and multi-page images are classified on their own and have none.
+BatchResult = collections.namedtuple(
+    "BatchResult",
+    "image_paths predictions decode_times inference_ms embeddings inputs "
+    "batched_paths",
+)
+
+
+def threads_per_worker(workers):
+    """Intra-op threads for each of ``workers`` processes sharing the cores"""
+    return max(1, (os.cpu_count() or 1) // workers)
+
+
+def _start_method():
+    # Forked workers inherit the loaded model without pickling it. macOS and
+    # Windows have to spawn, and receive the shared weights through pickling.
+    return "fork" if sys.platform.startswith("linux") else "spawn"
+
+
+def _predict(model, inputs):
+    """(has_watermark, confidence) pairs for a batch of inputs"""
+    with torch.no_grad():
+        probabilities = torch.nn.functional.softmax(model(inputs), dim=1)
+        confidence, predicted = torch.max(probabilities, 1)
+    return [
+        (label == 1, confidence_value)
+        for label, confidence_value in zip(predicted.tolist(), confidence.tolist())
+    ]
+
+
+def decode_payload(predict, payload, options):
+    """Decode a file path or archived image bytes into a model input
+
+    Animated and multi-page images are classified right away, frame by
+    frame, with ``predict``, and their (has_watermark, confidence)
+    prediction is returned as a tuple instead.
+    """
+    transform, fast_preprocess, _, _, (stride, budget), memory_limit = options
+    source = io.BytesIO(payload) if isinstance(payload, bytes) else payload
+    with open_image(source) as image:
+        if is_multiframe(image):
+            result = classify_frames(
+                image,
+                predict,
+                transform,
+                stride,
+                budget,
+                memory_limit=memory_limit,
+            )
+            return result.has_watermark, result.confidence
+        if fast_preprocess:
+            return np.asarray(load_rgb(image, memory_limit))
+        return transform(load_rgb(image, memory_limit))
+
+
+def _run_batch(model, backbone, task, options):
+    """Decode (unless given inputs) and classify one batch"""
+    transform, fast_preprocess, with_embeddings, return_inputs, _, _ = options
+    _, image_paths, payloads, inputs = task
+    predictions = [None] * len(image_paths)
+    decode_times = [0.0] * len(image_paths)
+    ok_rows = list(range(len(image_paths)))
+
+    if inputs is None:
+        predict = functools.partial(_predict, model)
+        decoded = []
+        ok_rows = []
+        for row, payload in enumerate(payloads):
+            decode_start = time.perf_counter()
+            try:
+                image_input = decode_payload(predict, payload, options)
+                if isinstance(image_input, tuple):
+                    predictions[row] = image_input
+                else:
+                    decoded.append(image_input)
+                    ok_rows.append(row)
+            except ImageTooLarge as e:
+                # Sent back as is, so the image is reported as skipped
+                predictions[row] = e
+            except Exception as e:
+                predictions[row] = RuntimeError(str(e))
+            decode_times[row] = (time.perf_counter() - decode_start) * 1000
+
+    batch_start = time.perf_counter()
+    embeddings = None
+    try:
+        if ok_rows:
+            if inputs is None and fast_preprocess:
+                inputs = preprocess_batch(decoded)
+            elif inputs is None:
+                inputs = torch.stack(decoded)
+
+            with torch.no_grad():
+                features = torch.flatten(backbone(inputs), 1)
+                probabilities = torch.nn.functional.softmax(model.fc(features), dim=1)
+                confidence, predicted = torch.max(probabilities, 1)
+
+            # 1 = Watermark, 0 = No Watermark
+            for row, label, confidence_value in zip(
+                ok_rows, predicted.tolist(), confidence.tolist()
+            ):
+                predictions[row] = (label == 1, confidence_value)
+            if with_embeddings:
+                embeddings = features.numpy()
+    except Exception as e:
+        for row in ok_rows:
+            predictions[row] = RuntimeError(str(e))
+        embeddings = None
+        inputs = None
+        ok_rows = []
+
+    inference_ms = (time.perf_counter() - batch_start) * 1000 / len(image_paths)
+    if not (return_inputs and payloads is not None):
+        inputs = None
+    batched_paths = [image_paths[row] for row in ok_rows]
+    return BatchResult(
+        image_paths,
+        predictions,
+        decode_times,
+        inference_ms,
+        embeddings,
+        inputs,
+        batched_paths,
+    )
+
+
+def _worker_main(model, options, num_threads, batch_size, task_queue, result_conn):
+    """Worker process loop: run batches until a None task arrives"""
+    torch.set_num_threads(num_threads)
+    if batch_size:
+        warm_up(model, [batch_size])
+    # Everything up to the pooled 512-d features (shares weights with the model)
+    backbone = torch.nn.Sequential(*list(model.children())[:-1])
+
+    while True:
+        task = task_queue.get()
+        if task is None:
+            break
+        result_conn.send((task[0], _run_batch(model, backbone, task, options)))
+
+
+class _Worker:
+    """A worker process, its task queue and the batches sent to it"""
+
+    def __init__(self, process, task_queue, results):
+        self.process = process
+        self.task_queue = task_queue
+        # Worker end of the result pipe; each worker has its own, so a
+        # stopped worker cannot leave a shared queue half written
+        self.results = results
+        # Ids of the batches sent to this worker, the running one first
+        self.batch_ids = collections.deque()
+        # When the running batch started (as far as the producer can tell)
+        self.started = None
+
+
+class InferencePool:
+    """Worker processes running the detector on batches of images
+
+    The producer calls ``submit`` while ``in_flight < max_in_flight`` and
+    otherwise collects a result with ``next_result``, so the work queue
+    stays bounded. With an ``inference_timeout``, a batch may run for that
+    many seconds per image before its worker is stopped; that batch comes
+    back as errors and the worker is replaced, as it is when a worker dies.
+    """
+
+    def __init__(
+        self,
+        model,
+        transform,
+        workers,
+        fast_preprocess=False,
+        with_embeddings=False,
+        return_inputs=False,
+        frame_sampling=(None, FRAME_BUDGET),
+        image_memory_limit=DEFAULT_MEMORY_LIMIT,
+        inference_timeout=None,
+        batch_size=None,
+        threads=None,
+    ):
+        self.max_in_flight = workers * BATCHES_PER_WORKER
+        # Intra-op threads of each worker (None: split the cores evenly)
+        self.threads_per_worker = threads or threads_per_worker(workers)
+        self.inference_timeout = inference_timeout
+        # Shape each worker warms up at (None: no warm-up)
+        self.batch_size = batch_size
+
+        # Forked workers share the parent's (memory-mapped) weight pages as
+        # they are; spawned workers receive them through shared memory
+        start_method = _start_method()
+        if start_method == "spawn":
+            model.share_memory()
+
+        self.model = model
+        self.context = mp.get_context(start_method)
+        self.options = (
+            transform,
+            fast_preprocess,
+            with_embeddings,
+            return_inputs,
+            frame_sampling,
+            image_memory_limit,
+        )
+        self.workers = [self._start_worker() for _ in range(workers)]
+
+        # Tasks (and decode times given by the producer) of submitted
+        # batches, by batch id
+        self.outstanding = {}
+        self.failed = collections.deque()
+        self.next_batch_id = 0
+
+    def _start_worker(self):
+        task_queue = self.context.Queue()
+        results, result_conn = self.context.Pipe(duplex=False)
+        process = self.context.Process(
+            target=_worker_main,
+            args=(
+                self.model,
+                self.options,
+                self.threads_per_worker,
+                self.batch_size,
+                task_queue,
+                result_conn,
+            ),
+            daemon=True,
+        )
+        process.start()
+        # Only the worker holds the sending end, so its exit reads as EOF
+        result_conn.close()
+        return _Worker(process, task_queue, results)
+
+    @property
+    def in_flight(self):
+        """Batches submitted whose results have not been collected yet"""
+        return len(self.outstanding) + len(self.failed)
+
+    def submit(self, image_paths, payloads=None, inputs=None, decode_times=None):
+        """Queue a batch given as file paths / archived bytes or as inputs
+
+        ``decode_times`` replaces the (zero) decode times of a batch of
+        inputs decoded by the producer.
+        """
+        batch_id = self.next_batch_id
+        self.next_batch_id += 1
+        task = (batch_id, image_paths, payloads, inputs)
+        self.outstanding[batch_id] = task, decode_times
+        self._send(min(self.workers, key=lambda w: len(w.batch_ids)), task)
+
+    def _send(self, worker, task):
+        if not worker.batch_ids:
+            worker.started = time.perf_counter()
+        worker.batch_ids.append(task[0])
+        worker.task_queue.put(task)
+
+    def next_result(self):
+        """Wait for and return the BatchResult of any finished batch"""
+        while not self.failed:
+            ready = connection.wait(
+                [worker.results for worker in self.workers], self._time_left()
+            )
+            for worker in self.workers:
+                if worker.results not in ready:
+                    continue
+                try:
+                    batch_id, result = worker.results.recv()
+                except (EOFError, OSError):
+                    self._replace(worker, "Worker process exited unexpectedly")
+                    break
+
+                # The next queued batch starts now
+                worker.batch_ids.popleft()
+                worker.started = time.perf_counter()
+                _, decode_times = self.outstanding.pop(batch_id)
+                if decode_times is not None:
+                    result = result._replace(decode_times=decode_times)
+                return result
+            else:
+                self._stop_overdue()
+        return self.failed.popleft()
+
+    def _deadline(self, worker):
+        """When the worker's running batch runs out of time, or None"""
+        if self.inference_timeout is None or not worker.batch_ids:
+            return None
+        (_, image_paths, _, _), _ = self.outstanding[worker.batch_ids[0]]
+        return worker.started + self.inference_timeout * len(image_paths)
+
+    def _time_left(self):
+        """Seconds until the next batch deadline (None: no deadline)"""
+        deadlines = [self._deadline(worker) for worker in self.workers]
+        deadlines = [deadline for deadline in deadlines if deadline is not None]
+        if not deadlines:
+            return None
+        return max(0.0, min(deadlines) - time.perf_counter())
+
+    def _stop_overdue(self):
+        """Replace the workers whose running batch is past its deadline"""
+        now = time.perf_counter()
+        for worker in list(self.workers):
+            deadline = self._deadline(worker)
+            # A result sent just now still counts
+            if deadline is not None and now >= deadline and not worker.results.poll():
+                self._replace(
+                    worker,
+                    "Inference timed out after {:.0f} s".format(self.inference_timeout),
+                )
+
+    def _replace(self, worker, error_message):
+        """Stop a worker, fail its running batch and requeue the rest"""
+        worker.process.kill()
+        worker.process.join()
+        worker.results.close()
+        worker.task_queue.cancel_join_thread()
+
+        replacement = self._start_worker()
+        self.workers[self.workers.index(worker)] = replacement
+        if not worker.batch_ids:
+            return
+
+        (_, image_paths, _, _), _ = self.outstanding.pop(worker.batch_ids.popleft())
+        self.failed.append(self._failed_result(image_paths, error_message))
+        for batch_id in worker.batch_ids:
+            task, _ = self.outstanding[batch_id]
+            self._send(replacement, task)
+
+    def _failed_result(self, image_paths, error_message):
+        error = RuntimeError(error_message)
+        count = len(image_paths)
+        return BatchResult(
+            image_paths, [error] * count, [None] * count, None, None, None, []
+        )
+
+    def terminate(self):
+        for worker in self.workers:
+            if worker.process.is_alive():
+                worker.process.terminate()
+        for worker in self.workers:
+            worker.process.join()
+
+    def close(self):
+        """Stop the workers once they have finished their current batches"""
+        for worker in self.workers:
+            worker.task_queue.put(None)
+        for worker in self.workers:
+            worker.process.join(timeout=10)
+        self.terminate()
+
+        # Do not wait at exit for data nobody will read
+        for worker in self.workers:
+            worker.task_queue.cancel_join_thread()
+            worker.results.close()
@@ -0,0 +1,132 @@
+"""Priority queue of detection work shared by all jobs.
+
+Jobs add image paths (a list, or a lazy iterable such as a folder walk) at
+a priority, and the detection thread takes them a batch at a time, always
+from the best priority available. Pending images can be promoted while the
+queue runs, e.g. when they scroll into view or are clicked, so they jump
+ahead of a long background scan at the next batch boundary. A path that is
+still waiting is never queued twice. Nothing is kept of the paths already
+taken, so memory stays flat however large the scanned trees are.
+"""
+
+import heapq
+import itertools
+import threading
+
+# Lower values are served first
+PRIORITY_INTERACTIVE = 0
+PRIORITY_VISIBLE = 1
+PRIORITY_NORMAL = 2
+PRIORITY_BACKGROUND = 3
+
+
+class JobQueue:
+    """Thread-safe queue of image paths ordered by priority
+
+    Any thread may add jobs and promote paths; only the detection thread
+    calls ``take``. A session runs from the first job to the moment
+    ``take`` finds nothing left, at which point the queue becomes idle and
+    ``add_job`` reports that a new consumer has to be started.
+    """
+
+    def __init__(self):
+        self.lock = threading.Lock()
+        self.counter = itertools.count()
+        # Entries are (priority, sequence, path); promoted paths leave a
+        # stale entry behind, skipped when it reaches the top
+        self.heap = []
+        self.pending = {}
+        # Lazy jobs as (priority, sequence, iterator), read on demand
+        self.sources = []
+        self.queued_count = 0
+        self.active = False
+
+    @property
+    def total(self):
+        """Images queued this session, or 0 while lazy jobs are still read"""
+        with self.lock:
+            return 0 if self.sources else self.queued_count
+
+    @property
+    def depth(self):
+        """Paths waiting to be taken (lazy jobs count once read)"""
+        return len(self.pending)
+
+    def add_job(self, paths, priority=PRIORITY_NORMAL):
+        """Queue a list or lazy iterable of paths
+
+        Returns True if the queue was idle, meaning no thread is consuming
+        it and one has to be started.
+        """
+        with self.lock:
+            if isinstance(paths, (list, tuple)):
+                for path in paths:
+                    self._push(path, priority)
+            else:
+                self.sources.append((priority, next(self.counter), iter(paths)))
+
+            was_idle = not self.active
+            self.active = True
+            return was_idle
+
+    def promote(self, paths, priority):
+        """Move pending paths up to a better priority"""
+        with self.lock:
+            for path in paths:
+                current = self.pending.get(path)
+                if current is not None and priority < current:
+                    self.pending[path] = priority
+                    heapq.heappush(self.heap, (priority, next(self.counter), path))
+
+    def _push(self, path, priority):
+        current = self.pending.get(path)
+        if current is not None and current <= priority:
+            return
+        if current is None:
+            self.queued_count += 1
+        self.pending[path] = priority
+        heapq.heappush(self.heap, (priority, next(self.counter), path))
+
+    def _fill(self, count):
+        """Read more paths from the best lazy job if it outranks the heap"""
+        with self.lock:
+            if not self.sources:
+                return
+            source = min(self.sources)
+            if self.heap and self.heap[0][0] <= source[0]:
+                return
+
+        # Reading may block on a folder walk, so it happens outside the lock
+        paths = list(itertools.islice(source[2], count))
+
+        with self.lock:
+            if len(paths) < count:
+                self.sources.remove(source)
+            for path in paths:
+                self._push(path, source[0])
+
+    def take(self, count):
+        """Remove up to count paths of the best priority available
+
+        Returns an empty list once every job is exhausted; the queue is
+        then idle and the session's count is reset.
+        """
+        while True:
+            self._fill(count)
+            with self.lock:
+                batch = []
+                while self.heap and len(batch) < count:
+                    priority, _, path = heapq.heappop(self.heap)
+                    if self.pending.get(path) != priority:
+                        continue
+                    del self.pending[path]
+                    batch.append(path)
+
+                if batch:
+                    return batch
+
+                if not self.sources:
+                    self.active = False
+                    self.queued_count = 0
+                    return []
+            # Only stale entries were left; read on from the lazy jobs
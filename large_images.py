@@ -0,0 +1,394 @@
+"""Bounded-memory decoding of very large images.
+
+Image headers are read before any pixels. Images whose full decode fits
+under a memory ceiling are converted to RGB as usual. Larger ones are
+reduced while they are read, so the full-resolution image never exists in
+memory:
+
+* JPEG files are decoded at a smaller scale with DCT scaling (``draft``).
+* Non-interlaced 8-bit PNG files are decoded in bands of rows. The zlib
+  stream is inflated incrementally and each band of filtered scanlines is
+  wrapped in a small PNG of its own, led by the last row of the previous
+  band so that the row filters see the same data as in the original file.
+* TIFF files are decoded one strip or tile at a time. Each block is wrapped
+  in a single-block TIFF carrying the tags of the original.
+
+Each band is box-filtered by an integer factor as soon as it is decoded, to
+an image at least twice the model's input size. Anything else that does
+not fit raises ImageTooLarge, whose message is meant for the user.
+"""
+
+import contextlib
+import io
+import itertools
+import math
+import struct
+import threading
+import zlib
+
+from PIL import Image, TiffImagePlugin, TiffTags
+
+# Memory a single image may take while it is decoded
+DEFAULT_MEMORY_LIMIT = 512 * 2**20
+
+# Shorter side of reduced images; the model input is 224 px
+REDUCED_SIZE = 448
+
+# Pillow's decompression-bomb check would refuse large images before their
+# header is even looked at. It is lifted while images bound for load_rgb,
+# which enforces the memory ceiling instead, are opened, and kept elsewhere.
+_bomb_check_lock = threading.Lock()
+_bomb_check_lifts = 0
+_max_image_pixels = None
+
+_PNG_SIGNATURE = b"\x89PNG\r\n\x1a\n"
+
+# Samples per pixel of 8-bit PNG color types
+_PNG_CHANNELS = {0: 1, 2: 3, 3: 1, 4: 2, 6: 4}
+
+# Compressed bytes read from a PNG at a time
+_PNG_READ_SIZE = 2**20
+
+# TIFF tags describing the pixel layout, copied into each single-block TIFF
+_TIFF_BLOCK_TAGS = (
+    258,  # BitsPerSample
+    259,  # Compression
+    262,  # PhotometricInterpretation
+    266,  # FillOrder
+    277,  # SamplesPerPixel
+    284,  # PlanarConfiguration
+    317,  # Predictor
+    320,  # ColorMap
+    338,  # ExtraSamples
+    339,  # SampleFormat
+    347,  # JPEGTables
+    529,  # YCbCrCoefficients
+    530,  # YCbCrSubSampling
+    532,  # ReferenceBlackWhite
+)
+
+
+class ImageTooLarge(Exception):
+    """An image that cannot be decoded under the memory ceiling"""
+
+
+@contextlib.contextmanager
+def _bomb_check_lifted():
+    """Lift Pillow's decompression-bomb check, restoring it when the last
+    thread inside leaves"""
+    global _bomb_check_lifts, _max_image_pixels
+    with _bomb_check_lock:
+        if not _bomb_check_lifts:
+            _max_image_pixels = Image.MAX_IMAGE_PIXELS
+            Image.MAX_IMAGE_PIXELS = None
+        _bomb_check_lifts += 1
+    try:
+        yield
+    finally:
+        with _bomb_check_lock:
+            _bomb_check_lifts -= 1
+            if not _bomb_check_lifts:
+                Image.MAX_IMAGE_PIXELS = _max_image_pixels
+
+
+def open_image(source):
+    """Open an image to be decoded by load_rgb, however many pixels it has
+
+    Only the header is read here, and load_rgb keeps the decode under its
+    memory ceiling, so Pillow's pixel-count check is skipped for this open.
+    """
+    with _bomb_check_lifted():
+        return Image.open(source)
+
+
+def decoded_bytes(image):
+    """Memory needed to decode an image whole and convert it to RGB"""
+    width, height = image.size
+    # Pillow stores RGB pixels in 4 bytes; other modes need a converted copy
+    return width * height * (4 if image.mode == "RGB" else 8)
+
+
+def _describe(image, memory_limit):
+    return "{}x{} image needs {:.0f} MB to decode (limit {:.0f} MB)".format(
+        image.size[0],
+        image.size[1],
+        decoded_bytes(image) / 2**20,
+        memory_limit / 2**20,
+    )
+
+
+def reduction_factor(size, reduced_size=REDUCED_SIZE):
+    """Integer factor that brings the shorter side down to about reduced_size"""
+    return max(1, min(size) // reduced_size)
+
+
+class _Reducer:
+    """Box-filters consecutive bands of rows into a reduced image"""
+
+    def __init__(self, size, factor):
+        self.factor = factor
+        self.image = Image.new(
+            "RGB", (math.ceil(size[0] / factor), math.ceil(size[1] / factor))
+        )
+        self.pending = None
+        self.y = 0
+
+    def add(self, band):
+        """Add the next rows, reducing every complete group of factor rows"""
+        if self.pending is not None:
+            joined = Image.new("RGB", (band.width, self.pending.height + band.height))
+            joined.paste(self.pending)
+            joined.paste(band, (0, self.pending.height))
+            band = joined
+
+        complete = band.height - band.height % self.factor
+        if complete:
+            self._paste(band.crop((0, 0, band.width, complete)))
+        self.pending = (
+            band.crop((0, complete, band.width, band.height))
+            if complete < band.height
+            else None
+        )
+
+    def _paste(self, band):
+        reduced = band.reduce(self.factor)
+        self.image.paste(reduced, (0, self.y))
+        self.y += reduced.height
+
+    def finish(self):
+        """Reduce the remaining rows and return the reduced image"""
+        if self.pending is not None:
+            self._paste(self.pending)
+            self.pending = None
+        return self.image
+
+
+def _png_chunk(chunk_type, data):
+    crc = zlib.crc32(chunk_type + data)
+    return struct.pack(">I", len(data)) + chunk_type + data + struct.pack(">I", crc)
+
+
+def _png_header(fp):
+    """Return the chunks before the image data and the offset of the first IDAT"""
+    fp.seek(len(_PNG_SIGNATURE))
+    chunks = []
+    while True:
+        header = fp.read(8)
+        if len(header) < 8:
+            raise EOFError("PNG file has no image data")
+        length, chunk_type = struct.unpack(">I4s", header)
+        if chunk_type == b"IDAT":
+            return chunks, fp.tell() - 8
+        chunks.append((chunk_type, fp.read(length)))
+        # Skip the CRC
+        fp.read(4)
+
+
+def _inflate_png(fp, offset):
+    """Yield the inflated scanlines of consecutive IDAT chunks in pieces"""
+    decompressor = zlib.decompressobj()
+    fp.seek(offset)
+    while True:
+        header = fp.read(8)
+        if len(header) < 8:
+            return
+        length, chunk_type = struct.unpack(">I4s", header)
+        if chunk_type != b"IDAT":
+            return
+
+        remaining = length
+        while remaining:
+            data = fp.read(min(remaining, _PNG_READ_SIZE))
+            if not data:
+                raise EOFError("PNG image data is truncated")
+            remaining -= len(data)
+            # Inflate in bounded pieces, whatever the compression ratio
+            while data:
+                yield decompressor.decompress(data, _PNG_READ_SIZE)
+                data = decompressor.unconsumed_tail
+        fp.read(4)
+
+
+def _load_png_bands(image, memory_limit):
+    """Decode a PNG band by band into a reduced RGB image"""
+    chunks, idat_offset = _png_header(image.fp)
+    width, height, bit_depth, color_type, _, _, interlace = struct.unpack(
+        ">IIBBBBB", chunks[0][1]
+    )
+    if bit_depth != 8 or interlace or color_type not in _PNG_CHANNELS:
+        raise ImageTooLarge(
+            _describe(image, memory_limit)
+            + "; only 8-bit non-interlaced PNGs can be read in bands"
+        )
+
+    # A band is held as filtered scanlines, copied a few times to wrap it
+    # in a PNG, then decoded, cropped, converted to RGB and joined with the
+    # rows left over from the previous band (4 bytes per pixel each)
+    factor = reduction_factor(image.size)
+    pixel_bytes = _PNG_CHANNELS[color_type] * 5 + 16
+    band_rows = memory_limit // (width * pixel_bytes) // factor * factor
+    if band_rows == 0:
+        raise ImageTooLarge(_describe(image, memory_limit))
+
+    row_bytes = width * _PNG_CHANNELS[color_type] + 1
+    # Palette, transparency and the other chunks before the image data
+    ancillary = b"".join(_png_chunk(t, data) for t, data in chunks[1:])
+    reducer = _Reducer(image.size, factor)
+    previous_row = b""
+
+    def decode_band(scanlines):
+        """Decode whole filtered scanlines, led by the previous band's last row"""
+        nonlocal previous_row
+        lead = 1 if previous_row else 0
+        rows = len(scanlines) // row_bytes
+        ihdr = struct.pack(">IIBBBBB", width, rows + lead, 8, color_type, 0, 0, 0)
+        data = (
+            _PNG_SIGNATURE
+            + _png_chunk(b"IHDR", ihdr)
+            + ancillary
+            # Stored without compression: it is only read back once
+            + _png_chunk(b"IDAT", zlib.compress(previous_row + scanlines, 0))
+            + _png_chunk(b"IEND", b"")
+        )
+        with _bomb_check_lifted():
+            band = Image.open(io.BytesIO(data))
+        with band:
+            band.load()
+            # Unfiltered samples of the last row, with filter type None
+            previous_row = (
+                b"\x00" + band.crop((0, band.height - 1, width, band.height)).tobytes()
+            )
+            reducer.add(band.crop((0, lead, width, band.height)).convert("RGB"))
+
+    pending = bytearray()
+    rows_left = height
+    band_bytes = band_rows * row_bytes
+    for data in _inflate_png(image.fp, idat_offset):
+        pending += data
+        while len(pending) >= band_bytes and rows_left:
+            decode_band(bytes(pending[:band_bytes]))
+            del pending[:band_bytes]
+            rows_left -= band_rows
+
+    rows = min(rows_left, len(pending) // row_bytes)
+    if rows:
+        decode_band(bytes(pending[: rows * row_bytes]))
+        rows_left -= rows
+    if rows_left:
+        raise EOFError("PNG image data is truncated")
+    return reducer.finish()
+
+
+def _tiff_band(tags, blocks, width, height, block_size, tiled):
+    """Decode one band of strips or tiles, wrapped in a TIFF of its own"""
+    if tags.prefix == b"MM":
+        header = b"MM\x00*\x00\x00\x00\x08"
+    else:
+        header = b"II*\x00\x08\x00\x00\x00"
+
+    ifd = TiffImagePlugin.ImageFileDirectory_v2(header)
+    for tag in _TIFF_BLOCK_TAGS:
+        if tag in tags:
+            ifd[tag] = tags[tag]
+            ifd.tagtype[tag] = tags.tagtype[tag]
+
+    counts = tuple(len(block) for block in blocks)
+    # Block offsets relative to the start of the block data
+    starts = (0,) + tuple(itertools.accumulate(counts))[:-1]
+    values = [(256, width), (257, height)]
+    if tiled:
+        # TileWidth, TileLength, TileByteCounts; TileOffsets are set below
+        values += [(322, block_size[0]), (323, block_size[1]), (325, counts)]
+        values += [(324, starts)]
+    else:
+        # RowsPerStrip, StripByteCounts, StripOffsets; Pillow moves strip
+        # offsets past the directory, where the block data goes
+        values += [(278, block_size[1]), (279, counts), (273, starts)]
+    for tag, value in values:
+        ifd[tag] = value
+        ifd.tagtype[tag] = TiffTags.LONG
+    if tiled:
+        data_start = len(header) + len(ifd.tobytes(len(header)))
+        ifd[324] = tuple(data_start + start for start in starts)
+
+    data = header + ifd.tobytes(len(header)) + b"".join(blocks)
+    with _bomb_check_lifted():
+        band = Image.open(io.BytesIO(data))
+    with band:
+        return band.convert("RGB")
+
+
+def _load_tiff_blocks(image, memory_limit):
+    """Decode a TIFF a band of strips or tiles at a time into a reduced image"""
+    tags = image.tag_v2
+    width, height = image.size
+    tiled = 324 in tags
+    if tiled:
+        # TileOffsets, TileByteCounts, TileWidth, TileLength
+        offsets, counts = tags[324], tags.get(325)
+        block_width, block_height = tags[322], tags[323]
+    else:
+        # StripOffsets, StripByteCounts, RowsPerStrip
+        offsets, counts = tags.get(273), tags.get(279)
+        block_width, block_height = width, min(tags.get(278, height), height)
+
+    if not tiled and tags.get(259, 1) == 1 and offsets and len(offsets) == 1:
+        # An uncompressed single strip can be cut into strips of one row
+        row_bytes = (width * sum(tags.get(258, (8,))) + 7) // 8
+        offsets = [offsets[0] + row * row_bytes for row in range(height)]
+        counts = [row_bytes] * height
+        block_height = 1
+
+    # A band is held as stored blocks (read, then joined into a TIFF), then
+    # decoded, converted to RGB and joined with leftover rows
+    stored_bytes = sum(tags.get(258, (8,))) / 8
+    pixel_bytes = stored_bytes * 2 + 12
+    band_height = int(memory_limit // (width * pixel_bytes)) // block_height
+    band_height *= block_height
+    if tags.get(284, 1) != 1 or not offsets or not counts or band_height == 0:
+        raise ImageTooLarge(
+            _describe(image, memory_limit)
+            + "; its strips or tiles cannot be read a few at a time"
+        )
+
+    blocks_across = math.ceil(width / block_width)
+    # Tiles are decoded a row of tiles at a time
+    band_height = block_height if tiled else band_height
+    reducer = _Reducer(image.size, reduction_factor(image.size))
+    for top in range(0, height, band_height):
+        rows = min(band_height, height - top)
+        first = top // block_height * blocks_across
+        last = math.ceil((top + rows) / block_height) * blocks_across
+        blocks = []
+        for index in range(first, last):
+            image.fp.seek(offsets[index])
+            blocks.append(image.fp.read(counts[index]))
+        reducer.add(
+            _tiff_band(tags, blocks, width, rows, (block_width, block_height), tiled)
+        )
+    return reducer.finish()
+
+
+def load_rgb(image, memory_limit=DEFAULT_MEMORY_LIMIT):
+    """Decode an opened image as RGB, reducing it while reading if needed
+
+    Images that fit under memory_limit bytes are decoded whole; larger ones
+    come back reduced by an integer factor. Raises ImageTooLarge when an
+    image neither fits nor can be read in pieces.
+    """
+    if decoded_bytes(image) <= memory_limit:
+        return image.convert("RGB")
+
+    if image.format == "JPEG":
+        factor = reduction_factor(image.size)
+        # Pillow picks the largest DCT scale that keeps at least the
+        # requested size, so rounding it up would cost a whole scale step
+        image.draft("RGB", (image.size[0] // factor, image.size[1] // factor))
+        if decoded_bytes(image) <= memory_limit:
+            return image.convert("RGB")
+    elif image.format == "PNG" and getattr(image, "n_frames", 1) == 1:
+        return _load_png_bands(image, memory_limit)
+    elif image.format == "TIFF":
+        return _load_tiff_blocks(image, memory_limit)
+
+    raise ImageTooLarge(_describe(image, memory_limit))
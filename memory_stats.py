@@ -0,0 +1,55 @@
+"""Resident memory of processes, read from /proc where available."""
+
+import ctypes
+import ctypes.util
+import os
+import sys
+
+
+def memory_usage(pid=None):
+    """Return (resident, shared) bytes of a process, or None if unknown
+
+    ``shared`` counts resident pages backed by files or shared memory, such
+    as memory-mapped model weights, which other processes can use as well.
+    Only Linux exposes this; other platforms return None.
+    """
+    try:
+        with open("/proc/{}/statm".format(pid or os.getpid())) as f:
+            fields = f.read().split()
+        page_size = os.sysconf("SC_PAGE_SIZE")
+        return int(fields[1]) * page_size, int(fields[2]) * page_size
+    except (OSError, ValueError, IndexError, AttributeError):
+        return None
+
+
+def resident_memory(pid=None):
+    """Resident memory of a process in bytes, or 0 if unknown"""
+    usage = memory_usage(pid)
+    return usage[0] if usage else 0
+
+
+def _load_libc():
+    if not sys.platform.startswith("linux"):
+        return None
+    try:
+        libc = ctypes.CDLL(ctypes.util.find_library("c") or "libc.so.6")
+        # Only glibc has malloc_trim (musl, for one, does not)
+        libc.malloc_trim.argtypes = [ctypes.c_size_t]
+        return libc
+    except (OSError, AttributeError):
+        return None
+
+
+_libc = _load_libc()
+
+
+def release_free_memory():
+    """Hand memory freed by finished work back to the system
+
+    glibc keeps freed blocks in per-thread arenas for reuse. Every job
+    decodes images on a new thread, so without trimming the resident size
+    of a long session creeps up by arenas nobody uses any more. Does
+    nothing where malloc_trim is not available.
+    """
+    if _libc is not None:
+        _libc.malloc_trim(0)
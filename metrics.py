@@ -0,0 +1,298 @@
+"""Prometheus-format metrics for unattended detection runs.
+
+Counters, gauges and histograms are kept in plain Python numbers and
+rendered in the Prometheus text exposition format, either served on a
+local ``/metrics`` endpoint or written to a file for node_exporter's
+textfile collector. Updates take no lock: every metric is only updated
+from the detection thread, so a scrape running alongside sees each value
+at most one update behind. Gauges of queue depths are read through a
+function when scraped and cost the detection loop nothing.
+"""
+
+import bisect
+import os
+import threading
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+
+CONTENT_TYPE = "text/plain; version=0.0.4; charset=utf-8"
+
+# Seconds; decoding and inference of one image range from about 1 ms to seconds
+LATENCY_BUCKETS = (0.001, 0.0025, 0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1, 2.5, 5)
+
+BATCH_SIZE_BUCKETS = (1, 2, 4, 8, 16, 32, 64, 128)
+
+# Seconds between writes of the textfile export
+TEXTFILE_INTERVAL = 15.0
+
+
+def _escape(value):
+    return str(value).replace("\\", "\\\\").replace('"', '\\"').replace("\n", "\\n")
+
+
+def _format_labels(names, values, extra=()):
+    pairs = list(zip(names, values)) + list(extra)
+    if not pairs:
+        return ""
+    return "{" + ",".join(f'{name}="{_escape(value)}"' for name, value in pairs) + "}"
+
+
+def _format_value(value):
+    if value == float("inf"):
+        return "+Inf"
+    if float(value).is_integer():
+        return str(int(value))
+    return repr(float(value))
+
+
+class _Metric:
+    """A metric family: one child per combination of label values"""
+
+    kind = None
+
+    def __init__(self, name, documentation, labelnames=()):
+        self.name = name
+        self.documentation = documentation
+        self.labelnames = tuple(labelnames)
+        self.children = {}
+        if not self.labelnames:
+            self.children[()] = self._new_child()
+
+    def labels(self, *values):
+        """The child for these label values, created on first use"""
+        child = self.children.get(values)
+        if child is None:
+            child = self.children.setdefault(values, self._new_child())
+        return child
+
+    def render(self):
+        lines = [
+            f"# HELP {self.name} {self.documentation}",
+            f"# TYPE {self.name} {self.kind}",
+        ]
+        # Copied, as the detection thread may add a child meanwhile
+        for values, child in list(self.children.items()):
+            lines.extend(self._render_child(values, child))
+        return lines
+
+
+class _Value:
+    def __init__(self):
+        self.value = 0.0
+        self.function = None
+
+    def inc(self, amount=1):
+        self.value += amount
+
+    def set(self, value):
+        self.value = value
+
+    def set_function(self, function):
+        """Read the value from ``function()`` whenever it is scraped"""
+        self.function = function
+
+    def get(self):
+        return self.function() if self.function is not None else self.value
+
+
+class Counter(_Metric):
+    kind = "counter"
+
+    def _new_child(self):
+        return _Value()
+
+    def inc(self, amount=1):
+        self.children[()].inc(amount)
+
+    def _render_child(self, values, child):
+        labels = _format_labels(self.labelnames, values)
+        return [f"{self.name}{labels} {_format_value(child.get())}"]
+
+
+class Gauge(Counter):
+    kind = "gauge"
+
+    def set(self, value):
+        self.children[()].set(value)
+
+
+class _Buckets:
+    def __init__(self, bounds):
+        self.bounds = bounds
+        # Observations per bucket, the last one for values above every bound
+        self.counts = [0] * (len(bounds) + 1)
+        self.sum = 0.0
+
+    def observe(self, value):
+        self.counts[bisect.bisect_left(self.bounds, value)] += 1
+        self.sum += value
+
+
+class Histogram(_Metric):
+    kind = "histogram"
+
+    def __init__(self, name, documentation, labelnames=(), buckets=LATENCY_BUCKETS):
+        self.buckets = tuple(buckets)
+        super().__init__(name, documentation, labelnames)
+
+    def _new_child(self):
+        return _Buckets(self.buckets)
+
+    def observe(self, value):
+        self.children[()].observe(value)
+
+    def _render_child(self, values, child):
+        counts = list(child.counts)
+        lines = []
+        cumulative = 0
+        for bound, count in zip(self.buckets + (float("inf"),), counts):
+            cumulative += count
+            labels = _format_labels(
+                self.labelnames, values, [("le", _format_value(bound))]
+            )
+            lines.append(f"{self.name}_bucket{labels} {cumulative}")
+        labels = _format_labels(self.labelnames, values)
+        lines.append(f"{self.name}_sum{labels} {_format_value(child.sum)}")
+        lines.append(f"{self.name}_count{labels} {cumulative}")
+        return lines
+
+
+class Registry:
+    """The metrics exported together"""
+
+    def __init__(self):
+        self.metrics = []
+
+    def register(self, metric):
+        self.metrics.append(metric)
+        return metric
+
+    def render(self):
+        """All metrics in the Prometheus text format"""
+        lines = []
+        for metric in self.metrics:
+            lines.extend(metric.render())
+        return "\n".join(lines) + "\n"
+
+
+class DetectorMetrics:
+    """The metrics of a detection run"""
+
+    def __init__(self):
+        self.registry = Registry()
+        register = self.registry.register
+        self.images = register(
+            Counter(
+                "watermark_detector_images_total",
+                "Images processed, by outcome",
+                ("outcome",),
+            )
+        )
+        self.cache_lookups = register(
+            Counter(
+                "watermark_detector_cache_lookups_total",
+                "Input cache lookups, by result (hit or miss)",
+                ("result",),
+            )
+        )
+        self.stage_seconds = register(
+            Histogram(
+                "watermark_detector_stage_seconds",
+                "Time spent on one image, by stage (decode or inference)",
+                ("stage",),
+            )
+        )
+        self.batch_size = register(
+            Histogram(
+                "watermark_detector_batch_size",
+                "Images per forward pass",
+                buckets=BATCH_SIZE_BUCKETS,
+            )
+        )
+        self.queue_depth = register(
+            Gauge(
+                "watermark_detector_queue_depth",
+                "Work waiting, by queue (input paths, or batches in the worker pool)",
+                ("queue",),
+            )
+        )
+        self.model_load_seconds = register(
+            Gauge(
+                "watermark_detector_model_load_seconds",
+                "Time taken to load the model at startup",
+            )
+        )
+
+    def observe_image(self, outcome, decode_ms=None, inference_ms=None):
+        """Count one processed image and its per-stage latencies"""
+        self.images.labels(outcome).inc()
+        if decode_ms is not None:
+            self.stage_seconds.labels("decode").observe(decode_ms / 1000)
+        if inference_ms is not None:
+            self.stage_seconds.labels("inference").observe(inference_ms / 1000)
+
+
+class _MetricsHandler(BaseHTTPRequestHandler):
+    registry = None
+
+    def do_GET(self):
+        if self.path.split("?")[0] != "/metrics":
+            self.send_error(404)
+            return
+        body = self.registry.render().encode("utf-8")
+        self.send_response(200)
+        self.send_header("Content-Type", CONTENT_TYPE)
+        self.send_header("Content-Length", str(len(body)))
+        self.end_headers()
+        self.wfile.write(body)
+
+    def log_message(self, format, *args):
+        # Scrapes every few seconds would flood stderr
+        pass
+
+
+class MetricsServer:
+    """Serve ``/metrics`` on a local port from a background thread"""
+
+    def __init__(self, registry, port, host="127.0.0.1"):
+        handler = type("MetricsHandler", (_MetricsHandler,), {"registry": registry})
+        self.server = ThreadingHTTPServer((host, port), handler)
+        self.server.daemon_threads = True
+        self.thread = threading.Thread(target=self.server.serve_forever, daemon=True)
+        self.thread.start()
+
+    @property
+    def port(self):
+        return self.server.server_address[1]
+
+    def close(self):
+        self.server.shutdown()
+        self.server.server_close()
+
+
+def write_textfile(registry, path):
+    """Write the metrics for a textfile collector, replacing the file at once"""
+    tmp_path = path + ".tmp"
+    with open(tmp_path, "w", encoding="utf-8") as f:
+        f.write(registry.render())
+    os.replace(tmp_path, path)
+
+
+class TextfileExporter:
+    """Rewrite a metrics file periodically and once more when closed"""
+
+    def __init__(self, registry, path, interval=TEXTFILE_INTERVAL):
+        self.registry = registry
+        self.path = path
+        self.interval = interval
+        self._stop = threading.Event()
+        self._thread = threading.Thread(target=self._run, daemon=True)
+        self._thread.start()
+
+    def _run(self):
+        while not self._stop.wait(self.interval):
+            write_textfile(self.registry, self.path)
+
+    def close(self):
+        self._stop.set()
+        self._thread.join()
+        write_textfile(self.registry, self.path)
@@ -0,0 +1,20 @@
+"""Loading of model weights by memory-mapping the checkpoint.
+
+``torch.load(..., mmap=True)`` maps the checkpoint file instead of reading
+it, so tensors are paged in lazily on first use. Mapped pages belong to the
+page cache and are shared read-only by every process that maps the same
+file, e.g. several CLI instances or the workers of an inference pool.
+Checkpoints in the legacy (pre-zip) format cannot be mapped and are read
+into memory as before.
+"""
+
+import torch
+
+
+def load_weights(path):
+    """Return (state_dict, mapped) for the checkpoint at path, on the CPU"""
+    try:
+        return torch.load(path, map_location="cpu", mmap=True, weights_only=True), True
+    except RuntimeError:
+        # Only zip-format checkpoints (torch.save since 1.6) can be mapped
+        return torch.load(path, map_location="cpu", weights_only=True), False
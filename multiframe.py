@@ -0,0 +1,101 @@
+"""Classification of animated and multi-page images frame by frame.
+
+Animated GIF/WebP/APNG files and multi-page TIFFs are not reduced to their
+first frame. Frames are sampled with a stride, up to a budget, and
+classified a chunk at a time in one forward pass per chunk. Decoding stops
+at the first chunk containing a frame over the watermark threshold, so a
+watermark early in a long animation does not cost decoding all of it.
+"""
+
+import collections
+import itertools
+import math
+import time
+
+import torch
+
+from large_images import DEFAULT_MEMORY_LIMIT, load_rgb
+
+# Frames classified per image at most
+FRAME_BUDGET = 32
+
+# Frames decoded and classified per forward pass
+FRAME_CHUNK = 8
+
+# Watermark probability at which a frame counts as watermarked
+WATERMARK_THRESHOLD = 0.5
+
+FrameResult = collections.namedtuple(
+    "FrameResult", "has_watermark confidence frame_index frames_checked inference_ms"
+)
+
+
+def is_multiframe(image):
+    """Whether a PIL image has more than one frame or page"""
+    return getattr(image, "n_frames", 1) > 1
+
+
+def frame_stride(frame_count, budget=FRAME_BUDGET):
+    """Stride spreading the budget evenly over all frames"""
+    return max(1, math.ceil(frame_count / budget))
+
+
+def iter_sampled_frames(
+    image, stride=None, budget=FRAME_BUDGET, memory_limit=DEFAULT_MEMORY_LIMIT
+):
+    """Yield (index, RGB frame) for every stride-th frame, at most budget
+
+    Without a stride the sampled frames are spread over the whole image.
+    """
+    if not stride:
+        stride = frame_stride(image.n_frames, budget)
+    indices = range(0, image.n_frames, stride)
+    for index in itertools.islice(indices, budget):
+        image.seek(index)
+        yield index, load_rgb(image, memory_limit)
+
+
+def classify_frames(
+    image,
+    predict,
+    transform,
+    stride=None,
+    budget=FRAME_BUDGET,
+    chunk=FRAME_CHUNK,
+    memory_limit=DEFAULT_MEMORY_LIMIT,
+):
+    """Classify the sampled frames of an image, stopping at the first watermark
+
+    ``predict(batch)`` returns (has_watermark, confidence) pairs like the
+    detector's predict. The image counts as watermarked if any sampled
+    frame does; the confidence is that of the most watermark-like frame.
+    """
+    frames = iter_sampled_frames(image, stride, budget, memory_limit)
+    best_probability = -1.0
+    best_index = 0
+    frames_checked = 0
+    inference_ms = 0.0
+
+    while best_probability < WATERMARK_THRESHOLD:
+        sampled = list(itertools.islice(frames, chunk))
+        if not sampled:
+            break
+
+        batch = torch.stack([transform(frame) for _, frame in sampled])
+        inference_start = time.perf_counter()
+        predictions = predict(batch)
+        inference_ms += (time.perf_counter() - inference_start) * 1000
+        frames_checked += len(sampled)
+
+        for (index, _), (has_watermark, confidence) in zip(sampled, predictions):
+            # Two classes, so the watermark probability follows from either
+            probability = confidence if has_watermark else 1 - confidence
+            if probability > best_probability:
+                best_probability = probability
+                best_index = index
+
+    has_watermark = best_probability >= WATERMARK_THRESHOLD
+    confidence = best_probability if has_watermark else 1 - best_probability
+    return FrameResult(
+        has_watermark, confidence, best_index, frames_checked, inference_ms
+    )
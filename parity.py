@@ -0,0 +1,201 @@
+"""Accuracy parity between the reference model path and faster ones.
+
+A faster configuration (batching, reduced decoding, vectorized
+preprocessing, worker processes, ...) is run on the same images as the
+reference eager fp32 model with its torchvision transform, and the two
+sets of predictions are compared: how many labels flip, how far the
+watermark probabilities move, and how much faster the candidate is.
+
+The images are generated locally from a seed, so every run and every
+machine checks the same set: photo-like gradients and noise, half of them
+with a tiled text watermark, in JPEG and PNG and at a range of sizes,
+including a few large enough for reduced decoding to apply.
+"""
+
+import os
+import random
+
+import numpy as np
+from PIL import Image, ImageDraw, ImageFont
+
+DEFAULT_PARITY_DIR = os.path.join(
+    os.path.expanduser("~"), ".cache", "watermark_detector", "parity"
+)
+
+# Images in the generated set
+IMAGE_COUNT = 64
+
+# Every LARGE_EVERY-th image is large (about 12 MP) to exercise reduced decoding
+LARGE_EVERY = 8
+LARGE_SIZE = (4000, 3000)
+
+# Default tolerances: no label may flip, probabilities may move by 0.02
+MAX_FLIP_RATE = 0.0
+MAX_PROBABILITY_DELTA = 0.02
+
+WATERMARK_TEXTS = ("© SAMPLE", "PREVIEW", "stock photo", "© 2024 Studio")
+
+
+def _background(rng, width, height):
+    """A smooth two-colour gradient with sensor-like noise"""
+    start = np.array([rng.randrange(256) for _ in range(3)], dtype=np.float32)
+    end = np.array([rng.randrange(256) for _ in range(3)], dtype=np.float32)
+    ramp = np.linspace(0.0, 1.0, width, dtype=np.float32)[None, :, None]
+    pixels = np.broadcast_to(start + (end - start) * ramp, (height, width, 3))
+    noise = np.random.default_rng(rng.randrange(2**32)).normal(
+        0.0, 8.0, (height, width, 3)
+    )
+    return Image.fromarray(np.clip(pixels + noise, 0, 255).astype(np.uint8))
+
+
+def _draw_shapes(rng, image):
+    draw = ImageDraw.Draw(image)
+    width, height = image.size
+    for _ in range(rng.randint(3, 8)):
+        x0, y0 = rng.randrange(width), rng.randrange(height)
+        x1 = x0 + rng.randint(width // 20, width // 3)
+        y1 = y0 + rng.randint(height // 20, height // 3)
+        colour = tuple(rng.randrange(256) for _ in range(3))
+        if rng.random() < 0.5:
+            draw.ellipse((x0, y0, x1, y1), fill=colour)
+        else:
+            draw.rectangle((x0, y0, x1, y1), fill=colour)
+
+
+def _draw_watermark(rng, image):
+    """Tile semi-transparent text over the image"""
+    width, height = image.size
+    try:
+        font = ImageFont.load_default(size=max(12, min(width, height) // 12))
+    except TypeError:
+        # Pillow before 10.1 only has the small bitmap font
+        font = ImageFont.load_default()
+    overlay = Image.new("RGBA", image.size, (0, 0, 0, 0))
+    draw = ImageDraw.Draw(overlay)
+    text = rng.choice(WATERMARK_TEXTS)
+    alpha = rng.randint(70, 160)
+    step_x = max(1, int(draw.textlength(text, font=font) * 1.5))
+    step_y = max(1, height // 4)
+    for y in range(0, height, step_y):
+        for x in range(-step_x // 2 * (y // step_y % 2), width, step_x):
+            draw.text((x, y), text, font=font, fill=(255, 255, 255, alpha))
+    return Image.alpha_composite(image.convert("RGBA"), overlay).convert("RGB")
+
+
+def generate_image_set(directory, count=IMAGE_COUNT, seed=0):
+    """Write the seeded image set to ``directory`` (once) and return its paths"""
+    os.makedirs(directory, exist_ok=True)
+    rng = random.Random(seed)
+    paths = []
+    for index in range(count):
+        # Draw every random choice even for existing files, so the set does
+        # not depend on which files were already there
+        if index % LARGE_EVERY == LARGE_EVERY - 1:
+            width, height = LARGE_SIZE
+        else:
+            width, height = rng.randint(160, 1600), rng.randint(160, 1200)
+        watermarked = index % 2 == 1
+        extension = ".png" if rng.random() < 0.25 else ".jpg"
+        image_seed = rng.randrange(2**32)
+
+        label = "watermark" if watermarked else "clean"
+        path = os.path.join(directory, f"{index:04d}_{label}{extension}")
+        paths.append(path)
+        if os.path.exists(path):
+            continue
+
+        image_rng = random.Random(image_seed)
+        image = _background(image_rng, width, height)
+        _draw_shapes(image_rng, image)
+        if watermarked:
+            image = _draw_watermark(image_rng, image)
+        tmp_path = path + ".tmp"
+        image.save(tmp_path, format="PNG" if extension == ".png" else "JPEG")
+        os.replace(tmp_path, path)
+    return paths
+
+
+def watermark_probability(has_watermark, confidence):
+    """Probability of the watermark class from a (label, confidence) pair"""
+    return confidence if has_watermark else 1 - confidence
+
+
+def compare(reference, candidate, reference_seconds, candidate_seconds):
+    """Drift and speedup of candidate predictions against the reference
+
+    Both are dicts of image path to (has_watermark, confidence), or to an
+    error message string. Images that only one side classified count as
+    missing.
+    """
+    flips = []
+    deltas = []
+    missing = []
+    for image_path, expected in reference.items():
+        actual = candidate.get(image_path)
+        if isinstance(expected, str) or isinstance(actual, (str, type(None))):
+            # Both failing the same image is parity too
+            if not (isinstance(expected, str) and isinstance(actual, str)):
+                missing.append(image_path)
+            continue
+        if expected[0] != actual[0]:
+            flips.append(image_path)
+        deltas.append(
+            abs(watermark_probability(*expected) - watermark_probability(*actual))
+        )
+
+    compared = max(1, len(reference))
+    return {
+        "images": len(reference),
+        "flips": flips,
+        "flip_rate": len(flips) / compared,
+        "missing": missing,
+        "max_delta": max(deltas, default=0.0),
+        "mean_delta": sum(deltas) / len(deltas) if deltas else 0.0,
+        "reference_seconds": reference_seconds,
+        "candidate_seconds": candidate_seconds,
+        "speedup": reference_seconds / candidate_seconds if candidate_seconds else 0.0,
+    }
+
+
+def parity_failures(
+    report, max_flip_rate=MAX_FLIP_RATE, max_delta=MAX_PROBABILITY_DELTA
+):
+    """Describe each tolerance the report exceeds (empty when within all)"""
+    failures = []
+    if report["missing"]:
+        failures.append(
+            "{} images classified by only one side".format(len(report["missing"]))
+        )
+    if report["flip_rate"] > max_flip_rate:
+        failures.append(
+            "label flip rate {:.2%} exceeds {:.2%}".format(
+                report["flip_rate"], max_flip_rate
+            )
+        )
+    if report["max_delta"] > max_delta:
+        failures.append(
+            "probability delta {:.4f} exceeds {:.4f}".format(
+                report["max_delta"], max_delta
+            )
+        )
+    return failures
+
+
+def format_report(report):
+    """Human-readable lines summarising a parity report"""
+    lines = [
+        "Images:            {}".format(report["images"]),
+        "Label flips:       {} ({:.2%})".format(
+            len(report["flips"]), report["flip_rate"]
+        ),
+        "Max prob. delta:   {:.4f}".format(report["max_delta"]),
+        "Mean prob. delta:  {:.4f}".format(report["mean_delta"]),
+        "Reference:         {:.2f} s".format(report["reference_seconds"]),
+        "Candidate:         {:.2f} s".format(report["candidate_seconds"]),
+        "Speedup:           {:.2f}x".format(report["speedup"]),
+    ]
+    for image_path in report["flips"]:
+        lines.append("  flipped: {}".format(image_path))
+    for image_path in report["missing"]:
+        lines.append("  missing: {}".format(image_path))
+    return lines
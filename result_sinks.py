@@ -0,0 +1,208 @@
+"""Streaming writers for detection results.
+
+Each sink receives one record per image while a job runs and writes them to
+disk in buffered batches, so reports for very large runs never have to be
+held in memory. The format is chosen from the file extension. Result files
+can be streamed back the same way, to merge the reports of sharded runs.
+"""
+
+import csv
+import json
+
+# Columns of every result record, in output order
+RESULT_FIELDS = ("path", "label", "confidence", "decode_ms", "inference_ms", "error")
+
+# Records buffered before each write
+DEFAULT_BUFFER_SIZE = 1000
+
+LABEL_WATERMARK = "watermark"
+LABEL_NO_WATERMARK = "no_watermark"
+LABEL_ERROR = "error"
+LABEL_SKIPPED = "skipped"
+
+
+def make_record(
+    path, label, confidence=None, decode_ms=None, inference_ms=None, error=None
+):
+    """Build a result record with all RESULT_FIELDS"""
+    return {
+        "path": path,
+        "label": label,
+        "confidence": confidence,
+        "decode_ms": decode_ms,
+        "inference_ms": inference_ms,
+        "error": error,
+    }
+
+
+class ResultSink:
+    """Base class buffering records and writing them in batches"""
+
+    def __init__(self, path, buffer_size=DEFAULT_BUFFER_SIZE):
+        self.path = path
+        self.buffer_size = buffer_size
+        self.buffer = []
+        self.count = 0
+
+    def write(self, record):
+        """Queue one record, writing the buffer once it is full"""
+        self.buffer.append(record)
+        self.count += 1
+        if len(self.buffer) >= self.buffer_size:
+            self.flush()
+
+    def flush(self):
+        """Write all buffered records"""
+        if self.buffer:
+            self.write_batch(self.buffer)
+            self.buffer = []
+
+    def write_batch(self, records):
+        raise NotImplementedError
+
+    def close(self):
+        """Write remaining records and close the file"""
+        self.flush()
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc_info):
+        self.close()
+
+
+class CsvSink(ResultSink):
+    """Write records as CSV with a header row"""
+
+    def __init__(self, path, buffer_size=DEFAULT_BUFFER_SIZE):
+        super().__init__(path, buffer_size)
+        self.file = open(path, "w", newline="", encoding="utf-8")
+        self.writer = csv.DictWriter(self.file, fieldnames=RESULT_FIELDS)
+        self.writer.writeheader()
+
+    def write_batch(self, records):
+        self.writer.writerows(records)
+        self.file.flush()
+
+    def close(self):
+        super().close()
+        self.file.close()
+
+
+class JsonlSink(ResultSink):
+    """Write records as one JSON object per line"""
+
+    def __init__(self, path, buffer_size=DEFAULT_BUFFER_SIZE):
+        super().__init__(path, buffer_size)
+        self.file = open(path, "w", encoding="utf-8")
+
+    def write_batch(self, records):
+        self.file.write("".join(json.dumps(record) + "\n" for record in records))
+        self.file.flush()
+
+    def close(self):
+        super().close()
+        self.file.close()
+
+
+class ParquetSink(ResultSink):
+    """Write records as Parquet, one row group per buffered batch"""
+
+    def __init__(self, path, buffer_size=DEFAULT_BUFFER_SIZE):
+        try:
+            import pyarrow as pa
+            import pyarrow.parquet as pq
+        except ImportError:
+            raise RuntimeError(
+                "Parquet export requires pyarrow (pip install pyarrow)"
+            ) from None
+
+        super().__init__(path, buffer_size)
+        self.pa = pa
+        self.schema = pa.schema(
+            [
+                ("path", pa.string()),
+                ("label", pa.string()),
+                ("confidence", pa.float64()),
+                ("decode_ms", pa.float64()),
+                ("inference_ms", pa.float64()),
+                ("error", pa.string()),
+            ]
+        )
+        self.writer = pq.ParquetWriter(path, self.schema)
+
+    def write_batch(self, records):
+        table = self.pa.Table.from_pylist(records, schema=self.schema)
+        self.writer.write_table(table)
+
+    def close(self):
+        super().close()
+        self.writer.close()
+
+
+SINKS_BY_EXTENSION = {
+    ".csv": CsvSink,
+    ".jsonl": JsonlSink,
+    ".ndjson": JsonlSink,
+    ".parquet": ParquetSink,
+}
+
+
+def open_sink(path, buffer_size=DEFAULT_BUFFER_SIZE):
+    """Open the sink matching the extension of path"""
+    for extension, sink_class in SINKS_BY_EXTENSION.items():
+        if path.lower().endswith(extension):
+            return sink_class(path, buffer_size)
+    raise ValueError(
+        "Unsupported export format for {} (use .csv, .jsonl or .parquet)".format(path)
+    )
+
+
+def _read_csv(path):
+    numeric_fields = ("confidence", "decode_ms", "inference_ms")
+    with open(path, newline="", encoding="utf-8") as f:
+        for row in csv.DictReader(f):
+            # Empty cells are the None values of the written record
+            for field in RESULT_FIELDS:
+                if row[field] == "":
+                    row[field] = None
+                elif field in numeric_fields:
+                    row[field] = float(row[field])
+            yield row
+
+
+def _read_jsonl(path):
+    with open(path, encoding="utf-8") as f:
+        for line in f:
+            if line.strip():
+                yield json.loads(line)
+
+
+def _read_parquet(path):
+    try:
+        import pyarrow.parquet as pq
+    except ImportError:
+        raise RuntimeError(
+            "Parquet export requires pyarrow (pip install pyarrow)"
+        ) from None
+
+    for batch in pq.ParquetFile(path).iter_batches():
+        yield from batch.to_pylist()
+
+
+READERS_BY_EXTENSION = {
+    ".csv": _read_csv,
+    ".jsonl": _read_jsonl,
+    ".ndjson": _read_jsonl,
+    ".parquet": _read_parquet,
+}
+
+
+def read_records(path):
+    """Stream the records of a result file written by one of the sinks"""
+    for extension, reader in READERS_BY_EXTENSION.items():
+        if path.lower().endswith(extension):
+            return reader(path)
+    raise ValueError(
+        "Unsupported export format for {} (use .csv, .jsonl or .parquet)".format(path)
+    )
@@ -0,0 +1,306 @@
+"""Table model and proxy for detection results.
+
+Results are kept in compact column arrays (path index, label, confidence,
+error code) rather than one widget item per image. Sorting and filtering
+are done with NumPy over those columns, so both stay interactive with
+hundreds of thousands of rows.
+"""
+
+from array import array
+
+import numpy as np
+from PyQt5.QtCore import QAbstractProxyModel, QAbstractTableModel, QModelIndex, Qt
+from PyQt5.QtGui import QColor
+
+from image_sources import display_name
+
+# Result codes stored in the label column
+RESULT_NO_WATERMARK = 0
+RESULT_WATERMARK = 1
+RESULT_ERROR = 2
+RESULT_SKIPPED = 3
+
+RESULT_TEXT = {
+    RESULT_NO_WATERMARK: "No watermark",
+    RESULT_WATERMARK: "Watermark",
+    RESULT_ERROR: "Error",
+    RESULT_SKIPPED: "Skipped",
+}
+RESULT_FOREGROUND = {
+    RESULT_NO_WATERMARK: QColor("#2e7d32"),
+    RESULT_WATERMARK: QColor("#c62828"),
+    RESULT_ERROR: QColor("#e65100"),
+    RESULT_SKIPPED: QColor("#616161"),
+}
+RESULT_BACKGROUND = {
+    RESULT_NO_WATERMARK: QColor("#e8f5e9"),
+    RESULT_WATERMARK: QColor("#ffebee"),
+    RESULT_ERROR: QColor("#fff3e0"),
+    RESULT_SKIPPED: QColor("#f5f5f5"),
+}
+
+# Results without a confidence
+UNCLASSIFIED_RESULTS = (RESULT_ERROR, RESULT_SKIPPED)
+
+COLUMN_IMAGE = 0
+COLUMN_RESULT = 1
+COLUMN_CONFIDENCE = 2
+COLUMN_ERROR = 3
+COLUMN_TITLES = ("Image", "Result", "Confidence", "Error")
+
+# Role returning the full image path of a row
+PathRole = Qt.UserRole
+
+
+class ResultsTableModel(QAbstractTableModel):
+    """Detection results stored as column arrays"""
+
+    def __init__(self, parent=None):
+        super().__init__(parent)
+        self.clear_data()
+
+    def clear_data(self):
+        self.paths = []
+        # Lower-case display names, used for sorting and filtering by name
+        self.name_keys = []
+        self.labels = array("b")
+        self.confidences = array("f")
+        # Error messages are stored once and referenced by code (-1 = none)
+        self.error_codes = array("i")
+        self.error_messages = []
+        self.error_lookup = {}
+
+    def clear(self):
+        """Remove all results"""
+        self.beginResetModel()
+        self.clear_data()
+        self.endResetModel()
+
+    def append_results(self, results):
+        """Append a batch of (path, label, confidence, error_message) results"""
+        if not results:
+            return
+
+        first = len(self.paths)
+        self.beginInsertRows(QModelIndex(), first, first + len(results) - 1)
+        for path, label, confidence, error_message in results:
+            self.paths.append(path)
+            self.name_keys.append(display_name(path).lower())
+            self.labels.append(label)
+            self.confidences.append(confidence)
+            if error_message is None:
+                self.error_codes.append(-1)
+            else:
+                code = self.error_lookup.get(error_message)
+                if code is None:
+                    code = self.error_lookup[error_message] = len(self.error_messages)
+                    self.error_messages.append(error_message)
+                self.error_codes.append(code)
+        self.endInsertRows()
+
+    def column_arrays(self):
+        """Zero-copy NumPy views of the label, confidence and error columns"""
+        return (
+            np.frombuffer(self.labels, dtype=np.int8),
+            np.frombuffer(self.confidences, dtype=np.float32),
+            np.frombuffer(self.error_codes, dtype=np.int32),
+        )
+
+    def count(self, label):
+        """Number of results with a given label"""
+        return int(np.count_nonzero(self.column_arrays()[0] == label))
+
+    def rowCount(self, parent=QModelIndex()):
+        return 0 if parent.isValid() else len(self.paths)
+
+    def columnCount(self, parent=QModelIndex()):
+        return 0 if parent.isValid() else len(COLUMN_TITLES)
+
+    def headerData(self, section, orientation, role=Qt.DisplayRole):
+        if orientation == Qt.Horizontal and role == Qt.DisplayRole:
+            return COLUMN_TITLES[section]
+        return None
+
+    def data(self, index, role=Qt.DisplayRole):
+        if not index.isValid():
+            return None
+
+        row = index.row()
+        column = index.column()
+        label = self.labels[row]
+
+        if role == Qt.DisplayRole:
+            if column == COLUMN_IMAGE:
+                return display_name(self.paths[row])
+            if column == COLUMN_RESULT:
+                return RESULT_TEXT[label]
+            if column == COLUMN_CONFIDENCE:
+                if label in UNCLASSIFIED_RESULTS:
+                    return ""
+                return "{:.1f}%".format(self.confidences[row] * 100)
+            if column == COLUMN_ERROR:
+                code = self.error_codes[row]
+                return self.error_messages[code] if code >= 0 else ""
+        elif role == Qt.ToolTipRole:
+            return self.paths[row]
+        elif role == Qt.ForegroundRole and column == COLUMN_RESULT:
+            return RESULT_FOREGROUND[label]
+        elif role == Qt.BackgroundRole:
+            return RESULT_BACKGROUND[label]
+        elif role == PathRole:
+            return self.paths[row]
+        return None
+
+
+class ResultsFilterProxy(QAbstractProxyModel):
+    """Sorted and filtered view of a ResultsTableModel
+
+    The visible rows are one NumPy array of source rows, recomputed with
+    vectorized masks and argsorts instead of per-row Python callbacks.
+    """
+
+    def __init__(self, parent=None):
+        super().__init__(parent)
+        self.rows = np.empty(0, dtype=np.int64)
+        self.source_to_proxy = np.empty(0, dtype=np.int64)
+        self.sort_column = -1
+        self.sort_order = Qt.AscendingOrder
+
+        # Filter settings
+        self.label_filter = None
+        self.max_confidence = None
+        self.name_filter = ""
+
+    def setSourceModel(self, source_model):
+        super().setSourceModel(source_model)
+        source_model.modelReset.connect(self.rebuild)
+        source_model.rowsInserted.connect(self.source_rows_inserted)
+        self.rebuild()
+
+    def set_filter(self, label=None, max_confidence=None, name=""):
+        """Show only rows with a label, confidence below a bound and a name match"""
+        self.label_filter = label
+        self.max_confidence = max_confidence
+        self.name_filter = name.lower()
+        self.rebuild()
+
+    def filter_mask(self, start=0):
+        """Boolean mask of accepted source rows from start onwards"""
+        labels, confidences, _ = self.sourceModel().column_arrays()
+        labels = labels[start:]
+        confidences = confidences[start:]
+
+        mask = np.ones(len(labels), dtype=bool)
+        if self.label_filter is not None:
+            mask &= labels == self.label_filter
+        if self.max_confidence is not None:
+            mask &= (confidences < self.max_confidence) & ~np.isin(
+                labels, UNCLASSIFIED_RESULTS
+            )
+        if self.name_filter:
+            name_keys = self.sourceModel().name_keys
+            mask &= np.fromiter(
+                (self.name_filter in name for name in name_keys[start:]),
+                dtype=bool,
+                count=len(labels),
+            )
+        return mask
+
+    def sorted_rows(self, rows):
+        """Order source rows by the current sort column"""
+        if self.sort_column < 0 or len(rows) == 0:
+            return rows
+
+        source = self.sourceModel()
+        labels, confidences, error_codes = source.column_arrays()
+        if self.sort_column == COLUMN_IMAGE:
+            names = np.array(source.name_keys)[rows]
+            order = np.argsort(names, kind="stable")
+        elif self.sort_column == COLUMN_RESULT:
+            order = np.argsort(labels[rows], kind="stable")
+        elif self.sort_column == COLUMN_CONFIDENCE:
+            order = np.argsort(confidences[rows], kind="stable")
+        else:
+            order = np.argsort(error_codes[rows], kind="stable")
+
+        if self.sort_order == Qt.DescendingOrder:
+            order = order[::-1]
+        return rows[order]
+
+    def rebuild(self):
+        """Recompute the visible rows from scratch"""
+        self.layoutAboutToBeChanged.emit()
+        old_persistent = self.persistentIndexList()
+        old_sources = [self.mapToSource(index) for index in old_persistent]
+
+        self.rows = self.sorted_rows(np.flatnonzero(self.filter_mask()))
+        self.update_reverse_map()
+
+        for old_index, source_index in zip(old_persistent, old_sources):
+            self.changePersistentIndex(old_index, self.mapFromSource(source_index))
+        self.layoutChanged.emit()
+
+    def update_reverse_map(self):
+        source_count = self.sourceModel().rowCount()
+        self.source_to_proxy = np.full(source_count, -1, dtype=np.int64)
+        self.source_to_proxy[self.rows] = np.arange(len(self.rows))
+
+    def source_rows_inserted(self, parent, first, last):
+        """Add newly appended source rows that pass the filter"""
+        if self.sort_column >= 0:
+            # Sorted views are re-sorted as a whole; argsort is cheap
+            self.rebuild()
+            return
+
+        accepted = first + np.flatnonzero(self.filter_mask(first)[: last - first + 1])
+        if len(accepted) == 0:
+            self.update_reverse_map()
+            return
+
+        start = len(self.rows)
+        self.beginInsertRows(QModelIndex(), start, start + len(accepted) - 1)
+        self.rows = np.concatenate([self.rows, accepted])
+        self.update_reverse_map()
+        self.endInsertRows()
+
+    def sort(self, column, order=Qt.AscendingOrder):
+        self.sort_column = column
+        self.sort_order = order
+        self.rebuild()
+
+    def mapToSource(self, proxy_index):
+        if not proxy_index.isValid() or proxy_index.row() >= len(self.rows):
+            return QModelIndex()
+        return self.sourceModel().index(
+            int(self.rows[proxy_index.row()]), proxy_index.column()
+        )
+
+    def mapFromSource(self, source_index):
+        if not source_index.isValid() or source_index.row() >= len(
+            self.source_to_proxy
+        ):
+            return QModelIndex()
+        row = int(self.source_to_proxy[source_index.row()])
+        if row < 0:
+            return QModelIndex()
+        return self.index(row, source_index.column())
+
+    def index(self, row, column, parent=QModelIndex()):
+        if parent.isValid() or not (0 <= row < len(self.rows)):
+            return QModelIndex()
+        return self.createIndex(row, column)
+
+    def parent(self, index=QModelIndex()):
+        return QModelIndex()
+
+    def rowCount(self, parent=QModelIndex()):
+        return 0 if parent.isValid() else len(self.rows)
+
+    def columnCount(self, parent=QModelIndex()):
+        return 0 if parent.isValid() else len(COLUMN_TITLES)
+
+    def data(self, index, role=Qt.DisplayRole):
+        return self.sourceModel().data(self.mapToSource(index), role)
+
+    def headerData(self, section, orientation, role=Qt.DisplayRole):
+        return self.sourceModel().headerData(section, orientation, role)
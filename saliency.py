@@ -0,0 +1,77 @@
+"""Grad-CAM heatmaps showing where the detector sees a watermark.
+
+Heatmaps are only computed on request, never as part of a detection run.
+A map is the ReLU of the ResNet ``layer4`` activations weighted by the
+spatially pooled gradients of the watermark logit, scaled to [0, 1] per
+image. Maps are cached on disk per model checkpoint as small 7x7 arrays,
+one file per image, keyed by the image path, size and modification time so
+an edited image gets a new map.
+"""
+
+import hashlib
+import json
+import os
+
+import numpy as np
+import torch
+
+from tensor_cache import file_signature
+
+DEFAULT_HEATMAP_DIR = os.path.join(
+    os.path.expanduser("~"), ".cache", "watermark_detector", "heatmaps"
+)
+
+# Output index of the watermark class
+WATERMARK_CLASS = 1
+
+
+def grad_cam(model, inputs, target_class=WATERMARK_CLASS):
+    """Grad-CAM maps over layer4 for a batch, as an N x 7 x 7 array in [0, 1]"""
+    with torch.no_grad():
+        x = model.maxpool(model.relu(model.bn1(model.conv1(inputs))))
+        x = model.layer3(model.layer2(model.layer1(x)))
+        activations = model.layer4(x)
+
+    # Only the pooling and fc layers need gradients: the gradient of the
+    # logit with respect to the layer4 output is all Grad-CAM uses
+    activations.requires_grad_(True)
+    with torch.enable_grad():
+        logits = model.fc(torch.flatten(model.avgpool(activations), 1))
+        # Images in a batch are independent, so one backward pass serves all
+        (gradients,) = torch.autograd.grad(logits[:, target_class].sum(), activations)
+
+    with torch.no_grad():
+        weights = gradients.mean(dim=(2, 3), keepdim=True)
+        heatmaps = torch.relu((weights * activations).sum(dim=1))
+        peak = heatmaps.flatten(1).max(dim=1).values.clamp(min=1e-8)
+        heatmaps = heatmaps / peak[:, None, None]
+    return heatmaps.cpu().numpy()
+
+
+class HeatmapCache:
+    """Heatmaps of one model checkpoint stored as .npy files"""
+
+    def __init__(self, model_key, cache_dir=DEFAULT_HEATMAP_DIR):
+        # Maps of a different checkpoint would point at different evidence
+        self.directory = os.path.join(cache_dir, model_key)
+        os.makedirs(self.directory, exist_ok=True)
+
+    def _file(self, path):
+        key = json.dumps([path] + file_signature(path))
+        digest = hashlib.sha1(key.encode("utf-8")).hexdigest()
+        return os.path.join(self.directory, digest + ".npy")
+
+    def get(self, path):
+        """Return the cached heatmap of an image, or None if missing or stale"""
+        try:
+            return np.load(self._file(path)).astype(np.float32)
+        except (OSError, ValueError):
+            return None
+
+    def store(self, path, heatmap):
+        """Cache the heatmap of an image"""
+        file_path = self._file(path)
+        tmp_path = file_path + ".tmp"
+        with open(tmp_path, "wb") as f:
+            np.save(f, heatmap.astype(np.float16))
+        os.replace(tmp_path, file_path)
@@ -0,0 +1,284 @@
+"""Static sharding of a scan across machines and merging of the results.
+
+With ``--shard i/N`` a headless run only processes the images whose path
+hashes to shard ``i`` of ``N``, so N machines given the same inputs split
+the work between them with no service in between. The hash is taken of the
+path relative to the folder holding each input, which keeps the partition
+the same on machines that mount the archive at different places.
+
+Every shard writes its own result file, with paths in the same relative
+form, and once it has finished a small manifest next to it. The manifest
+sums up the partition as the shard's walk saw it: how many images (or
+whole tar archives, which belong to one shard) the walk found and were
+assigned to the shard, each with a checksum of their keys. Merging reads
+the shard files and their manifests, checks that every shard is there,
+that the shards' assignments add up to the whole partition, that each
+shard reported on everything assigned to it and that no image was
+reported twice, and writes one consolidated report.
+"""
+
+import hashlib
+import json
+import os
+
+from image_sources import is_tar_archive, member_path, split_member_path
+from result_sinks import ResultSink, open_sink, read_records
+
+MANIFEST_SUFFIX = ".shard.json"
+
+# Duplicated images listed by path when merging; the rest are only counted
+MAX_LISTED_DUPLICATES = 10
+
+# Key checksums are sums of 8-byte key digests, wrapping around
+CHECKSUM_MODULUS = 2**64
+
+
+def parse_shard(text):
+    """Parse ``i/N`` into (index, count)"""
+    try:
+        index, count = (int(part) for part in text.split("/"))
+    except ValueError:
+        raise ValueError(f"Invalid shard {text!r} (expected i/N, e.g. 0/4)") from None
+    if count < 1 or not 0 <= index < count:
+        raise ValueError(f"Invalid shard {text!r} (need 0 <= i < N)")
+    return index, count
+
+
+def root_names(roots):
+    """The names keys start with, one per input; they must be distinct
+
+    Keys are relative to the folder holding each input, so two inputs of
+    the same name (say ``/a/photos`` and ``/b/photos``) would share keys.
+    """
+    names = [os.path.basename(os.path.abspath(root)) for root in roots]
+    duplicates = sorted({name for name in names if names.count(name) > 1})
+    if duplicates:
+        raise ValueError(
+            "Sharded inputs need distinct names, but several are called "
+            + ", ".join(repr(name) for name in duplicates)
+        )
+    return names
+
+
+def shard_key(path, root):
+    """The part of a path that is hashed: relative to the folder holding root"""
+    base = os.path.dirname(os.path.abspath(root))
+    # Member names are kept as they are in the archive
+    archive_path, member_name = split_member_path(path)
+    key = os.path.relpath(os.path.abspath(archive_path), base).replace(os.sep, "/")
+    return key if member_name is None else member_path(key, member_name)
+
+
+def key_digest(key):
+    """8-byte hash of a key, as an integer"""
+    digest = hashlib.blake2b(key.encode("utf-8"), digest_size=8).digest()
+    return int.from_bytes(digest, "big")
+
+
+def shard_of(key, count):
+    """The shard a key belongs to, the same on every machine and run"""
+    return key_digest(key) % count
+
+
+def entry_key(key):
+    """The walked entry a result key belongs to: a whole tar, or the key itself"""
+    archive_key, member_name = split_member_path(key)
+    if member_name is not None and is_tar_archive(archive_key):
+        return archive_key
+    return key
+
+
+class ShardPartition:
+    """Select the walked paths of one shard, summing up the whole partition
+
+    Pass it as the ``select`` of a FolderWalker. Every walked entry is
+    counted and added to the partition checksum, and those of the shard to
+    the shard's own count and checksum as well.
+    """
+
+    def __init__(self, shard, roots):
+        self.index, self.count = shard
+        self.roots = list(roots)
+        self.names = root_names(self.roots)
+        self.entries = 0
+        self.checksum = 0
+        self.assigned = 0
+        self.assigned_checksum = 0
+
+    def __call__(self, path, root):
+        digest = key_digest(shard_key(path, root))
+        self.entries += 1
+        self.checksum = (self.checksum + digest) % CHECKSUM_MODULUS
+        if digest % self.count != self.index:
+            return False
+        self.assigned += 1
+        self.assigned_checksum = (self.assigned_checksum + digest) % CHECKSUM_MODULUS
+        return True
+
+    def key(self, path):
+        """The shard key of a walked path (or of a member of a walked tar)"""
+        for root, name in zip(self.roots, self.names):
+            key = shard_key(path, root)
+            if key == name or key.startswith((name + "/", name + "!")):
+                return key
+        return shard_key(path, self.roots[0])
+
+
+class ShardSink(ResultSink):
+    """Write a shard's records to a sink under their shard keys
+
+    Keys are the same wherever the inputs are mounted, so the merged
+    report does not depend on where each machine found them.
+    """
+
+    def __init__(self, sink, partition):
+        super().__init__(sink.path, sink.buffer_size)
+        self.sink = sink
+        self.partition = partition
+
+    def write(self, record):
+        super().write(dict(record, path=self.partition.key(record["path"])))
+
+    def write_batch(self, records):
+        self.sink.write_batch(records)
+
+    def close(self):
+        super().close()
+        self.sink.close()
+
+
+def manifest_path(output):
+    return output + MANIFEST_SUFFIX
+
+
+def write_manifest(output, partition, images, seconds):
+    """Record that a shard has finished, what it was assigned and its results"""
+    manifest = {
+        "shard": partition.index,
+        "shards": partition.count,
+        "roots": partition.names,
+        "images": images,
+        "seconds": seconds,
+        # Images or tar archives walked, as (count, checksum) pairs
+        "assigned": [partition.assigned, partition.assigned_checksum],
+        "partition": [partition.entries, partition.checksum],
+    }
+    tmp_path = manifest_path(output) + ".tmp"
+    with open(tmp_path, "w", encoding="utf-8") as f:
+        json.dump(manifest, f, indent=2)
+    os.replace(tmp_path, manifest_path(output))
+
+
+def read_manifests(shard_paths):
+    """Load the manifest of every shard file; return (manifests, problems)"""
+    manifests = {}
+    problems = []
+    for shard_path in shard_paths:
+        try:
+            with open(manifest_path(shard_path), encoding="utf-8") as f:
+                manifests[shard_path] = json.load(f)
+        except FileNotFoundError:
+            problems.append(f"{shard_path}: no manifest, the shard did not finish")
+        except (OSError, ValueError) as e:
+            problems.append(f"{shard_path}: unreadable manifest ({e})")
+    if not manifests:
+        return manifests, problems
+
+    # All shards must come from one partition of the same inputs
+    first = next(iter(manifests.values()))
+    for shard_path, manifest in manifests.items():
+        if manifest["shards"] != first["shards"]:
+            problems.append(
+                "{}: shard of {} rather than {}".format(
+                    shard_path, manifest["shards"], first["shards"]
+                )
+            )
+        if manifest["roots"] != first["roots"]:
+            problems.append(f"{shard_path}: run on different inputs")
+        elif manifest["partition"] != first["partition"]:
+            problems.append(f"{shard_path}: found different images in the inputs")
+
+    found = {}
+    for shard_path, manifest in manifests.items():
+        found.setdefault(manifest["shard"], []).append(shard_path)
+    for index in range(first["shards"]):
+        paths = found.get(index, [])
+        if not paths:
+            problems.append(f"shard {index}/{first['shards']} is missing")
+        elif len(paths) > 1:
+            problems.append(
+                "shard {}/{} given more than once: {}".format(
+                    index, first["shards"], ", ".join(paths)
+                )
+            )
+
+    # Together the shards must have been assigned the whole partition
+    if not problems:
+        assigned = [manifest["assigned"] for manifest in manifests.values()]
+        entries, checksum = first["partition"]
+        if sum(count for count, _ in assigned) != entries or (
+            sum(digest for _, digest in assigned) % CHECKSUM_MODULUS != checksum
+        ):
+            problems.append("the shards were not assigned all of the inputs")
+    return manifests, problems
+
+
+def merge_shards(shard_paths, output):
+    """Combine shard result files into one report
+
+    Returns (counts by label, seconds of the slowest shard, problems). The
+    report is only written when there are no problems.
+    """
+    manifests, problems = read_manifests(shard_paths)
+    counts = {}
+    # 8-byte digests rather than the paths, for archives of millions of images
+    seen = set()
+    duplicates = 0
+
+    tmp_path = output + ".tmp" + os.path.splitext(output)[1]
+    with open_sink(tmp_path) as sink:
+        for shard_path in shard_paths:
+            records = 0
+            # Walked entries the shard reported on, to compare with the
+            # ones it was assigned (a tar has a record per image)
+            entries = set()
+            for record in read_records(shard_path):
+                records += 1
+                entries.add(key_digest(entry_key(record["path"])))
+                digest = key_digest(record["path"])
+                if digest in seen:
+                    duplicates += 1
+                    if duplicates <= MAX_LISTED_DUPLICATES:
+                        problems.append(f"{record['path']}: reported more than once")
+                    continue
+                seen.add(digest)
+                counts[record["label"]] = counts.get(record["label"], 0) + 1
+                sink.write(record)
+
+            manifest = manifests.get(shard_path)
+            if manifest is None:
+                continue
+            if records != manifest["images"]:
+                problems.append(
+                    "{}: {} results for {} images, the file is incomplete".format(
+                        shard_path, records, manifest["images"]
+                    )
+                )
+            elif [len(entries), sum(entries) % CHECKSUM_MODULUS] != manifest[
+                "assigned"
+            ]:
+                problems.append(
+                    "{}: results for {} of the {} images assigned to the shard, "
+                    "or for others".format(
+                        shard_path, len(entries), manifest["assigned"][0]
+                    )
+                )
+    if duplicates > MAX_LISTED_DUPLICATES:
+        problems.append(f"{duplicates} duplicated results in total")
+
+    if problems:
+        os.remove(tmp_path)
+    else:
+        os.replace(tmp_path, output)
+    seconds = max((manifest["seconds"] for manifest in manifests.values()), default=0)
+    return counts, seconds, problems
@@ -0,0 +1,159 @@
+"""Memory-mapped cache of preprocessed model inputs.
+
+The output of ``transform`` is stored once as uint8 pixels in a single
+memory-mapped array file, with a JSON index mapping each image path to its
+slot. Later runs read whole batches straight from the memmap instead of
+decoding and resizing the files again.
+
+``ToTensor`` only divides uint8 pixels by 255, so storing the rounded pixel
+values and dividing again on load gives back exactly the same tensor.
+"""
+
+import hashlib
+import json
+import os
+
+import numpy as np
+import torch
+
+from image_sources import split_member_path
+from large_images import DEFAULT_MEMORY_LIMIT
+
+DEFAULT_CACHE_DIR = os.path.join(
+    os.path.expanduser("~"), ".cache", "watermark_detector", "tensors"
+)
+INPUT_SHAPE = (3, 224, 224)
+
+# Slots are added in chunks so the data file is not resized for every image
+_GROW_SLOTS = 256
+
+
+def transform_fingerprint(
+    transform, shape=INPUT_SHAPE, image_memory_limit=DEFAULT_MEMORY_LIMIT
+):
+    """Hash of the transform definition, used to invalidate stale caches
+
+    The image memory limit is part of it, since images over the limit are
+    reduced while they are decoded and so preprocess differently.
+    """
+    definition = "{}|{}|{}".format(repr(transform), shape, image_memory_limit)
+    return hashlib.sha1(definition.encode("utf-8")).hexdigest()[:16]
+
+
+def file_signature(path):
+    """Modification time and size of an image (or the archive holding it)"""
+    stat = os.stat(split_member_path(path)[0])
+    return [stat.st_mtime_ns, stat.st_size]
+
+
+class TensorCache:
+    """Memory-mapped uint8 store of preprocessed inputs keyed by image path"""
+
+    def __init__(
+        self,
+        transform,
+        cache_dir=DEFAULT_CACHE_DIR,
+        shape=INPUT_SHAPE,
+        image_memory_limit=DEFAULT_MEMORY_LIMIT,
+    ):
+        self.shape = tuple(shape)
+        self.fingerprint = transform_fingerprint(
+            transform, self.shape, image_memory_limit
+        )
+        self.directory = os.path.join(cache_dir, self.fingerprint)
+        self.data_path = os.path.join(self.directory, "inputs.u8")
+        self.index_path = os.path.join(self.directory, "index.json")
+        os.makedirs(self.directory, exist_ok=True)
+
+        # Index: path -> [slot, mtime_ns, size]
+        self.index = {}
+        if os.path.exists(self.index_path):
+            try:
+                with open(self.index_path) as f:
+                    self.index = json.load(f)
+            except (OSError, ValueError):
+                self.index = {}
+
+        self.count = max((entry[0] for entry in self.index.values()), default=-1) + 1
+        self._data = None
+        self._open(max(self.count, _GROW_SLOTS))
+        self._dirty = False
+
+    def _open(self, capacity):
+        """Open (and grow if needed) the memory-mapped data file"""
+        slot_bytes = int(np.prod(self.shape))
+        size = capacity * slot_bytes
+        if self._data is not None:
+            self._data.flush()
+            self._data = None
+
+        # Extend the file without touching existing contents
+        mode = "r+b" if os.path.exists(self.data_path) else "w+b"
+        with open(self.data_path, mode) as f:
+            f.seek(0, os.SEEK_END)
+            if f.tell() < size:
+                f.truncate(size)
+
+        self.capacity = os.path.getsize(self.data_path) // slot_bytes
+        self._data = np.memmap(
+            self.data_path,
+            dtype=np.uint8,
+            mode="r+",
+            shape=(self.capacity,) + self.shape,
+        )
+
+    def lookup(self, path):
+        """Return the slot of a cached path, or None if missing or stale"""
+        entry = self.index.get(path)
+        if entry is None:
+            return None
+        try:
+            if entry[1:] != file_signature(path):
+                return None
+        except OSError:
+            return None
+        return entry[0]
+
+    def store(self, path, tensor):
+        """Store the preprocessed float tensor for a path"""
+        entry = self.index.get(path)
+        if entry is not None:
+            slot = entry[0]
+        else:
+            slot = self.count
+            self.count += 1
+            if slot >= self.capacity:
+                self._open(self.capacity + _GROW_SLOTS)
+
+        pixels = torch.round(tensor.detach().cpu() * 255).to(torch.uint8)
+        self._data[slot] = pixels.numpy()
+        self.index[path] = [slot] + file_signature(path)
+        self._dirty = True
+
+    def load_batch(self, slots):
+        """Read a batch of slots as a float tensor with the transform's scaling"""
+        slots = np.asarray(slots, dtype=np.int64)
+        if len(slots) and np.all(np.diff(slots) == 1):
+            # Contiguous slots are a plain slice of the memmap
+            pixels = torch.from_numpy(self._data[slots[0] : slots[-1] + 1])
+        else:
+            pixels = torch.from_numpy(self._data[slots])
+        return pixels.float().div(255)
+
+    def flush(self):
+        """Write pending data and the index to disk"""
+        if self._data is not None:
+            self._data.flush()
+        if not self._dirty:
+            return
+
+        tmp_path = self.index_path + ".tmp"
+        with open(tmp_path, "w") as f:
+            json.dump(self.index, f)
+        os.replace(tmp_path, self.index_path)
+        self._dirty = False
+
+    def close(self):
+        """Flush and release the memory map"""
+        self.flush()
+        self._data = None
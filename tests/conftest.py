@@ -0,0 +1,21 @@
+import importlib
+import os
+import sys
+
+import pytest
+import torch
+
+# The modules live at the top of the repository
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+sys.path.insert(0, ROOT)
+
+
+@pytest.fixture(scope="session")
+def app(tmp_path_factory):
+    """The application module, loaded with a small untrained checkpoint"""
+    from architectures import build_model
+
+    checkpoint = tmp_path_factory.mktemp("model") / "resnet10.pth"
+    torch.save(build_model("resnet10").state_dict(), checkpoint)
+    os.environ["WATERMARK_DETECTOR_MODEL"] = str(checkpoint)
+    return importlib.import_module("watermark_detector_app")
@@ -0,0 +1,34 @@
+import numpy as np
+import torch
+from PIL import Image
+from torchvision import transforms
+
+from batch_preprocess import INPUT_SIZE, preprocess_batch
+
+
+def gradient(width, height):
+    """An RGB image with smooth detail in every channel"""
+    x = np.linspace(0, 255, width)[None, :]
+    y = np.linspace(0, 255, height)[:, None]
+    pixels = np.stack([x + 0 * y, y + 0 * x, (x + y) / 2], axis=-1)
+    return pixels.astype(np.uint8)
+
+
+def test_batch_matches_the_per_image_transform():
+    arrays = [gradient(640, 480), gradient(300, 500), gradient(640, 480)]
+    reference = transforms.Compose(
+        [transforms.Resize(INPUT_SIZE), transforms.ToTensor()]
+    )
+
+    batch = preprocess_batch(arrays)
+
+    assert batch.shape == (3, 3) + INPUT_SIZE and batch.dtype == torch.float32
+    for row, array in zip(batch, arrays):
+        expected = reference(Image.fromarray(array))
+        assert (row - expected).abs().max() <= 1 / 255 + 1e-6
+
+
+def test_images_of_the_input_size_are_not_resized():
+    array = np.random.default_rng(0).integers(0, 256, INPUT_SIZE + (3,), np.uint8)
+    batch = preprocess_batch([array])
+    assert torch.equal(batch[0], torch.from_numpy(array).permute(2, 0, 1) / 255)
@@ -0,0 +1,49 @@
+import numpy as np
+import pytest
+
+import embedding_store
+from embedding_store import EmbeddingStore
+
+DIM = 8
+
+
+@pytest.fixture
+def store_dir(tmp_path):
+    return str(tmp_path / "embeddings")
+
+
+def test_search_ranks_by_cosine_similarity(store_dir):
+    store = EmbeddingStore("model", store_dir, dim=DIM)
+    basis = np.eye(DIM, dtype=np.float32)
+    store.add(
+        ["a.jpg", "b.jpg", "c.jpg"], [basis[0] * 5, basis[0] + basis[1], basis[2]]
+    )
+
+    results = store.search("a.jpg", k=5)
+
+    # The query image itself is left out
+    assert [path for path, _ in results] == ["b.jpg", "c.jpg"]
+    assert results[0][1] == pytest.approx(2**-0.5, abs=1e-3)
+    assert store.search(basis[2], k=1) == [("c.jpg", pytest.approx(1.0, abs=1e-3))]
+    assert store.search(basis[1], min_similarity=0.5) == [
+        ("b.jpg", pytest.approx(2**-0.5, abs=1e-3))
+    ]
+    assert store.search("unknown.jpg") == []
+
+
+def test_embeddings_persist_across_opens(store_dir, monkeypatch):
+    # The data file grows while rows are added
+    monkeypatch.setattr(embedding_store, "_GROW_ROWS", 2)
+    store = EmbeddingStore("model", store_dir, dim=DIM)
+    rows = np.random.default_rng(0).normal(size=(3, DIM))
+    store.add(["a.jpg", "b.jpg", "c.jpg"], rows)
+    # Adding a path again replaces its row
+    store.add(["b.jpg"], rows[:1])
+    store.close()
+
+    reopened = EmbeddingStore("model", store_dir, dim=DIM)
+    assert len(reopened) == 3 and "b.jpg" in reopened
+    expected = rows[0] / np.linalg.norm(rows[0])
+    np.testing.assert_allclose(reopened.get("b.jpg"), expected, atol=1e-3)
+    # Each model checkpoint has its own store
+    assert len(EmbeddingStore("other", store_dir, dim=DIM)) == 0
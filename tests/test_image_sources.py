@@ -0,0 +1,130 @@
+import tarfile
+import threading
+import time
+
+import pytest
+from PIL import Image
+
+import image_sources
+from image_sources import (
+    ReadAhead,
+    expand_paths,
+    iter_folder_images,
+    iter_image_sources,
+    member_path,
+)
+
+
+@pytest.fixture
+def tar_archive(tmp_path):
+    archive = tmp_path / "images.tar.gz"
+    with tarfile.open(archive, "w:gz") as tf:
+        for index in range(3):
+            image_path = tmp_path / f"{index}.png"
+            Image.new("RGB", (8, 8)).save(image_path)
+            tf.add(image_path, arcname=image_path.name)
+        readme = tmp_path / "README"
+        readme.write_text("not an image")
+        tf.add(readme, arcname="README")
+    return str(archive)
+
+
+@pytest.fixture
+def count_tar_opens(monkeypatch):
+    opened = []
+    tarfile_open = tarfile.open
+
+    def counting_open(*args, **kwargs):
+        opened.append(args[0])
+        return tarfile_open(*args, **kwargs)
+
+    monkeypatch.setattr(image_sources.tarfile, "open", counting_open)
+    return opened
+
+
+def test_selecting_a_tar_does_not_read_it(tar_archive, count_tar_opens):
+    assert expand_paths([tar_archive]) == [tar_archive]
+    assert list(iter_folder_images(tar_archive)) == [tar_archive]
+    assert count_tar_opens == []
+
+
+def test_tar_members_are_listed_by_the_reading_pass(tar_archive, count_tar_opens):
+    sources = list(iter_image_sources([tar_archive]))
+    assert [path for path, _, _ in sources] == [
+        member_path(tar_archive, f"{index}.png") for index in range(3)
+    ]
+    assert all(error is None for _, _, error in sources)
+    assert count_tar_opens == [tar_archive]
+
+
+def test_listing_tars_for_per_image_work(tar_archive):
+    assert len(list(iter_folder_images(tar_archive, list_tars=True))) == 3
+
+
+def test_tar_without_images_is_reported(tmp_path):
+    archive = tmp_path / "empty.tar"
+    tarfile.open(archive, "w").close()
+    [(path, source, error)] = iter_image_sources([str(archive)])
+    assert path == str(archive) and source is None
+    assert "No images" in str(error)
+
+
+def test_unreadable_tar_is_reported(tmp_path):
+    archive = tmp_path / "broken.tar.gz"
+    archive.write_bytes(b"not a tar")
+    [(path, _, error)] = iter_image_sources([str(archive)])
+    assert path == str(archive) and error is not None
+
+
+class TrackingReadAhead(ReadAhead):
+    """Counts the bytes of files read but not yet taken, including slow reads"""
+
+    def __init__(self, *args, **kwargs):
+        super().__init__(*args, **kwargs)
+        self.outstanding = 0
+        self.peak = 0
+        self.tracking = threading.Lock()
+
+    def read(self, path):
+        with self.tracking:
+            self.outstanding += len(open(path, "rb").read())
+            self.peak = max(self.peak, self.outstanding)
+        time.sleep(0.01)
+        return super().read(path)
+
+
+def test_read_ahead_stays_within_its_budget(tmp_path):
+    paths = []
+    for index in range(20):
+        path = tmp_path / f"{index}.bin"
+        path.write_bytes(bytes([index]) * 100_000)
+        paths.append(str(path))
+    read_ahead = TrackingReadAhead(4, byte_budget=250_000)
+
+    for path, source, error in image_sources._iter_read_ahead(paths, read_ahead):
+        assert error is None
+        assert source.read() == open(path, "rb").read()
+        with read_ahead.tracking:
+            read_ahead.outstanding -= 100_000
+
+    assert 0 < read_ahead.peak <= read_ahead.byte_budget
+    assert read_ahead.buffered == 0
+    assert read_ahead.files_read == 20
+
+
+def test_read_ahead_leaves_large_and_unreadable_files_to_the_decoder(tmp_path):
+    large = tmp_path / "large.bin"
+    large.write_bytes(b"x" * 2000)
+    small = tmp_path / "small.bin"
+    small.write_bytes(b"y" * 10)
+    missing = str(tmp_path / "missing.bin")
+    read_ahead = ReadAhead(2, byte_budget=1000)
+
+    results = list(
+        image_sources._iter_read_ahead([str(large), missing, str(small)], read_ahead)
+    )
+
+    assert results[0] == (str(large), str(large), None)
+    assert results[1][0] == missing and isinstance(results[1][2], OSError)
+    assert results[2][1].read() == b"y" * 10
+    assert read_ahead.buffered == 0
@@ -0,0 +1,84 @@
+import os
+import time
+
+import pytest
+import torch
+from PIL import Image
+
+from inference_pool import InferencePool, _predict
+
+
+class Stall(torch.nn.Module):
+    """Pools the input; inputs of ones make it hang or exit instead"""
+
+    def __init__(self, exit_worker=False):
+        super().__init__()
+        self.exit_worker = exit_worker
+
+    def forward(self, inputs):
+        if inputs.flatten()[0] > 0:
+            if self.exit_worker:
+                os._exit(1)
+            time.sleep(60)
+        return inputs.mean((2, 3), keepdim=True)
+
+
+class StallingModel(torch.nn.Module):
+    def __init__(self, exit_worker=False):
+        super().__init__()
+        self.stall = Stall(exit_worker)
+        self.fc = torch.nn.Linear(3, 2)
+
+    def forward(self, inputs):
+        return self.fc(torch.flatten(self.stall(inputs), 1))
+
+
+def test_pool_classifies_like_the_model(app, tmp_path):
+    if app.device.type != "cpu":
+        pytest.skip("worker processes run on the CPU")
+    image_paths = []
+    for index in range(6):
+        path = str(tmp_path / f"{index}.png")
+        Image.new("RGB", (64, 48), (index * 40, 100, 200 - index * 30)).save(path)
+        image_paths.append(path)
+    inputs = torch.stack([app.transform(Image.open(path)) for path in image_paths])
+    expected = dict(zip(image_paths, _predict(app.model, inputs)))
+
+    pool = InferencePool(app.model, app.transform, 2, batch_size=3)
+    try:
+        pool.submit(image_paths[:3], payloads=image_paths[:3])
+        pool.submit(image_paths[3:], payloads=image_paths[3:])
+        assert pool.in_flight == 2
+        results = [pool.next_result(), pool.next_result()]
+    finally:
+        pool.close()
+
+    assert pool.in_flight == 0
+    for result in results:
+        for path, (has_watermark, confidence) in zip(
+            result.image_paths, result.predictions
+        ):
+            assert has_watermark == expected[path][0]
+            assert confidence == pytest.approx(expected[path][1], abs=1e-4)
+
+
+@pytest.mark.parametrize(
+    "exit_worker, message", [(False, "timed out"), (True, "exited unexpectedly")]
+)
+def test_stuck_or_dead_worker_is_replaced(exit_worker, message):
+    pool = InferencePool(StallingModel(exit_worker), None, 1, inference_timeout=0.5)
+    try:
+        worker = pool.workers[0]
+        pool.submit(["stuck.jpg"], inputs=torch.ones((1, 3, 4, 4)))
+        pool.submit(["queued.jpg"], inputs=torch.zeros((1, 3, 4, 4)))
+
+        failed = pool.next_result()
+        assert failed.image_paths == ["stuck.jpg"]
+        assert message in str(failed.predictions[0])
+        # The batch queued behind it goes to the replacement
+        result = pool.next_result()
+        assert result.image_paths == ["queued.jpg"]
+        assert isinstance(result.predictions[0], tuple)
+        assert pool.workers[0] is not worker and not worker.process.is_alive()
+    finally:
+        pool.close()
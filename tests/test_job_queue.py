@@ -0,0 +1,109 @@
+import tarfile
+
+from PIL import Image
+
+import image_sources
+from image_sources import list_archive_images
+from job_queue import (
+    PRIORITY_BACKGROUND,
+    PRIORITY_INTERACTIVE,
+    PRIORITY_NORMAL,
+    PRIORITY_VISIBLE,
+    JobQueue,
+)
+
+
+def drain(job_queue, count=2):
+    paths = []
+    while True:
+        batch = job_queue.take(count)
+        if not batch:
+            return paths
+        paths.extend(batch)
+
+
+def test_serves_best_priority_first():
+    job_queue = JobQueue()
+    assert job_queue.add_job(["b1", "b2"], PRIORITY_BACKGROUND)
+    job_queue.add_job(["n1", "n2"], PRIORITY_NORMAL)
+    assert drain(job_queue) == ["n1", "n2", "b1", "b2"]
+
+
+def test_promoted_paths_jump_ahead():
+    job_queue = JobQueue()
+    job_queue.add_job(["a", "b", "c", "d"])
+    job_queue.promote(["d"], PRIORITY_VISIBLE)
+    job_queue.promote(["c"], PRIORITY_INTERACTIVE)
+    assert drain(job_queue, 1) == ["c", "d", "a", "b"]
+
+
+def test_waiting_path_is_not_queued_twice():
+    job_queue = JobQueue()
+    job_queue.add_job(["a", "b"])
+    job_queue.add_job(["b", "c"])
+    assert job_queue.total == 3
+    assert drain(job_queue) == ["a", "b", "c"]
+
+
+def test_re_enqueue_while_running():
+    job_queue = JobQueue()
+    assert job_queue.add_job(["a", "b", "c"])
+    assert job_queue.take(2) == ["a", "b"]
+    # The running consumer picks the job up, including a path it has done
+    assert not job_queue.add_job(["a", "d"], PRIORITY_VISIBLE)
+    assert drain(job_queue) == ["a", "d", "c"]
+    # Running dry makes the queue idle again
+    assert job_queue.add_job(["e"])
+
+
+def test_lazy_jobs_are_read_on_demand():
+    read = []
+
+    def walk():
+        for index in range(5):
+            read.append(index)
+            yield f"walk{index}"
+
+    job_queue = JobQueue()
+    job_queue.add_job(walk(), PRIORITY_BACKGROUND)
+    assert job_queue.total == 0
+    assert job_queue.take(2) == ["walk0", "walk1"]
+    assert len(read) == 2
+    job_queue.add_job(["x"], PRIORITY_NORMAL)
+    assert drain(job_queue) == ["x", "walk2", "walk3", "walk4"]
+
+
+def test_nothing_is_kept_of_taken_paths():
+    job_queue = JobQueue()
+    job_queue.add_job((f"image{index}" for index in range(1000)))
+    drain(job_queue, 100)
+    assert not job_queue.pending and not job_queue.heap
+
+
+def test_tar_members_are_read_in_one_pass(app, tmp_path, monkeypatch):
+    archive = tmp_path / "images.tar.gz"
+    with tarfile.open(archive, "w:gz") as tf:
+        for index in range(12):
+            image_path = tmp_path / f"{index}.png"
+            Image.new("RGB", (8, 8), (index, 0, 0)).save(image_path)
+            tf.add(image_path, arcname=image_path.name)
+
+    opened = []
+    tarfile_open = tarfile.open
+
+    def counting_open(*args, **kwargs):
+        opened.append(args[0])
+        return tarfile_open(*args, **kwargs)
+
+    members = list_archive_images(str(archive))
+    monkeypatch.setattr(image_sources.tarfile, "open", counting_open)
+
+    job_queue = JobQueue()
+    job_queue.add_job(members)
+    results = []
+    detection_thread = app.WatermarkDetectionThread(job_queue, batch_size=2)
+    detection_thread.result_ready.connect(lambda path, *_: results.append(path))
+    detection_thread.run()
+
+    assert sorted(results) == sorted(members)
+    assert opened == [str(archive)]
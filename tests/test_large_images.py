@@ -0,0 +1,40 @@
+import io
+
+import pytest
+from PIL import Image
+
+from large_images import load_rgb, open_image
+
+
+@pytest.fixture
+def small_bomb_limit(monkeypatch):
+    # Makes a 1000 x 1000 image count as a decompression bomb
+    monkeypatch.setattr(Image, "MAX_IMAGE_PIXELS", 100000)
+
+
+def image_bytes(size, format):
+    buffer = io.BytesIO()
+    Image.new("RGB", size).save(buffer, format)
+    return buffer.getvalue()
+
+
+def png_bytes(size):
+    return image_bytes(size, "PNG")
+
+
+def test_bomb_check_is_kept_outside_bounded_decoding(small_bomb_limit):
+    with pytest.raises(Image.DecompressionBombError):
+        Image.open(io.BytesIO(png_bytes((1000, 1000))))
+
+
+def test_bounded_decoding_lifts_the_bomb_check(small_bomb_limit):
+    with open_image(io.BytesIO(png_bytes((1000, 1000)))) as image:
+        # Read in bands and reduced under a ceiling smaller than the image
+        assert load_rgb(image, memory_limit=2**20).size == (500, 500)
+    assert Image.MAX_IMAGE_PIXELS == 100000
+
+
+def test_large_jpeg_is_decoded_at_a_reduced_scale():
+    # Sides that are no multiple of the reduction factor
+    with open_image(io.BytesIO(image_bytes((2403, 1801), "JPEG"))) as image:
+        assert load_rgb(image, memory_limit=2 * 2**20).size == (601, 451)
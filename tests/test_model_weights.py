@@ -0,0 +1,32 @@
+import torch
+
+from model_weights import load_weights
+
+
+def test_zip_checkpoint_is_mapped(tmp_path):
+    path = tmp_path / "weights.pth"
+    state_dict = {"weight": torch.arange(6.0).reshape(2, 3)}
+    torch.save(state_dict, path)
+
+    loaded, mapped = load_weights(str(path))
+
+    assert mapped
+    assert torch.equal(loaded["weight"], state_dict["weight"])
+    assert loaded["weight"].device.type == "cpu"
+
+
+def test_legacy_checkpoint_is_read(tmp_path):
+    path = tmp_path / "legacy.pth"
+    state_dict = {"weight": torch.ones(3)}
+    torch.save(state_dict, path, _use_new_zipfile_serialization=False)
+
+    loaded, mapped = load_weights(str(path))
+
+    assert not mapped
+    assert torch.equal(loaded["weight"], state_dict["weight"])
+
+
+def test_application_model_uses_the_mapped_weights(app):
+    assert app.MODEL_MAPPED
+    # Built on the meta device, every parameter was replaced by a loaded one
+    assert all(not p.is_meta for p in app.model.parameters())
@@ -0,0 +1,57 @@
+import pytest
+from PIL import Image
+from torchvision import transforms
+
+from multiframe import classify_frames, is_multiframe
+
+FRAMES = 40
+
+
+def gif(tmp_path, red_frames=()):
+    """A GIF of distinct gray frames, with red ones at the given indices"""
+    frames = [
+        Image.new("RGB", (16, 16), (255, 0, 0) if i in red_frames else (5 * i,) * 3)
+        for i in range(FRAMES)
+    ]
+    path = tmp_path / "animation.gif"
+    frames[0].save(path, save_all=True, append_images=frames[1:], duration=40)
+    return Image.open(path)
+
+
+def predict_red(batch):
+    """A detector that sees a watermark in red frames"""
+    red = batch[:, 0].mean((1, 2)) - batch[:, 1].mean((1, 2)) > 0.5
+    return [(True, 0.9) if is_red else (False, 0.8) for is_red in red.tolist()]
+
+
+def test_decoding_stops_at_the_first_watermarked_chunk(tmp_path):
+    with gif(tmp_path, red_frames={10, 30}) as image:
+        assert is_multiframe(image) and image.n_frames == FRAMES
+        result = classify_frames(image, predict_red, transforms.ToTensor(), stride=1)
+
+    assert result.has_watermark and result.confidence == pytest.approx(0.9)
+    assert result.frame_index == 10
+    # Two chunks of eight frames, not the budget of 32
+    assert result.frames_checked == 16
+
+
+def test_budget_is_spread_over_all_frames(tmp_path):
+    with gif(tmp_path) as image:
+        result = classify_frames(image, predict_red, transforms.ToTensor())
+
+    assert not result.has_watermark and result.confidence == pytest.approx(0.8)
+    # Every second frame, as 40 frames do not fit a budget of 32
+    assert result.frames_checked == 20
+
+
+def test_stride_samples_every_nth_frame_up_to_the_budget(tmp_path):
+    with gif(tmp_path, red_frames={39}) as image:
+        result = classify_frames(
+            image, predict_red, transforms.ToTensor(), stride=3, budget=FRAMES
+        )
+    assert result.has_watermark and result.frame_index == 39
+    assert result.frames_checked == 14
+
+
+def test_single_frame_image_is_not_multiframe():
+    assert not is_multiframe(Image.new("RGB", (8, 8)))
@@ -0,0 +1,45 @@
+import pytest
+
+from result_sinks import (
+    LABEL_ERROR,
+    LABEL_WATERMARK,
+    make_record,
+    open_sink,
+    read_records,
+)
+
+RECORDS = [
+    make_record("a.jpg", LABEL_WATERMARK, 0.875, 12.5, 3.25),
+    make_record("dir/b, c.png", LABEL_ERROR, error='Bad "header"\nin file'),
+    make_record("d.gif", LABEL_WATERMARK, 0.5, 1.0, 2.0),
+]
+
+
+@pytest.mark.parametrize("extension", [".csv", ".jsonl", ".ndjson", ".parquet"])
+def test_records_round_trip(tmp_path, extension):
+    if extension == ".parquet":
+        pytest.importorskip("pyarrow")
+    path = str(tmp_path / ("results" + extension))
+    # A buffer smaller than the run writes several batches
+    with open_sink(path, buffer_size=2) as sink:
+        for record in RECORDS:
+            sink.write(record)
+    assert sink.count == 3
+    assert list(read_records(path)) == RECORDS
+
+
+def test_sink_writes_in_batches(tmp_path):
+    path = str(tmp_path / "results.jsonl")
+    sink = open_sink(path, buffer_size=2)
+    sink.write(RECORDS[0])
+    assert list(read_records(path)) == []
+    sink.write(RECORDS[1])
+    assert len(list(read_records(path))) == 2
+    sink.close()
+
+
+def test_unknown_format_is_rejected(tmp_path):
+    with pytest.raises(ValueError, match="Unsupported export format"):
+        open_sink(str(tmp_path / "results.xlsx"))
+    with pytest.raises(ValueError, match="Unsupported export format"):
+        read_records(str(tmp_path / "results.xlsx"))
@@ -0,0 +1,80 @@
+from PyQt5.QtCore import Qt
+
+from results_table import (
+    COLUMN_CONFIDENCE,
+    COLUMN_IMAGE,
+    PathRole,
+    RESULT_ERROR,
+    RESULT_NO_WATERMARK,
+    RESULT_WATERMARK,
+    ResultsFilterProxy,
+    ResultsTableModel,
+)
+
+RESULTS = [
+    ("/photos/beach.jpg", RESULT_WATERMARK, 0.9, None),
+    ("/photos/Alps.jpg", RESULT_NO_WATERMARK, 0.2, None),
+    ("/photos/broken.jpg", RESULT_ERROR, 0.0, "Cannot identify image"),
+    ("/photos/city.jpg", RESULT_WATERMARK, 0.6, None),
+]
+
+
+def table(results=RESULTS):
+    model = ResultsTableModel()
+    proxy = ResultsFilterProxy()
+    proxy.setSourceModel(model)
+    model.append_results(results)
+    return model, proxy
+
+
+def visible_paths(proxy):
+    return [proxy.index(row, 0).data(PathRole) for row in range(proxy.rowCount())]
+
+
+def test_sort_by_confidence_and_name():
+    _, proxy = table()
+    proxy.sort(COLUMN_CONFIDENCE, Qt.DescendingOrder)
+    assert visible_paths(proxy)[:2] == ["/photos/beach.jpg", "/photos/city.jpg"]
+
+    # Names sort without regard to case
+    proxy.sort(COLUMN_IMAGE)
+    assert visible_paths(proxy) == [
+        "/photos/Alps.jpg",
+        "/photos/beach.jpg",
+        "/photos/broken.jpg",
+        "/photos/city.jpg",
+    ]
+
+
+def test_filters_combine_and_leave_out_unclassified_images():
+    _, proxy = table()
+    proxy.set_filter(label=RESULT_WATERMARK)
+    assert visible_paths(proxy) == ["/photos/beach.jpg", "/photos/city.jpg"]
+
+    # The error's confidence of 0 does not count as low confidence
+    proxy.set_filter(max_confidence=0.7)
+    assert visible_paths(proxy) == ["/photos/Alps.jpg", "/photos/city.jpg"]
+
+    proxy.set_filter(max_confidence=0.7, name="CIT")
+    assert visible_paths(proxy) == ["/photos/city.jpg"]
+
+
+def test_appended_rows_are_filtered_and_mapped():
+    model, proxy = table()
+    proxy.set_filter(label=RESULT_WATERMARK)
+    model.append_results(
+        [
+            ("/photos/dunes.jpg", RESULT_NO_WATERMARK, 0.1, None),
+            ("/photos/river.jpg", RESULT_WATERMARK, 0.8, None),
+        ]
+    )
+    assert visible_paths(proxy)[-1] == "/photos/river.jpg"
+    assert proxy.rowCount() == 3
+
+    source_row = model.paths.index("/photos/river.jpg")
+    proxy_index = proxy.mapFromSource(model.index(source_row, 0))
+    assert proxy_index.row() == 2
+    assert proxy.mapToSource(proxy_index).row() == source_row
+    # Rows left out by the filter have no place in the view
+    assert not proxy.mapFromSource(model.index(source_row - 1, 0)).isValid()
+    assert model.count(RESULT_WATERMARK) == 3
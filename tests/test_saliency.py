@@ -0,0 +1,35 @@
+import os
+
+import numpy as np
+import torch
+
+from saliency import HeatmapCache, grad_cam
+
+
+def test_grad_cam_maps_each_image_on_its_own(app):
+    model = app.model
+    inputs = torch.randn((3, 3, 224, 224), generator=torch.Generator().manual_seed(0))
+    inputs = inputs.to(app.device)
+
+    heatmaps = grad_cam(model, inputs)
+
+    assert heatmaps.shape == (3, 7, 7)
+    assert heatmaps.min() >= 0 and heatmaps.max() <= 1 + 1e-6
+    # One backward pass for the batch gives the maps of single images
+    np.testing.assert_allclose(heatmaps[1:2], grad_cam(model, inputs[1:2]), atol=1e-5)
+    assert all(not p.requires_grad or p.grad is None for p in model.parameters())
+
+
+def test_heatmaps_are_cached_until_the_image_changes(tmp_path):
+    image = tmp_path / "photo.jpg"
+    image.write_bytes(b"jpg")
+    cache = HeatmapCache("model", str(tmp_path / "heatmaps"))
+    heatmap = np.linspace(0, 1, 49, dtype=np.float32).reshape(7, 7)
+
+    assert cache.get(str(image)) is None
+    cache.store(str(image), heatmap)
+    np.testing.assert_allclose(cache.get(str(image)), heatmap, atol=1e-3)
+
+    image.write_bytes(b"edited jpg")
+    os.utime(image, ns=(0, 10**9))
+    assert cache.get(str(image)) is None
@@ -0,0 +1,126 @@
+import tarfile
+
+import pytest
+
+from image_sources import FolderWalker, iter_image_sources
+from result_sinks import LABEL_NO_WATERMARK, make_record, open_sink, read_records
+from sharding import (
+    ShardPartition,
+    ShardSink,
+    merge_shards,
+    parse_shard,
+    root_names,
+    write_manifest,
+)
+
+SHARDS = 3
+
+
+@pytest.fixture
+def photos(tmp_path):
+    """A tree of (fake) images and a tar archive, walked as ``photos``"""
+    root = tmp_path / "mount" / "photos"
+    (root / "sub").mkdir(parents=True)
+    for index in range(20):
+        (root / ("sub" if index % 2 else "") / f"{index}.jpg").write_bytes(b"jpg")
+    with tarfile.open(root / "more.tar", "w") as tf:
+        for index in range(4):
+            member = tmp_path / f"member{index}.png"
+            member.write_bytes(b"png")
+            tf.add(member, arcname=member.name)
+    return root
+
+
+def run_shard(root, shard, output, drop=0):
+    """Write the records of one shard like a headless run, leaving out some"""
+    partition = ShardPartition(parse_shard(shard), [str(root)])
+    folder_walker = FolderWalker([str(root)], select=partition)
+    sink = ShardSink(open_sink(str(output)), partition)
+    # Tars are listed by the pass that reads them, as in detection
+    paths = [path for path, _, _ in iter_image_sources(folder_walker)]
+    dropped = [path for path in paths if path.endswith(".jpg")][:drop]
+    for path in paths:
+        if path not in dropped:
+            sink.write(make_record(path, LABEL_NO_WATERMARK, 0.9))
+    sink.close()
+    write_manifest(str(output), partition, sink.count, 1.0)
+    return str(output)
+
+
+def run_all(root, tmp_path, **drops):
+    return [
+        run_shard(
+            root,
+            f"{index}/{SHARDS}",
+            tmp_path / f"shard{index}.csv",
+            drops.get(f"drop{index}", 0),
+        )
+        for index in range(SHARDS)
+    ]
+
+
+def test_merge_covers_every_image_once(photos, tmp_path):
+    output = str(tmp_path / "merged.csv")
+    counts, _, problems = merge_shards(run_all(photos, tmp_path), output)
+    assert problems == []
+    paths = sorted(record["path"] for record in read_records(output))
+    assert len(paths) == counts[LABEL_NO_WATERMARK] == 24
+    assert all(path.startswith("photos/") for path in paths)
+    assert "photos/more.tar!/member0.png" in paths
+
+
+def test_shards_from_different_mount_points_merge(photos, tmp_path):
+    other_mount = tmp_path / "elsewhere"
+    other_mount.mkdir()
+    (other_mount / "photos").symlink_to(photos)
+    shard_paths = run_all(photos, tmp_path)
+    shard_paths[1] = run_shard(
+        other_mount / "photos", f"1/{SHARDS}", tmp_path / "moved.csv"
+    )
+    output = str(tmp_path / "merged.csv")
+    _, _, problems = merge_shards(shard_paths, output)
+    assert problems == []
+    assert len(list(read_records(output))) == 24
+
+
+def test_image_no_shard_processed_is_reported(photos, tmp_path):
+    shard_paths = run_all(photos, tmp_path, drop1=1)
+    output = tmp_path / "merged.csv"
+    _, _, problems = merge_shards(shard_paths, str(output))
+    assert any("assigned to the shard" in problem for problem in problems)
+    assert not output.exists()
+
+
+def test_duplicated_image_is_reported(photos, tmp_path):
+    shard_paths = run_all(photos, tmp_path)
+    with open(shard_paths[1], "a", encoding="utf-8") as f:
+        f.write(open(shard_paths[0], encoding="utf-8").read().splitlines()[1] + "\n")
+    _, _, problems = merge_shards(shard_paths, str(tmp_path / "merged.csv"))
+    assert any("reported more than once" in problem for problem in problems)
+
+
+def test_missing_shard_is_reported(photos, tmp_path):
+    shard_paths = run_all(photos, tmp_path)
+    _, _, problems = merge_shards(shard_paths[:2], str(tmp_path / "merged.csv"))
+    assert problems == [f"shard 2/{SHARDS} is missing"]
+
+
+def test_shard_of_different_inputs_is_reported(photos, tmp_path):
+    shard_paths = run_all(photos, tmp_path)
+    (photos / "late.jpg").write_bytes(b"jpg")
+    shard_paths[2] = run_shard(photos, f"2/{SHARDS}", tmp_path / "late.csv")
+    _, _, problems = merge_shards(shard_paths, str(tmp_path / "merged.csv"))
+    assert any("different images" in problem for problem in problems)
+
+
+def test_parse_shard_rejects_bad_shards():
+    assert parse_shard("1/4") == (1, 4)
+    for text in ("4/4", "1", "a/b", "0/0"):
+        with pytest.raises(ValueError):
+            parse_shard(text)
+
+
+def test_inputs_of_the_same_name_are_rejected(tmp_path):
+    assert root_names([str(tmp_path / "photos"), "/b/more/"]) == ["photos", "more"]
+    with pytest.raises(ValueError, match="photos"):
+        ShardPartition((0, 2), [str(tmp_path / "photos"), "/b/photos/"])
@@ -0,0 +1,47 @@
+import pytest
+import torch
+
+from warmup import BackgroundWarmUp, pad_batch
+
+
+class ShapeRecorder(torch.nn.Module):
+    def __init__(self):
+        super().__init__()
+        self.batch_sizes = []
+
+    def forward(self, inputs):
+        self.batch_sizes.append(len(inputs))
+        return inputs.flatten(1)[:, :2]
+
+
+def test_background_warm_up_runs_every_batch_size_once():
+    model = ShapeRecorder()
+    BackgroundWarmUp(model, [32, 1, 32]).wait()
+    assert model.batch_sizes == [1, 32]
+
+
+def test_pad_batch_keeps_rows_and_pads_with_zeros():
+    inputs = torch.ones((3, 3, 4, 4))
+    padded = pad_batch(inputs, 8)
+    assert padded.shape == (8, 3, 4, 4)
+    assert torch.equal(padded[:3], inputs)
+    assert not padded[3:].any()
+    assert pad_batch(inputs, 2) is inputs
+
+
+def test_default_cpu_configuration_warms_up(app):
+    args = app.parse_args(["--headless", "photos"])
+    workers = args.workers or 0
+    assert app.WatermarkDetectionThread([]).watchdog is False
+    assert app.start_warm_up(4, workers, args.decode_timeout, args.inference_timeout)
+    assert app.background_warm_up is not None
+    app.finish_warm_up()
+    assert not app.background_warm_up.thread.is_alive()
+
+
+def test_watchdog_leaves_warm_up_to_the_workers(app):
+    if app.device.type != "cpu":
+        pytest.skip("a GPU is always driven in-process")
+    args = app.parse_args(["--headless", "photos", "--decode-timeout"])
+    assert args.decode_timeout == app.DECODE_TIMEOUT
+    assert not app.start_warm_up(4, 0, args.decode_timeout, args.inference_timeout)
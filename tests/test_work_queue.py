@@ -0,0 +1,139 @@
+import time
+
+import pytest
+
+import work_queue
+from result_sinks import LABEL_ERROR, LABEL_WATERMARK, make_record, read_records
+from work_queue import QueueSink, SharedWorkQueue, export_results
+
+LEASE = 0.3
+
+
+@pytest.fixture
+def photos(tmp_path):
+    root = tmp_path / "photos"
+    root.mkdir()
+    for index in range(6):
+        (root / f"{index}.jpg").write_bytes(b"jpg")
+    return str(root)
+
+
+@pytest.fixture
+def queue_path(tmp_path):
+    return str(tmp_path / "queue.sqlite")
+
+
+@pytest.fixture
+def open_queue(queue_path):
+    queues = []
+
+    def open_queue(claim_size=2, lease_seconds=60.0):
+        queues.append(SharedWorkQueue(queue_path, claim_size, lease_seconds))
+        return queues[-1]
+
+    yield open_queue
+    for worker_queue in queues:
+        worker_queue.close()
+
+
+def filled(worker_queue, photos):
+    worker_queue.fill([photos])
+    worker_queue.fill_thread.join()
+    return worker_queue
+
+
+def complete(worker_queue, image_paths):
+    worker_queue.complete(
+        [make_record(path, LABEL_WATERMARK, 0.9) for path in image_paths]
+    )
+
+
+def test_every_image_gets_exactly_one_result(photos, queue_path, open_queue, tmp_path):
+    first = filled(open_queue(), photos)
+    second = open_queue()
+    # Only the first worker walks the inputs
+    second.fill([photos])
+    assert second.fill_thread is None
+
+    claimed = []
+    while True:
+        image_paths = first.claim() + second.claim()
+        if not image_paths:
+            break
+        claimed += image_paths
+        complete(first, image_paths)
+        complete(second, image_paths)
+    assert len(claimed) == len(set(claimed)) == 6
+    assert not second.wait_for_work()
+
+    output = str(tmp_path / "report.csv")
+    counts, seconds, problems = export_results(queue_path, output)
+    assert problems == [] and counts == {LABEL_WATERMARK: 6} and seconds >= 0
+    assert sorted(record["path"] for record in read_records(output)) == sorted(claimed)
+
+
+def test_heartbeat_keeps_leases(photos, open_queue):
+    holder = filled(open_queue(claim_size=6, lease_seconds=LEASE), photos)
+    image_paths = holder.claim()
+    assert len(image_paths) == 6
+    other = open_queue(lease_seconds=LEASE)
+    # Slow progress, one result per half a lease, keeps the rest claimed
+    for index in range(5):
+        time.sleep(LEASE / 2)
+        complete(holder, image_paths[index : index + 1])
+        assert other.claim() == []
+
+
+def test_hung_worker_loses_its_claims(photos, open_queue):
+    hung = filled(open_queue(claim_size=6, lease_seconds=LEASE), photos)
+    image_paths = hung.claim()
+    # The heartbeat runs on, but no result comes
+    time.sleep(LEASE * 2.5)
+    assert hung._heartbeat.is_alive()
+    assert sorted(open_queue(claim_size=6).claim()) == sorted(image_paths)
+
+
+def test_expired_leases_are_claimed_again(photos, open_queue):
+    crashed = filled(open_queue(claim_size=6, lease_seconds=LEASE), photos)
+    image_paths = crashed.claim()
+    # A worker whose heartbeat stops has crashed
+    crashed._stopped.set()
+    crashed._heartbeat.join()
+    time.sleep(LEASE * 1.5)
+
+    successor = open_queue(claim_size=6, lease_seconds=LEASE)
+    assert successor.wait_for_work()
+    assert sorted(successor.claim()) == sorted(image_paths)
+    # Late results of the lost claims are ignored
+    complete(crashed, image_paths)
+    assert successor.remaining() == 6
+    complete(successor, image_paths)
+    assert successor.remaining() == 0
+
+
+def test_image_losing_every_claim_is_given_up(photos, open_queue, monkeypatch):
+    monkeypatch.setattr(work_queue, "MAX_ATTEMPTS", 2)
+    filled(open_queue(claim_size=6), photos)
+    for _ in range(2):
+        worker_queue = open_queue(claim_size=6, lease_seconds=LEASE)
+        assert len(worker_queue.claim()) == 6
+        worker_queue.close()
+        time.sleep(LEASE * 1.5)
+
+    last = open_queue(claim_size=6, lease_seconds=LEASE)
+    assert last.claim() == []
+    assert last.remaining() == 0
+    assert not last.wait_for_work()
+
+
+def test_export_waits_for_unfinished_images(photos, queue_path, open_queue, tmp_path):
+    worker_queue = filled(open_queue(), photos)
+    sink = QueueSink(worker_queue)
+    for path in worker_queue.claim():
+        sink.write(make_record(path, LABEL_ERROR, error="unreadable"))
+    sink.close()
+
+    output = tmp_path / "report.csv"
+    _, _, problems = export_results(queue_path, str(output))
+    assert problems == [f"{queue_path}: 4 images not processed yet"]
+    assert not output.exists()
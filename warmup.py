@@ -0,0 +1,51 @@
+"""Warm-up of the model before the first real batch.
+
+The first forward pass at a given batch shape pays for one-time setup:
+lazy torch initialisation, oneDNN primitive creation, allocator pools, and
+on a GPU cuDNN algorithm selection. Running dummy batches at the shapes
+detection will use, on a background thread right after the model loads,
+moves that cost out of the way of the first result.
+
+On a GPU, partial batches are also padded to the full batch size: padded
+rows cost next to nothing there, while a new shape would select kernels
+again. On the CPU every row costs its share of the compute, so partial
+batches keep their size and each new shape is set up once.
+"""
+
+import threading
+
+import torch
+
+INPUT_SHAPE = (3, 224, 224)
+
+
+def warm_up(model, batch_sizes, device=torch.device("cpu")):
+    """Run a forward pass at every batch size"""
+    with torch.no_grad():
+        for batch_size in sorted(set(batch_sizes)):
+            model(torch.zeros((batch_size,) + INPUT_SHAPE, device=device))
+    if device.type == "cuda":
+        torch.cuda.synchronize(device)
+
+
+def pad_batch(inputs, batch_size):
+    """Pad a partial batch with zero rows up to batch_size"""
+    missing = batch_size - len(inputs)
+    if missing <= 0:
+        return inputs
+    padding = inputs.new_zeros((missing,) + tuple(inputs.shape[1:]))
+    return torch.cat([inputs, padding])
+
+
+class BackgroundWarmUp:
+    """Warm a model up on a daemon thread"""
+
+    def __init__(self, model, batch_sizes, device=torch.device("cpu")):
+        self.thread = threading.Thread(
+            target=warm_up, args=(model, batch_sizes, device), daemon=True
+        )
+        self.thread.start()
+
+    def wait(self):
+        """Block until the warm-up is done"""
+        self.thread.join()
@@ -1,6 +1,9 @@
+import argparse
+import itertools
 import os
 import sys
 import tempfile
+import time
 from PyQt5.QtWidgets import (
     QApplication,
     QMainWindow,
@@ -28,6 +31,12 @@ from PyQt5.QtWidgets import (
     QMenu,
     QAction,
     QToolButton,
+    QDialog,
+    QDialogButtonBox,
+    QTableView,
+    QHeaderView,
+    QLineEdit,
+    QSpinBox,
 )
 from PyQt5.QtGui import (
     QPixmap,
@@ -39,20 +48,124 @@ from PyQt5.QtGui import (
     QLinearGradient,
     QBrush,
     QPainter,
+    QPen,
+    QImage,
+    QImageReader,
 )
-from PyQt5.QtCore import Qt, QThread, pyqtSignal, QSize, QRect, QPoint
+from PyQt5.QtCore import Qt, QThread, QTimer, pyqtSignal, QSize, QRect, QRectF, QPoint
 
+import numpy as np
 import torch
-from torchvision import transforms, models
+from torchvision import transforms
 from PIL import Image, ImageQt
 
+from architectures import architecture_of, build_model
+from autotune import SAMPLE_SIZE, autotune, load_tuning, save_tuning
+from batch_preprocess import PREPROCESS_DEFINITION, preprocess_batch
+from decoder_pool import DECODE_TIMEOUT, DECODER_PROCESSES, DecoderPool
+from diagnostics import LeakTracker
+from embedding_store import EmbeddingStore, model_fingerprint
+from image_sources import (
+    DEFAULT_READ_AHEAD_BYTES,
+    FolderWalker,
+    ReadAhead,
+    display_name,
+    expand_paths,
+    is_member_path,
+    is_tar_archive,
+    is_zip_member,
+    split_member_path,
+    iter_image_sources,
+    read_zip_member,
+)
+from inference_pool import INFERENCE_TIMEOUT, InferencePool
+from job_queue import (
+    PRIORITY_BACKGROUND,
+    PRIORITY_INTERACTIVE,
+    PRIORITY_NORMAL,
+    PRIORITY_VISIBLE,
+    JobQueue,
+)
+from large_images import DEFAULT_MEMORY_LIMIT, ImageTooLarge, load_rgb, open_image
+from memory_stats import memory_usage, release_free_memory
+from metrics import DetectorMetrics, MetricsServer, TextfileExporter
+from model_weights import load_weights
+from multiframe import FRAME_BUDGET, classify_frames, is_multiframe
+from parity import (
+    DEFAULT_PARITY_DIR,
+    IMAGE_COUNT,
+    MAX_FLIP_RATE,
+    MAX_PROBABILITY_DELTA,
+    compare,
+    format_report,
+    generate_image_set,
+    parity_failures,
+)
+from result_sinks import (
+    LABEL_ERROR,
+    LABEL_NO_WATERMARK,
+    LABEL_SKIPPED,
+    LABEL_WATERMARK,
+    make_record,
+    open_sink,
+)
+from results_table import (
+    COLUMN_IMAGE,
+    RESULT_ERROR,
+    RESULT_NO_WATERMARK,
+    RESULT_SKIPPED,
+    RESULT_WATERMARK,
+    PathRole,
+    ResultsFilterProxy,
+    ResultsTableModel,
+)
+from saliency import HeatmapCache, grad_cam
+from sharding import (
+    ShardPartition,
+    ShardSink,
+    merge_shards,
+    parse_shard,
+    root_names,
+    write_manifest,
+)
+from tensor_cache import TensorCache, transform_fingerprint
+from warmup import BackgroundWarmUp, pad_batch
+from work_queue import (
+    LEASE_SECONDS,
+    QueueSink,
+    SharedWorkQueue,
+    export_results,
+    is_queue_file,
+)
+
+# Bundled builds keep the checkpoint with the unpacked application files; a
+# distilled student (see distill.py) can be run in its place
+MODEL_PATH = os.environ.get("WATERMARK_DETECTOR_MODEL") or os.path.join(
+    getattr(sys, "_MEIPASS", ""), "watermark_detector.pth"
+)
+
 # Load the trained PyTorch model
+load_start = time.perf_counter()
 device = torch.device("cuda" if torch.cuda.is_available() else "cpu")
-model = models.resnet18()
-model.fc = torch.nn.Linear(model.fc.in_features, 2)
-model.load_state_dict(torch.load("watermark_detector.pth", map_location=device))
+
+# Build the network without allocating weights, then use the memory-mapped
+# checkpoint tensors as its parameters (no copy on the CPU)
+state_dict, MODEL_MAPPED = load_weights(MODEL_PATH)
+MODEL_ARCHITECTURE = architecture_of(state_dict)
+with torch.device("meta"):
+    model = build_model(MODEL_ARCHITECTURE)
+model.load_state_dict(state_dict, assign=True)
+del state_dict
 model.to(device)
 model.eval()
+MODEL_LOAD_MS = (time.perf_counter() - load_start) * 1000
+
+# Batches are padded to one shape on a GPU, so cuDNN's pick for it is reused
+torch.backends.cudnn.benchmark = device.type == "cuda"
+
+# Everything up to the pooled features (512-d for the ResNets; shares weights
+# with the model)
+backbone = torch.nn.Sequential(*list(model.children())[:-1])
 
 # Image transformation
 transform = transforms.Compose(
@@ -63,6 +176,98 @@ transform = transforms.Compose(
 )
 
 
+# Number of images fed to the model per forward pass (unless autotuned)
+BATCH_SIZE = 32
+
+
+def predict(image_tensors, with_embeddings=False, padded_size=None):
+    """Run the model on a batch and return (has_watermark, confidence) pairs
+
+    With ``with_embeddings`` the penultimate-layer features are returned as
+    well, as a second N x model.fc.in_features array. With ``padded_size``
+    a partial batch runs padded to that size.
+    """
+    # Decoding the first batch overlaps the warm-up; its forward pass waits
+    finish_warm_up()
+    count = len(image_tensors)
+    inputs = image_tensors.to(device)
+    if padded_size is not None:
+        inputs = pad_batch(inputs, padded_size)
+    with torch.no_grad():
+        # Same computation as model(...), keeping the features before fc
+        features = torch.flatten(backbone(inputs), 1)[:count]
+        output = model.fc(features)
+        probabilities = torch.nn.functional.softmax(output, dim=1)
+        confidence, predicted = torch.max(probabilities, 1)
+
+    # 1 = Watermark, 0 = No Watermark
+    predictions = [
+        (label == 1, confidence_value)
+        for label, confidence_value in zip(predicted.tolist(), confidence.tolist())
+    ]
+    if with_embeddings:
+        return predictions, features.cpu().numpy()
+    return predictions
+
+
+# Warm-up of the in-process model, started once the app knows its batch size
+background_warm_up = None
+
+
+def inference_in_process(workers, decode_timeout, inference_timeout):
+    """Whether a detection thread with these settings runs the model itself"""
+    # Mirrors WatermarkDetectionThread: on the CPU, workers or a watchdog
+    # move inference to the pool processes
+    return device.type != "cpu" or not (workers or decode_timeout or inference_timeout)
+
+
+def start_warm_up(batch_size, workers=0, decode_timeout=None, inference_timeout=None):
+    """Warm the model up in the background for single images and full batches
+
+    Only done when a detection thread with these settings runs the model
+    itself (the default on the CPU, and always on a GPU, where full
+    batches are the padded shape); pool workers warm up by themselves.
+    Returns whether a warm-up was started.
+    """
+    global background_warm_up
+    if not inference_in_process(workers, decode_timeout, inference_timeout):
+        return False
+    background_warm_up = BackgroundWarmUp(model, [1, batch_size], device)
+    return True
+
+
+def finish_warm_up():
+    """Wait for a running warm-up (before forking, or a real forward pass)"""
+    if background_warm_up is not None:
+        background_warm_up.wait()
+
+
+def startup_metrics():
+    """Describe how long the model took to load and the memory in use"""
+    text = "Model {} loaded in {:.0f} ms ({})".format(
+        MODEL_ARCHITECTURE,
+        MODEL_LOAD_MS,
+        "memory-mapped" if MODEL_MAPPED else "read into memory",
+    )
+    usage = memory_usage()
+    if usage is not None:
+        resident, shared = usage
+        text += ", {:.0f} MB resident ({:.0f} MB shared)".format(
+            resident / 2**20, shared / 2**20
+        )
+    return text
+
+
+def format_explanation(has_watermark, confidence_value):
+    """Create the explanation text for a detection result"""
+    # Format confidence as percentage string
+    confidence_str = "{:.1f}%".format(confidence_value * 100)
+
+    if has_watermark:
+        return "Watermark detected (Confidence: {})".format(confidence_str)
+    return "No watermark detected (Confidence: {})".format(confidence_str)
+
+
 class WatermarkDetectionThread(QThread):
     """Thread for running watermark detection to keep UI responsive"""
 
@@ -72,87 +277,601 @@ class WatermarkDetectionThread(QThread):
     progress_update = pyqtSignal(int, int)  # current, total
     all_completed = pyqtSignal()
     error = pyqtSignal(str, str)  # image_path, error_message
-
-    def __init__(self, image_paths):
+    skipped = pyqtSignal(str, str)  # image_path, reason
+
+    def __init__(
+        self,
+        image_paths,
+        tensor_cache=None,
+        fast_preprocess=False,
+        embedding_store=None,
+        result_sink=None,
+        workers=0,
+        batch_size=BATCH_SIZE,
+        frame_stride=None,
+        frame_budget=FRAME_BUDGET,
+        image_memory_limit=DEFAULT_MEMORY_LIMIT,
+        decode_timeout=None,
+        inference_timeout=None,
+        metrics=None,
+        read_ahead=None,
+        threads=None,
+    ):
         super().__init__()
+        # A list of paths, a lazy iterable such as a FolderWalker, or a
+        # JobQueue that is served in priority order until it runs dry
         self.image_paths = image_paths
+        self.tensor_cache = tensor_cache
+        self.fast_preprocess = fast_preprocess
+        self.embedding_store = embedding_store
+        # Receives one record per image; closed when the run ends
+        self.result_sink = result_sink
+        # Worker processes share CPU weights; a GPU is driven by one process
+        self.workers = workers if device.type == "cpu" else 0
+        self.pool = None
+        self.batch_size = batch_size
+        # Sampling of animated and multi-page images (no stride: spread evenly)
+        self.frame_sampling = (frame_stride, frame_budget)
+        # Larger images are reduced while they are decoded, or skipped
+        self.image_memory_limit = image_memory_limit
+        # Per-image time budgets (None or 0: none, the default). With either
+        # one, decoding runs in killable decoder processes and inference in
+        # pool workers; a GPU is driven from this thread, so there decoding
+        # stays in-process. The watchdog costs process hops, so it is opt-in.
+        self.decode_timeout = decode_timeout
+        self.inference_timeout = inference_timeout
+        self.watchdog = device.type == "cpu" and bool(
+            decode_timeout or inference_timeout
+        )
+        self.decoders = None
+        # DetectorMetrics updated as images are processed
+        self.metrics = metrics
+        # ReadAhead reading plain files into memory ahead of decoding
+        self.read_ahead = read_ahead
+        # Intra-op threads of every pool worker (None: split the cores);
+        # in-process inference uses the threads set on torch
+        self.threads = threads
+        self.processed = 0
 
     def run(self):
-        total_images = len(self.image_paths)
+        # Streamed inputs have no known total; report 0 until they are done
+        try:
+            self.total_images = len(self.image_paths)
+        except TypeError:
+            self.total_images = 0
+        self.processed = 0
+        # Under the watchdog the forward passes run in (killable) workers too
+        workers = max(1, self.workers) if self.watchdog else self.workers
+        if workers > 0 or self.watchdog:
+            # Not forking while the warm-up thread is inside torch
+            finish_warm_up()
+        if workers > 0:
+            self.pool = InferencePool(
+                model,
+                transform,
+                workers,
+                self.fast_preprocess,
+                with_embeddings=self.embedding_store is not None,
+                return_inputs=self.tensor_cache is not None,
+                frame_sampling=self.frame_sampling,
+                image_memory_limit=self.image_memory_limit,
+                inference_timeout=self.inference_timeout or None,
+                batch_size=self.batch_size,
+                threads=self.threads,
+            )
+        if self.metrics is not None:
+            self.watch_queue_depths()
+        if self.watchdog:
+            self.decoders = DecoderPool(
+                model,
+                transform,
+                max(DECODER_PROCESSES, self.workers),
+                self.fast_preprocess,
+                self.frame_sampling,
+                self.image_memory_limit,
+                timeout=self.decode_timeout or None,
+                inference_timeout=self.inference_timeout or None,
+            )
+        try:
+            if isinstance(self.image_paths, JobQueue):
+                self.process_queue(self.image_paths)
+            else:
+                self.process_images(self.image_paths)
+        finally:
+            if self.decoders is not None:
+                self.decoders.close()
+                self.decoders = None
+            if self.pool is not None:
+                self.pool.close()
+                self.pool = None
+
+        if self.tensor_cache is not None:
+            self.tensor_cache.flush()
+        if self.embedding_store is not None:
+            self.embedding_store.flush()
+        if self.result_sink is not None:
+            self.result_sink.close()
 
-        for i, image_path in enumerate(self.image_paths):
-            try:
-                # Update progress
-                self.progress_update.emit(i + 1, total_images)
+        # Signal that all images have been processed
+        self.all_completed.emit()
 
-                # Open and process the image
-                image = Image.open(image_path).convert("RGB")
-                image_tensor = transform(image).unsqueeze(0).to(device)
+    def watch_queue_depths(self):
+        """Have the metrics read the queue depths whenever they are scraped"""
+        image_paths = self.image_paths
+        if isinstance(image_paths, JobQueue):
+            input_depth = lambda: image_paths.depth
+        elif isinstance(image_paths, FolderWalker):
+            input_depth = lambda: image_paths.queued
+        else:
+            input_depth = lambda: 0
+        queue_depth = self.metrics.queue_depth
+        queue_depth.labels("input").set_function(input_depth)
+        queue_depth.labels("pool").set_function(
+            lambda: self.pool.in_flight if self.pool is not None else 0
+        )
 
-                # Make prediction
-                with torch.no_grad():
-                    output = model(image_tensor)
-                    probabilities = torch.nn.functional.softmax(output, dim=1)
-                    confidence, predicted = torch.max(probabilities, 1)
-                    confidence_value = confidence.item()
+    def process_queue(self, job_queue):
+        """Process the paths of a job queue, best priority first"""
+        # One stream for the whole session, so the pool stays fed across
+        # batches and consecutive members of a tar are read in one pass
+        self.process_images(self.queued_paths(job_queue))
+
+    def queued_paths(self, job_queue):
+        """Yield paths from a job queue a batch at a time until it runs dry"""
+        while True:
+            # Take one batch per pool worker so all of them stay busy
+            image_paths = job_queue.take(self.batch_size * max(1, self.workers))
+            if not image_paths:
+                return
+            self.total_images = job_queue.total
+            yield from image_paths
+
+    def process_images(self, image_paths):
+        """Decode, batch and classify every image path"""
+        cached_batch = []
+
+        def uncached_paths():
+            """Pass through paths that must be decoded, batching cache hits"""
+            for image_path in image_paths:
+                slot = None
+                # A whole tar never hits: its members are only known once
+                # the pass reading it comes across them
+                if self.tensor_cache is not None:
+                    slot = self.tensor_cache.lookup(image_path)
+                    if self.metrics is not None:
+                        result = "miss" if slot is None else "hit"
+                        self.metrics.cache_lookups.labels(result).inc()
+                if slot is None:
+                    yield image_path
+                    continue
+
+                # Feed previously preprocessed inputs straight from the cache
+                cached_batch.append((image_path, slot))
+                if len(cached_batch) >= self.batch_size:
+                    self.run_cached_batch(cached_batch)
+                    cached_batch.clear()
+
+        # Archive members arrive as in-memory buffers, plain files as paths
+        sources = iter_image_sources(uncached_paths(), read_ahead=self.read_ahead)
+        if self.decoders is not None:
+            decoded_images = self.decoders.decode(sources)
+        else:
+            decoded_images = self.decode_sources(sources)
+        decoded_batch = []
+
+        for image_path, decoded, decode_ms in decoded_images:
+            if isinstance(decoded, ImageTooLarge):
+                self.report_skipped(image_path, str(decoded), decode_ms)
+            elif isinstance(decoded, Exception):
+                self.report_error(image_path, str(decoded), decode_ms)
+            elif isinstance(decoded, tuple):
+                # Frames of an animated image were classified by the decoder
+                has_watermark, confidence_value = decoded
+                self.report_result(
+                    image_path, has_watermark, confidence_value, decode_ms, 0.0
+                )
+            else:
+                decoded_batch.append((image_path, decoded, decode_ms))
 
-                # Return the prediction (1 = Watermark, 0 = No Watermark)
-                has_watermark = predicted.item() == 1
+            if len(decoded_batch) >= self.batch_size:
+                self.run_decoded_batch(decoded_batch)
+                decoded_batch.clear()
 
-                # Format confidence as percentage
-                confidence_pct = confidence_value * 100
+        if decoded_batch:
+            self.run_decoded_batch(decoded_batch)
 
-                # Format confidence as percentage string
-                confidence_str = "{:.1f}%".format(confidence_pct)
+        if cached_batch:
+            self.run_cached_batch(cached_batch)
 
-                # Create explanation based on detection result
-                if has_watermark:
-                    explanation = "Watermark detected (Confidence: {})".format(
-                        confidence_str
-                    )
+        # Collect the batches the workers are still running
+        while self.pool is not None and self.pool.in_flight:
+            self.handle_pool_result(self.pool.next_result())
+
+    def decode_sources(self, sources):
+        """Decode images in this thread, yielding (image_path, decoded, decode_ms)
+
+        Failures are yielded as the exception. Animated and multi-page
+        images are classified and reported right away.
+        """
+        for image_path, source, read_error in sources:
+            decode_start = time.perf_counter()
+            try:
+                if read_error is not None:
+                    raise read_error
+
+                # Open and decode the image; resizing happens per batch
+                if self.pool is not None:
+                    # Workers decode; send them the path or the archived bytes
+                    decoded = source if isinstance(source, str) else source.getvalue()
                 else:
-                    explanation = "No watermark detected (Confidence: {})".format(
-                        confidence_str
-                    )
+                    with open_image(source) as image:
+                        if is_multiframe(image):
+                            # Classified on their own, one chunk of frames at a time
+                            self.run_frames(image_path, image, decode_start)
+                            continue
+                        rgb_image = load_rgb(image, self.image_memory_limit)
+                        if self.fast_preprocess:
+                            decoded = np.asarray(rgb_image)
+                        else:
+                            decoded = transform(rgb_image)
+            except Exception as e:
+                decoded = e
+            decode_ms = (time.perf_counter() - decode_start) * 1000
+            yield image_path, decoded, decode_ms
+
+    def report_progress(self):
+        """Count one more processed image and emit the progress"""
+        self.processed += 1
+        # A tar counts as one path until its images are listed
+        if self.total_images:
+            self.total_images = max(self.total_images, self.processed)
+        self.progress_update.emit(self.processed, self.total_images)
+
+    def run_decoded_batch(self, decoded_batch):
+        """Preprocess and run the model on a batch of decoded images"""
+        image_paths = [image_path for image_path, _, _ in decoded_batch]
+        decode_times = [decode_ms for _, _, decode_ms in decoded_batch]
+        if self.metrics is not None:
+            self.metrics.batch_size.observe(len(image_paths))
+        if self.pool is not None and self.decoders is None:
+            self.submit_to_pool(
+                image_paths, payloads=[decoded for _, decoded, _ in decoded_batch]
+            )
+            return
 
-                # Emit result for this image
-                self.result_ready.emit(
-                    image_path, has_watermark, explanation, confidence_value
+        batch_start = time.perf_counter()
+        try:
+            if self.fast_preprocess:
+                batch = preprocess_batch([decoded for _, decoded, _ in decoded_batch])
+            else:
+                batch = torch.stack([decoded for _, decoded, _ in decoded_batch])
+
+            if self.tensor_cache is not None:
+                for image_path, image_tensor in zip(image_paths, batch):
+                    self.tensor_cache.store(image_path, image_tensor)
+
+            if self.pool is not None:
+                # Decoded by the decoder processes; inference runs in the pool
+                self.submit_to_pool(
+                    image_paths, inputs=batch, decode_times=decode_times
+                )
+                return
+            predictions = self.predict_batch(image_paths, batch)
+        except Exception as e:
+            predictions = [e] * len(image_paths)
+
+        # Batch preprocessing and inference time is shared by its images
+        inference_ms = (time.perf_counter() - batch_start) * 1000 / len(image_paths)
+        self.emit_predictions(image_paths, predictions, decode_times, inference_ms)
+
+    def run_frames(self, image_path, image, decode_start):
+        """Classify the sampled frames of an animated or multi-page image"""
+        stride, budget = self.frame_sampling
+        result = classify_frames(
+            image,
+            predict,
+            transform,
+            stride,
+            budget,
+            memory_limit=self.image_memory_limit,
+        )
+        decode_ms = (time.perf_counter() - decode_start) * 1000 - result.inference_ms
+        self.report_result(
+            image_path,
+            result.has_watermark,
+            result.confidence,
+            decode_ms,
+            result.inference_ms,
+        )
+
+    def run_cached_batch(self, cached_batch):
+        """Run the model on a batch of (image_path, slot) cache hits"""
+        # Reading in slot order keeps memmap access sequential
+        cached_batch = sorted(cached_batch, key=lambda item: item[1])
+        image_paths = [image_path for image_path, _ in cached_batch]
+        if self.metrics is not None:
+            self.metrics.batch_size.observe(len(image_paths))
+        batch_start = time.perf_counter()
+        try:
+            batch = self.tensor_cache.load_batch([slot for _, slot in cached_batch])
+            if self.pool is not None:
+                self.submit_to_pool(image_paths, inputs=batch)
+                return
+            predictions = self.predict_batch(image_paths, batch)
+        except Exception as e:
+            predictions = [e] * len(cached_batch)
+
+        # Cached inputs need no decoding
+        inference_ms = (time.perf_counter() - batch_start) * 1000 / len(image_paths)
+        decode_times = [0.0] * len(image_paths)
+        self.emit_predictions(image_paths, predictions, decode_times, inference_ms)
+
+    def submit_to_pool(
+        self, image_paths, payloads=None, inputs=None, decode_times=None
+    ):
+        """Queue a batch for the workers, handling results while the pool is full"""
+        while self.pool.in_flight >= self.pool.max_in_flight:
+            self.handle_pool_result(self.pool.next_result())
+        self.pool.submit(image_paths, payloads, inputs, decode_times)
+
+    def handle_pool_result(self, result):
+        """Cache, store and emit a batch result returned by a worker"""
+        if result.inputs is not None and self.tensor_cache is not None:
+            for image_path, image_tensor in zip(result.batched_paths, result.inputs):
+                self.tensor_cache.store(image_path, image_tensor)
+        if result.embeddings is not None and self.embedding_store is not None:
+            self.embedding_store.add(result.batched_paths, result.embeddings)
+
+        self.emit_predictions(
+            result.image_paths,
+            result.predictions,
+            result.decode_times,
+            result.inference_ms,
+        )
+
+    def predict_batch(self, image_paths, batch):
+        """Run the model, keeping the embeddings when a store is attached"""
+        # Fixed shape on a GPU; on the CPU padded rows would cost real time
+        padded_size = self.batch_size if device.type == "cuda" else None
+        if self.embedding_store is None:
+            return predict(batch, padded_size=padded_size)
+
+        predictions, embeddings = predict(
+            batch, with_embeddings=True, padded_size=padded_size
+        )
+        self.embedding_store.add(image_paths, embeddings)
+        return predictions
+
+    def emit_predictions(self, image_paths, predictions, decode_times, inference_ms):
+        """Emit results (or errors) for a batch of predictions"""
+        for image_path, prediction, decode_ms in zip(
+            image_paths, predictions, decode_times
+        ):
+            if isinstance(prediction, ImageTooLarge):
+                self.report_skipped(image_path, str(prediction), decode_ms)
+            elif isinstance(prediction, Exception):
+                self.report_error(image_path, str(prediction), decode_ms, inference_ms)
+            else:
+                has_watermark, confidence_value = prediction
+                self.report_result(
+                    image_path, has_watermark, confidence_value, decode_ms, inference_ms
+                )
+
+    def report_result(
+        self, image_path, has_watermark, confidence_value, decode_ms, inference_ms
+    ):
+        """Record and emit the result for a single image"""
+        self.report_progress()
+        label = LABEL_WATERMARK if has_watermark else LABEL_NO_WATERMARK
+        if self.metrics is not None:
+            self.metrics.observe_image(label, decode_ms, inference_ms)
+        if self.result_sink is not None:
+            self.result_sink.write(
+                make_record(
+                    image_path, label, confidence_value, decode_ms, inference_ms
                 )
+            )
+
+        explanation = format_explanation(has_watermark, confidence_value)
+        self.result_ready.emit(image_path, has_watermark, explanation, confidence_value)
+
+    def report_error(
+        self, image_path, error_message, decode_ms=None, inference_ms=None
+    ):
+        """Record and emit the error for a single image"""
+        self.report_progress()
+        if self.metrics is not None:
+            self.metrics.observe_image(LABEL_ERROR, decode_ms, inference_ms)
+        if self.result_sink is not None:
+            self.result_sink.write(
+                make_record(
+                    image_path,
+                    LABEL_ERROR,
+                    decode_ms=decode_ms,
+                    inference_ms=inference_ms,
+                    error=error_message,
+                )
+            )
+
+        self.error.emit(image_path, error_message)
+
+    def report_skipped(self, image_path, reason, decode_ms=None):
+        """Record and emit an image that was not classified"""
+        self.report_progress()
+        if self.metrics is not None:
+            self.metrics.observe_image(LABEL_SKIPPED, decode_ms)
+        if self.result_sink is not None:
+            self.result_sink.write(
+                make_record(
+                    image_path, LABEL_SKIPPED, decode_ms=decode_ms, error=reason
+                )
+            )
+
+        self.skipped.emit(image_path, reason)
+
+
+# Images per Grad-CAM forward/backward pass
+HEATMAP_BATCH_SIZE = 8
+
+# Alpha of the overlay where the heatmap peaks
+HEATMAP_OPACITY = 160
+
+
+class HeatmapThread(QThread):
+    """Thread computing Grad-CAM heatmaps requested from the UI
+
+    Requests go through their own job queue, so an opened result is served
+    before the rest of a batch request. Cached heatmaps are returned
+    without running the model.
+    """
+
+    heatmap_ready = pyqtSignal(str, object)  # image_path, 7x7 heatmap array
+    error = pyqtSignal(str, str)  # image_path, error_message
+
+    def __init__(self, job_queue, heatmap_cache):
+        super().__init__()
+        self.job_queue = job_queue
+        self.heatmap_cache = heatmap_cache
 
+    def run(self):
+        while True:
+            image_paths = self.job_queue.take(HEATMAP_BATCH_SIZE)
+            if not image_paths:
+                break
+
+            uncached_paths = []
+            for image_path in image_paths:
+                try:
+                    heatmap = self.heatmap_cache.get(image_path)
+                except OSError as e:
+                    self.error.emit(image_path, str(e))
+                    continue
+                if heatmap is not None:
+                    self.heatmap_ready.emit(image_path, heatmap)
+                else:
+                    uncached_paths.append(image_path)
+
+            decoded_paths = []
+            decoded = []
+            for image_path, source, read_error in iter_image_sources(uncached_paths):
+                try:
+                    if read_error is not None:
+                        raise read_error
+                    with open_image(source) as image:
+                        decoded.append(transform(load_rgb(image)))
+                    decoded_paths.append(image_path)
+                except Exception as e:
+                    self.error.emit(image_path, str(e))
+            if not decoded:
+                continue
+
+            try:
+                heatmaps = grad_cam(model, torch.stack(decoded).to(device))
             except Exception as e:
-                self.error.emit(image_path, str(e))
+                for image_path in decoded_paths:
+                    self.error.emit(image_path, str(e))
+                continue
+
+            for image_path, heatmap in zip(decoded_paths, heatmaps):
+                try:
+                    self.heatmap_cache.store(image_path, heatmap)
+                except OSError:
+                    # The map is still shown, just computed again next time
+                    pass
+                self.heatmap_ready.emit(image_path, heatmap)
+
+
+def overlay_heatmap(pixmap, heatmap):
+    """Return a copy of pixmap with a heatmap blended over it in red"""
+    # Red with an opacity that follows the heatmap value
+    height, width = heatmap.shape
+    pixels = np.zeros((height, width, 4), dtype=np.uint8)
+    pixels[..., 2] = 255
+    pixels[..., 3] = (np.clip(heatmap, 0, 1) * HEATMAP_OPACITY).astype(np.uint8)
+    image = QImage(pixels.data, width, height, width * 4, QImage.Format_ARGB32)
+
+    # The model saw the image stretched to a square, so stretch the map back
+    image = image.scaled(pixmap.size(), Qt.IgnoreAspectRatio, Qt.SmoothTransformation)
+    result = QPixmap(pixmap)
+    painter = QPainter(result)
+    painter.drawImage(0, 0, image)
+    painter.end()
+    return result
+
+
+# Static styles of every thumbnail, set once on the grid. Status labels
+# switch between rules through their "state" property.
+THUMBNAIL_STYLE = """
+    ImageThumbnail QLabel {
+        background-color: transparent;
+        border: none;
+    }
+    QLabel#thumbnailStatus {
+        background-color: #f0f0f0;
+        color: #777777;
+        border-radius: 4px;
+        padding: 4px 8px;
+        font-weight: bold;
+        margin: 5px;
+    }
+    QLabel#thumbnailStatus[state="watermark"] {
+        background-color: #ffebee;
+        color: #c62828;
+        border: 1px solid #ef9a9a;
+    }
+    QLabel#thumbnailStatus[state="clean"] {
+        background-color: #e8f5e9;
+        color: #2e7d32;
+        border: 1px solid #a5d6a7;
+    }
+    QLabel#thumbnailStatus[state="error"] {
+        background-color: #fff3e0;
+        color: #e65100;
+        border: 1px solid #ffcc80;
+    }
+    QLabel#thumbnailStatus[state="skipped"] {
+        background-color: #f5f5f5;
+        color: #616161;
+        border: 1px solid #bdbdbd;
+    }
+"""
+
+# Card colors: (background, border, border width) per selection/hover state
+THUMBNAIL_SELECTED_COLORS = (QColor("#e3f2fd"), QColor("#2196f3"), 2)
+THUMBNAIL_HOVER_COLORS = (QColor("white"), QColor("#3498db"), 1)
+THUMBNAIL_COLORS = (QColor("white"), QColor("#e0e0e0"), 1)
+
+
+class ThumbnailState:
+    """Selection and detection state of all thumbnails, kept in one place
+
+    Thumbnails read their state from here when painting, so changing the
+    selection of many images is a set update followed by one repaint.
+    """
 
-        # Signal that all images have been processed
-        self.all_completed.emit()
+    def __init__(self):
+        self.selected = set()
+        # image path -> (has_watermark, explanation, confidence)
+        self.results = {}
+
+    def clear(self):
+        self.selected.clear()
+        self.results.clear()
 
 
 class ImageThumbnail(QFrame):
     """Custom widget for displaying an image thumbnail with detection results"""
 
-    def __init__(self, image_path, parent=None):
+    def __init__(self, image_path, state, parent=None):
         super().__init__(parent)
         self.image_path = image_path
-        self.has_watermark = None
-        self.explanation = ""
-        self.confidence = 0.0
-        self.selected = False
+        self.state = state
+        # Scaled image without any overlay
+        self.pixmap = None
 
-        # Set up the UI
+        # Set up the UI; the card is painted in paintEvent
         self.setFrameShape(QFrame.NoFrame)
-        self.setStyleSheet(
-            """
-            QFrame {
-                background-color: white;
-                border-radius: 8px;
-                border: 1px solid #e0e0e0;
-            }
-            QFrame:hover {
-                border: 1px solid #3498db;
-                box-shadow: 0 4px 8px rgba(0, 0, 0, 0.1);
-            }
-        """
-        )
+        self.setAttribute(Qt.WA_Hover)
         self.setMinimumSize(150, 120)
         self.setMaximumSize(200, 170)
 
@@ -168,25 +887,15 @@ class ImageThumbnail(QFrame):
 
         # File name label
         self.filename_label = QLabel(os.path.basename(image_path))
+        self.filename_label.setToolTip(display_name(image_path))
         self.filename_label.setAlignment(Qt.AlignCenter)
         self.filename_label.setWordWrap(True)
         layout.addWidget(self.filename_label)
 
-        # Status label with modern styling
+        # Status label, styled by THUMBNAIL_STYLE
         self.status_label = QLabel("Pending")
+        self.status_label.setObjectName("thumbnailStatus")
         self.status_label.setAlignment(Qt.AlignCenter)
-        self.status_label.setStyleSheet(
-            """
-            QLabel {
-                background-color: #f0f0f0;
-                color: #777777;
-                border-radius: 4px;
-                padding: 4px 8px;
-                font-weight: bold;
-                margin: 5px;
-            }
-        """
-        )
         layout.addWidget(self.status_label)
 
         self.setLayout(layout)
@@ -194,109 +903,126 @@ class ImageThumbnail(QFrame):
         # Load the image
         self.load_image()
 
+    @property
+    def selected(self):
+        return self.image_path in self.state.selected
+
+    @property
+    def has_watermark(self):
+        result = self.state.results.get(self.image_path)
+        return result[0] if result else None
+
+    @property
+    def explanation(self):
+        result = self.state.results.get(self.image_path)
+        return result[1] if result else ""
+
+    @property
+    def confidence(self):
+        result = self.state.results.get(self.image_path)
+        return result[2] if result else 0.0
+
     def load_image(self):
         """Load and display the image thumbnail"""
-        pixmap = QPixmap(self.image_path)
+        if is_zip_member(self.image_path):
+            # Zip members support random access, so read them straight into memory
+            pixmap = QPixmap()
+            try:
+                pixmap.loadFromData(read_zip_member(self.image_path))
+            except Exception:
+                pass
+        elif is_member_path(self.image_path):
+            # Tar members are only read sequentially during detection
+            self.image_label.setText("Archived image")
+            return
+        elif is_tar_archive(self.image_path):
+            # Its images are listed and shown as detection reads them
+            self.image_label.setText("Tar archive")
+            return
+        else:
+            # Qt decodes images whole; leave out the ones that would not fit
+            size = QImageReader(self.image_path).size()
+            if size.width() * size.height() * 4 > DEFAULT_MEMORY_LIMIT:
+                self.image_label.setText("Large image")
+                return
+            pixmap = QPixmap(self.image_path)
+
         if not pixmap.isNull():
             # Scale the pixmap to fit the label while maintaining aspect ratio
             pixmap = pixmap.scaled(
                 120, 120, Qt.KeepAspectRatio, Qt.SmoothTransformation
             )
+            self.pixmap = pixmap
             self.image_label.setPixmap(pixmap)
         else:
             self.image_label.setText("Failed to load image")
 
+    def set_status(self, text, status):
+        """Show a status text styled by the rule for status"""
+        self.status_label.setText(text)
+        self.status_label.setProperty("state", status)
+        # Property selectors are only re-evaluated on polish
+        self.status_label.style().unpolish(self.status_label)
+        self.status_label.style().polish(self.status_label)
+
     def set_result(self, has_watermark, explanation, confidence=0.0):
         """Set the detection result for this image"""
-        self.has_watermark = has_watermark
-        self.explanation = explanation
-        self.confidence = confidence
+        self.state.results[self.image_path] = (has_watermark, explanation, confidence)
 
         # Format confidence for display
         confidence_pct = confidence * 100
         confidence_text = "{:.1f}%".format(confidence_pct)
 
-        # Update the status label with modern styling
         if has_watermark:
-            self.status_label.setText("Watermark: {}".format(confidence_text))
-            self.status_label.setStyleSheet(
-                """
-                QLabel {
-                    background-color: #ffebee;
-                    color: #c62828;
-                    border: 1px solid #ef9a9a;
-                    border-radius: 4px;
-                    padding: 4px 8px;
-                    font-weight: bold;
-                    margin: 5px;
-                }
-            """
-            )
+            self.set_status("Watermark: {}".format(confidence_text), "watermark")
         else:
-            self.status_label.setText("No Watermark: {}".format(confidence_text))
-            self.status_label.setStyleSheet(
-                """
-                QLabel {
-                    background-color: #e8f5e9;
-                    color: #2e7d32;
-                    border: 1px solid #a5d6a7;
-                    border-radius: 4px;
-                    padding: 4px 8px;
-                    font-weight: bold;
-                    margin: 5px;
-                }
-            """
-            )
+            self.set_status("No Watermark: {}".format(confidence_text), "clean")
 
         # Update the tooltip
         self.setToolTip(explanation)
 
     def set_error(self, error_message):
         """Set an error state for this image"""
-        self.status_label.setText("Error")
-        self.status_label.setStyleSheet(
-            """
-            QLabel {
-                background-color: #fff3e0;
-                color: #e65100;
-                border: 1px solid #ffcc80;
-                border-radius: 4px;
-                padding: 4px 8px;
-                font-weight: bold;
-                margin: 5px;
-            }
-        """
-        )
+        self.state.results.pop(self.image_path, None)
+        self.set_status("Error", "error")
         self.setToolTip("Error: {}".format(error_message))
 
+    def set_skipped(self, reason):
+        """Show that this image was too large to classify"""
+        self.state.results.pop(self.image_path, None)
+        self.set_status("Skipped", "skipped")
+        self.setToolTip("Skipped: {}".format(reason))
+
+    def set_heatmap(self, heatmap):
+        """Overlay a saliency heatmap on the image"""
+        if self.pixmap is not None:
+            self.image_label.setPixmap(overlay_heatmap(self.pixmap, heatmap))
+
     def set_selected(self, selected):
         """Set the selected state of this thumbnail"""
-        self.selected = selected
         if selected:
-            self.setStyleSheet(
-                """
-                QFrame {
-                    background-color: #e3f2fd;
-                    border: 2px solid #2196f3;
-                    border-radius: 8px;
-                    box-shadow: 0 4px 8px rgba(33, 150, 243, 0.3);
-                }
-            """
-            )
+            self.state.selected.add(self.image_path)
         else:
-            self.setStyleSheet(
-                """
-                QFrame {
-                    background-color: white;
-                    border-radius: 8px;
-                    border: 1px solid #e0e0e0;
-                }
-                QFrame:hover {
-                    border: 1px solid #3498db;
-                    box-shadow: 0 4px 8px rgba(0, 0, 0, 0.1);
-                }
-            """
-            )
+            self.state.selected.discard(self.image_path)
+        self.update()
+
+    def paintEvent(self, event):
+        """Paint the card for the current selection and hover state"""
+        if self.selected:
+            background, border, width = THUMBNAIL_SELECTED_COLORS
+        elif self.underMouse():
+            background, border, width = THUMBNAIL_HOVER_COLORS
+        else:
+            background, border, width = THUMBNAIL_COLORS
+
+        painter = QPainter(self)
+        painter.setRenderHint(QPainter.Antialiasing)
+        painter.setPen(QPen(border, width))
+        painter.setBrush(background)
+        inset = width / 2
+        painter.drawRoundedRect(
+            QRectF(self.rect()).adjusted(inset, inset, -inset, -inset), 8, 8
+        )
 
     def mouseReleaseEvent(self, event):
         """Handle mouse click events"""
@@ -314,14 +1040,21 @@ class ImageThumbnail(QFrame):
         super().mouseReleaseEvent(event)
 
 
+# Delay after scrolling before the images in view are reported
+VISIBLE_IMAGES_DELAY_MS = 150
+
+
 class ImageGridWidget(QWidget):
     """Widget for displaying a grid of image thumbnails"""
 
     thumbnail_clicked = pyqtSignal(ImageThumbnail)
+    visible_images_changed = pyqtSignal(list)  # image paths in view
 
     def __init__(self, parent=None):
         super().__init__(parent)
         self.thumbnails = []
+        self.thumbnails_by_path = {}
+        self.state = ThumbnailState()
 
         # Create a scroll area
         self.scroll_area = QScrollArea()
@@ -335,10 +1068,22 @@ class ImageGridWidget(QWidget):
         self.grid_layout = QGridLayout()
         self.grid_layout.setSpacing(5)
         self.grid_widget.setLayout(self.grid_layout)
+        self.grid_widget.setStyleSheet(THUMBNAIL_STYLE)
 
         # Set the grid widget as the scroll area's widget
         self.scroll_area.setWidget(self.grid_widget)
 
+        # Report the images in view once scrolling settles
+        self.visible_timer = QTimer(self)
+        self.visible_timer.setSingleShot(True)
+        self.visible_timer.setInterval(VISIBLE_IMAGES_DELAY_MS)
+        self.visible_timer.timeout.connect(
+            lambda: self.visible_images_changed.emit(self.visible_image_paths())
+        )
+        self.scroll_area.verticalScrollBar().valueChanged.connect(
+            self.visible_timer.start
+        )
+
         # Main layout
         layout = QVBoxLayout()
         layout.addWidget(self.scroll_area)
@@ -350,12 +1095,44 @@ class ImageGridWidget(QWidget):
         self.clear()
 
         # Add new thumbnails
-        for i, path in enumerate(image_paths):
-            thumbnail = ImageThumbnail(path, self)
-            row = i // 4  # 4 thumbnails per row
-            col = i % 4
-            self.grid_layout.addWidget(thumbnail, row, col)
-            self.thumbnails.append(thumbnail)
+        for path in image_paths:
+            self.add_image(path)
+
+    def add_image(self, image_path):
+        """Append a single image to the grid"""
+        i = len(self.thumbnails)
+        thumbnail = ImageThumbnail(image_path, self.state, self)
+        row = i // 4  # 4 thumbnails per row
+        col = i % 4
+        self.grid_layout.addWidget(thumbnail, row, col)
+        self.thumbnails.append(thumbnail)
+        self.thumbnails_by_path[image_path] = thumbnail
+        return thumbnail
+
+    def find_thumbnail(self, image_path):
+        """Get the thumbnail showing an image, or None"""
+        return self.thumbnails_by_path.get(image_path)
+
+    def visible_image_paths(self):
+        """Paths of the thumbnails currently scrolled into view"""
+        top = self.scroll_area.verticalScrollBar().value()
+        bottom = top + self.scroll_area.viewport().height()
+
+        # Rows of 4 run top to bottom; binary search for the first row in view
+        low, high = 0, (len(self.thumbnails) + 3) // 4
+        while low < high:
+            middle = (low + high) // 2
+            if self.thumbnails[middle * 4].geometry().bottom() < top:
+                low = middle + 1
+            else:
+                high = middle
+
+        paths = []
+        for thumbnail in self.thumbnails[low * 4 :]:
+            if thumbnail.geometry().top() > bottom:
+                break
+            paths.append(thumbnail.image_path)
+        return paths
 
     def clear(self):
         """Clear all thumbnails from the grid"""
@@ -365,8 +1142,10 @@ class ImageGridWidget(QWidget):
             if item.widget():
                 item.widget().deleteLater()
 
-        # Clear the thumbnails list
+        # Clear the thumbnails list and their state
         self.thumbnails.clear()
+        self.thumbnails_by_path.clear()
+        self.state.clear()
 
     def get_selected_thumbnails(self):
         """Get all selected thumbnails"""
@@ -378,21 +1157,99 @@ class ImageGridWidget(QWidget):
 
     def select_all(self):
         """Select all thumbnails"""
-        for thumbnail in self.thumbnails:
-            thumbnail.set_selected(True)
+        self.state.selected.update(self.thumbnails_by_path)
+        # One repaint of the grid instead of one per thumbnail
+        self.grid_widget.update()
 
     def deselect_all(self):
         """Deselect all thumbnails"""
-        for thumbnail in self.thumbnails:
-            thumbnail.set_selected(False)
+        self.state.selected.clear()
+        self.grid_widget.update()
+
+
+# Folder scans only create thumbnails for the first results
+MAX_STREAMED_THUMBNAILS = 200
+
+# Result table filter presets: (text, result code or None for all)
+RESULT_FILTERS = (
+    ("All results", None),
+    ("Watermarked", RESULT_WATERMARK),
+    ("Not watermarked", RESULT_NO_WATERMARK),
+    ("Errors", RESULT_ERROR),
+    ("Skipped", RESULT_SKIPPED),
+)
+
+# How long results are buffered before being added to the table
+RESULTS_FLUSH_INTERVAL_MS = 100
+
+# Cosine similarity above which images count as near-variants
+SIMILARITY_THRESHOLD = 0.9
+SIMILAR_IMAGES_LIMIT = 200
+
+
+class SimilarImagesDialog(QDialog):
+    """Dialog listing the stored images most similar to a query image"""
+
+    def __init__(self, image_path, matches, parent=None):
+        super().__init__(parent)
+        self.setWindowTitle("Similar Images")
+        self.resize(500, 400)
+
+        layout = QVBoxLayout()
+
+        header = QLabel(
+            "{} images similar to {}".format(len(matches), display_name(image_path))
+        )
+        header.setFont(QFont("Arial", 10, QFont.Bold))
+        layout.addWidget(header)
+
+        match_list = QListWidget()
+        match_list.setAlternatingRowColors(True)
+        for match_path, similarity in matches:
+            item = QListWidgetItem(
+                "{} - {:.1f}% similar".format(
+                    display_name(match_path), similarity * 100
+                )
+            )
+            item.setToolTip(match_path)
+            match_list.addItem(item)
+        layout.addWidget(match_list)
+
+        buttons = QDialogButtonBox(QDialogButtonBox.Close)
+        buttons.rejected.connect(self.reject)
+        layout.addWidget(buttons)
+
+        self.setLayout(layout)
 
 
 class WatermarkDetectorApp(QMainWindow):
     def __init__(self):
         super().__init__()
         self.image_paths = []
+        self.tensor_cache = None
+        self.embedding_store = None
+        self.export_path = None
+        self.folder_walker = None
+        self.detection_thread = None
+        # Work of all detection jobs, served to one detection thread
+        self.job_queue = JobQueue()
+        # Heatmap requests, computed on demand by their own thread
+        self.heatmap_queue = JobQueue()
+        self.heatmap_cache = None
+        self.heatmap_thread = None
+        # Set by --diagnostics to snapshot resources around every job
+        self.leak_tracker = None
+
+        # Settings found by autotuning on this machine, if it has been tuned
+        self.tuning = load_tuning(model_fingerprint(MODEL_PATH)) or {}
+        if "threads" in self.tuning:
+            torch.set_num_threads(self.tuning["threads"])
+
         self.initUI()
 
+        # Accept files and folders dropped onto the window
+        self.setAcceptDrops(True)
+
     def create_icon(self, icon_type, color):
         """Create an SVG icon for tabs and buttons"""
         icon = QIcon()
@@ -539,7 +1396,7 @@ class WatermarkDetectorApp(QMainWindow):
         # Create status bar
         self.statusBar = QStatusBar()
         self.setStatusBar(self.statusBar)
-        self.statusBar.showMessage("Ready")
+        self.statusBar.showMessage("Ready. " + startup_metrics())
 
     def setup_detection_tab(self):
         # Create main layout
@@ -637,6 +1494,15 @@ class WatermarkDetectorApp(QMainWindow):
         self.select_button.clicked.connect(self.select_images)
         control_layout.addWidget(self.select_button)
 
+        # Folder selection button with icon
+        self.select_folder_button = QPushButton("  Select Folder")
+        self.select_folder_button.setIcon(self.create_icon("select", "white"))
+        self.select_folder_button.setIconSize(QSize(16, 16))
+        self.select_folder_button.setFont(QFont("Arial", 10))
+        self.select_folder_button.setStyleSheet(self.select_button.styleSheet())
+        self.select_folder_button.clicked.connect(self.select_folder)
+        control_layout.addWidget(self.select_folder_button)
+
         # Detect button with icon
         self.detect_button = QPushButton("  Detect Watermarks")
         self.detect_button.setIcon(self.create_icon("detect_all", "white"))
@@ -753,6 +1619,97 @@ class WatermarkDetectorApp(QMainWindow):
         self.clear_button.setEnabled(False)
         control_layout.addWidget(self.clear_button)
 
+        # Find near-duplicates of the selected image from stored embeddings
+        self.find_similar_button = QPushButton("  Find Similar")
+        self.find_similar_button.setIcon(self.create_icon("detect", "white"))
+        self.find_similar_button.setIconSize(QSize(14, 14))
+        self.find_similar_button.setStyleSheet(
+            """
+            QPushButton {
+                background-color: #16a085;
+                color: white;
+                border: none;
+                padding: 6px 12px;
+                border-radius: 4px;
+                font-weight: bold;
+                text-align: left;
+                padding-left: 10px;
+            }
+            QPushButton:hover {
+                background-color: #138d75;
+            }
+            QPushButton:disabled {
+                background-color: #cccccc;
+                color: #888888;
+            }
+        """
+        )
+        self.find_similar_button.clicked.connect(self.find_similar_images)
+        self.find_similar_button.setEnabled(False)
+        control_layout.addWidget(self.find_similar_button)
+
+        # Show where the model sees a watermark in the selected images
+        self.heatmap_button = QPushButton("  Show Heatmaps")
+        self.heatmap_button.setIcon(self.create_icon("detect", "white"))
+        self.heatmap_button.setIconSize(QSize(14, 14))
+        self.heatmap_button.setToolTip(
+            "Compute Grad-CAM heatmaps for the selected images in the background"
+        )
+        self.heatmap_button.setStyleSheet(self.find_similar_button.styleSheet())
+        self.heatmap_button.clicked.connect(self.show_selected_heatmaps)
+        self.heatmap_button.setEnabled(False)
+        control_layout.addWidget(self.heatmap_button)
+
+        # Reuse preprocessed inputs across runs of the same images
+        self.cache_checkbox = QCheckBox("Cache inputs")
+        self.cache_checkbox.setToolTip(
+            "Store preprocessed images in a memory-mapped cache so repeated "
+            "runs skip decoding and resizing"
+        )
+        self.cache_checkbox.setStyleSheet("QCheckBox { border: none; }")
+        control_layout.addWidget(self.cache_checkbox)
+
+        # Resize and convert whole batches as tensors instead of per image
+        self.fast_preprocess_checkbox = QCheckBox("Fast preprocessing")
+        self.fast_preprocess_checkbox.setToolTip(
+            "Resize and convert images in vectorized batches (results may differ "
+            "from the reference preprocessing by one pixel level)"
+        )
+        self.fast_preprocess_checkbox.setStyleSheet("QCheckBox { border: none; }")
+        control_layout.addWidget(self.fast_preprocess_checkbox)
+
+        # Keep the penultimate-layer features for similarity search
+        self.embeddings_checkbox = QCheckBox("Store embeddings")
+        self.embeddings_checkbox.setToolTip(
+            "Save image embeddings during detection so Find Similar can search "
+            "them without running the model again"
+        )
+        self.embeddings_checkbox.setStyleSheet("QCheckBox { border: none; }")
+        control_layout.addWidget(self.embeddings_checkbox)
+
+        # Run inference in worker processes instead of the detection thread
+        workers_label = QLabel("Workers:")
+        workers_label.setStyleSheet("QLabel { border: none; }")
+        control_layout.addWidget(workers_label)
+        self.workers_spin = QSpinBox()
+        self.workers_spin.setRange(0, os.cpu_count() or 1)
+        self.workers_spin.setSpecialValueText("Off")
+        self.workers_spin.setValue(self.tuning.get("workers", 0))
+        self.workers_spin.setToolTip(
+            "Number of worker processes sharing the model for large jobs "
+            "(Off runs detection in a single background thread)"
+        )
+        control_layout.addWidget(self.workers_spin)
+
+        # Stream every result to a CSV, JSONL or Parquet report
+        self.export_checkbox = QCheckBox("Export results")
+        self.export_checkbox.setToolTip(
+            "Write a record for every image to a report file while detection runs"
+        )
+        self.export_checkbox.setStyleSheet("QCheckBox { border: none; }")
+        self.export_checkbox.toggled.connect(self.export_toggled)
+        control_layout.addWidget(self.export_checkbox)
+
         control_panel.setLayout(control_layout)
         main_layout.addWidget(control_panel)
 
@@ -808,6 +1765,7 @@ class WatermarkDetectorApp(QMainWindow):
         # Create image grid (left side)
         self.image_grid = ImageGridWidget()
         self.image_grid.thumbnail_clicked.connect(self.thumbnail_clicked)
+        self.image_grid.visible_images_changed.connect(self.promote_visible_images)
 
         # Create a container for the grid with a title
         grid_container = QFrame()
@@ -852,19 +1810,20 @@ class WatermarkDetectorApp(QMainWindow):
                 font-weight: bold;
                 background-color: transparent;
             }
-            QListWidget {
+            QTableView {
                 border: 1px solid #e0e0e0;
                 border-radius: 4px;
                 background-color: #f8f8f8;
-                padding: 3px;
+                color: black;
+                selection-background-color: #e3f2fd;
+                selection-color: black;
             }
-            QListWidget::item {
+            QHeaderView::section {
+                background-color: #f0f0f0;
+                color: #333333;
                 padding: 3px;
+                border: none;
                 border-bottom: 1px solid #e0e0e0;
-            }
-            QListWidget::item:selected {
-                background-color: #e3f2fd;
-                color: black;
                 font-weight: bold;
             }
         """
@@ -878,89 +1837,56 @@ class WatermarkDetectorApp(QMainWindow):
         results_header.setStyleSheet("padding: 5px; border-bottom: 1px solid #e0e0e0;")
         results_layout.addWidget(results_header)
 
-        # Watermarked images list
-        watermarked_header = QLabel("Watermarked Images")
-        watermarked_header.setFont(QFont("Arial", 10))
-        watermarked_header.setStyleSheet(
-            """
-            color: #c62828;
-            padding: 3px;
-            margin-top: 5px;
-        """
+        # Filter controls
+        filter_layout = QHBoxLayout()
+        self.result_filter_combo = QComboBox()
+        for text, label in RESULT_FILTERS:
+            self.result_filter_combo.addItem(text, label)
+        self.result_filter_combo.currentIndexChanged.connect(self.apply_result_filter)
+        filter_layout.addWidget(self.result_filter_combo)
+
+        confidence_label = QLabel("Confidence below")
+        confidence_label.setStyleSheet("font-weight: normal;")
+        filter_layout.addWidget(confidence_label)
+        self.confidence_filter_spin = QSpinBox()
+        self.confidence_filter_spin.setRange(1, 100)
+        self.confidence_filter_spin.setValue(100)
+        self.confidence_filter_spin.setSuffix("%")
+        self.confidence_filter_spin.setToolTip("100% shows every confidence")
+        self.confidence_filter_spin.valueChanged.connect(self.apply_result_filter)
+        filter_layout.addWidget(self.confidence_filter_spin)
+
+        self.name_filter_edit = QLineEdit()
+        self.name_filter_edit.setPlaceholderText("Filter by name")
+        self.name_filter_edit.textChanged.connect(self.apply_result_filter)
+        filter_layout.addWidget(self.name_filter_edit)
+        results_layout.addLayout(filter_layout)
+
+        # Results table backed by column arrays, sorted and filtered by a proxy
+        self.results_model = ResultsTableModel(self)
+        self.results_proxy = ResultsFilterProxy(self)
+        self.results_proxy.setSourceModel(self.results_model)
+        self.pending_results = []
+
+        self.results_table = QTableView()
+        self.results_table.setModel(self.results_proxy)
+        self.results_table.setSortingEnabled(True)
+        self.results_table.sortByColumn(-1, Qt.AscendingOrder)
+        self.results_table.setSelectionBehavior(QTableView.SelectRows)
+        self.results_table.setSelectionMode(QTableView.SingleSelection)
+        self.results_table.setWordWrap(False)
+        self.results_table.verticalHeader().setVisible(False)
+        self.results_table.verticalHeader().setDefaultSectionSize(22)
+        self.results_table.horizontalHeader().setSectionResizeMode(
+            COLUMN_IMAGE, QHeaderView.Stretch
         )
-        results_layout.addWidget(watermarked_header)
+        self.results_table.setVerticalScrollBarPolicy(Qt.ScrollBarAlwaysOn)
+        results_layout.addWidget(self.results_table)
 
-        self.watermarked_list = QListWidget()
-        self.watermarked_list.setAlternatingRowColors(True)
-        self.watermarked_list.setMaximumHeight(80)  # Limit height
-        self.watermarked_list.setVerticalScrollBarPolicy(Qt.ScrollBarAlwaysOn)
-        self.watermarked_list.setStyleSheet(
-            """
-            QListWidget {
-                background-color: #ffebee;
-                border: 1px solid #ef9a9a;
-                max-height: 80px;
-                color: black;
-            }
-        """
-        )
-        results_layout.addWidget(self.watermarked_list)
-
-        # Non-watermarked images list
-        non_watermarked_header = QLabel("Non-Watermarked Images")
-        non_watermarked_header.setFont(QFont("Arial", 10))
-        non_watermarked_header.setStyleSheet(
-            """
-            color: #2e7d32;
-            padding: 3px;
-            margin-top: 5px;
-        """
-        )
-        results_layout.addWidget(non_watermarked_header)
-
-        self.non_watermarked_list = QListWidget()
-        self.non_watermarked_list.setAlternatingRowColors(True)
-        self.non_watermarked_list.setMaximumHeight(80)  # Limit height
-        self.non_watermarked_list.setVerticalScrollBarPolicy(Qt.ScrollBarAlwaysOn)
-        self.non_watermarked_list.setStyleSheet(
-            """
-            QListWidget {
-                background-color: #e8f5e9;
-                border: 1px solid #a5d6a7;
-                max-height: 80px;
-                color: black;
-            }
-        """
-        )
-        results_layout.addWidget(self.non_watermarked_list)
-
-        # Error list
-        error_header = QLabel("Failed Images")
-        error_header.setFont(QFont("Arial", 10))
-        error_header.setStyleSheet(
-            """
-            color: #e65100;
-            padding: 3px;
-            margin-top: 5px;
-        """
-        )
-        results_layout.addWidget(error_header)
-
-        self.error_list = QListWidget()
-        self.error_list.setAlternatingRowColors(True)
-        self.error_list.setMaximumHeight(60)  # Limit height
-        self.error_list.setVerticalScrollBarPolicy(Qt.ScrollBarAlwaysOn)
-        self.error_list.setStyleSheet(
-            """
-            QListWidget {
-                background-color: #fff3e0;
-                border: 1px solid #ffcc80;
-                max-height: 60px;
-                color: black;
-            }
-        """
-        )
-        results_layout.addWidget(self.error_list)
+        # Results are added to the model in batches rather than one by one
+        self.results_flush_timer = QTimer(self)
+        self.results_flush_timer.setInterval(RESULTS_FLUSH_INTERVAL_MS)
+        self.results_flush_timer.timeout.connect(self.flush_pending_results)
 
         # Add a summary label
         self.summary_label = QLabel("No images analyzed yet")
@@ -980,10 +1906,8 @@ class WatermarkDetectorApp(QMainWindow):
 
         results_container.setLayout(results_layout)
 
-        # Connect list item clicks
-        self.watermarked_list.itemClicked.connect(self.result_item_clicked)
-        self.non_watermarked_list.itemClicked.connect(self.result_item_clicked)
-        self.error_list.itemClicked.connect(self.result_item_clicked)
+        # Connect result clicks
+        self.results_table.clicked.connect(self.result_item_clicked)
 
         # Add the containers to the split view
         split_view.addWidget(grid_container, 55)  # 55% width
@@ -1060,7 +1984,8 @@ class WatermarkDetectorApp(QMainWindow):
             "and can identify whether an image contains a watermark with high accuracy.</p>"
             "<h3>How to use:</h3>"
             "<ol>"
-            "<li>Select multiple images using the <b>Select Images</b> button</li>"
+            "<li>Select multiple images using the <b>Select Images</b> button, "
+            "or a whole folder tree with <b>Select Folder</b> or drag and drop</li>"
             "<li>Click <b>Detect Watermarks</b> to analyze all images</li>"
             "<li>View the results in the grid view with color-coded indicators</li>"
             "</ol>"
@@ -1101,12 +2026,28 @@ class WatermarkDetectorApp(QMainWindow):
         self.about_tab.setLayout(layout)
 
     def select_images(self):
-        """Open a file dialog to select multiple images"""
+        """Open a file dialog to select multiple images or archives"""
         file_dialog = QFileDialog()
         file_dialog.setFileMode(QFileDialog.ExistingFiles)
         file_paths, _ = file_dialog.getOpenFileNames(
-            self, "Select Images", "", "Image Files (*.png *.jpg *.jpeg *.bmp *.webp)"
+            self,
+            "Select Images",
+            "",
+            "Images and Archives (*.png *.jpg *.jpeg *.bmp *.webp *.gif *.tif "
+            "*.tiff *.zip *.tar *.tar.gz *.tgz *.tar.bz2 *.tbz2 *.tar.xz *.txz);;"
+            "Image Files (*.png *.jpg *.jpeg *.bmp *.webp *.gif *.tif *.tiff);;"
+            "Archives (*.zip *.tar *.tar.gz *.tgz *.tar.bz2 *.tbz2 *.tar.xz *.txz)",
         )
+        self.load_images(file_paths)
+
+    def load_images(self, file_paths):
+        """Show a list of images or archives in the grid"""
+        # Replace archives by the image members they contain
+        try:
+            file_paths = expand_paths(file_paths)
+        except Exception as e:
+            QMessageBox.warning(self, "Warning", f"Failed to read archive: {e}")
+            return
 
         if file_paths:
             self.image_paths = file_paths
@@ -1116,11 +2057,17 @@ class WatermarkDetectorApp(QMainWindow):
             self.detect_button.setEnabled(True)
             self.select_all_button.setEnabled(True)
             self.deselect_all_button.setEnabled(True)
-            self.clear_button.setEnabled(True)
+            self.heatmap_button.setEnabled(True)
+            # Images may be loaded while detection runs, to queue another job
+            self.clear_button.setEnabled(not self.detection_running())
 
             # Update status
             self.statusBar.showMessage(f"Loaded {len(file_paths)} images")
 
+    def detection_running(self):
+        """Whether the detection thread is still working through the queue"""
+        return self.detection_thread is not None and self.detection_thread.isRunning()
+
     def detect_watermarks(self):
         """Detect watermarks in all selected images"""
         # Get selected thumbnails or all if none selected
@@ -1134,11 +2081,112 @@ class WatermarkDetectorApp(QMainWindow):
 
         # Get paths of selected images
         selected_paths = [thumb.image_path for thumb in selected_thumbnails]
+        self.start_detection(selected_paths)
+
+    def select_folder(self):
+        """Open a dialog to scan a whole folder tree"""
+        folder = QFileDialog.getExistingDirectory(self, "Select Folder")
+        if folder:
+            self.scan_folders([folder])
+
+    def scan_folders(self, roots):
+        """Walk folder trees in the background, detecting while the walk runs"""
+        self.clear_images()
+        self.folder_walker = FolderWalker(roots)
+        self.start_detection(self.folder_walker, PRIORITY_BACKGROUND)
+
+    def dragEnterEvent(self, event):
+        """Accept dragged files and folders"""
+        if event.mimeData().hasUrls():
+            event.acceptProposedAction()
+
+    def dropEvent(self, event):
+        """Load dropped images, or scan dropped folders"""
+        paths = [
+            url.toLocalFile() for url in event.mimeData().urls() if url.isLocalFile()
+        ]
+        if not paths:
+            return
+
+        event.acceptProposedAction()
+        if self.detection_running():
+            self.queue_dropped(paths)
+        elif any(os.path.isdir(path) for path in paths):
+            self.scan_folders(paths)
+        else:
+            self.load_images(paths)
+
+    def queue_dropped(self, paths):
+        """Add dropped images and folders to the running detection"""
+        folders = [path for path in paths if os.path.isdir(path)]
+        files = [path for path in paths if not os.path.isdir(path)]
+        if folders:
+            folder_walker = FolderWalker(folders)
+            if self.folder_walker is None:
+                # Show what the walk finds, as for a scanned folder
+                self.folder_walker = folder_walker
+            self.start_detection(folder_walker, PRIORITY_BACKGROUND)
+        if files:
+            try:
+                files = expand_paths(files)
+            except Exception as e:
+                QMessageBox.warning(self, "Warning", f"Failed to read archive: {e}")
+                return
+            for path in files:
+                if self.image_grid.find_thumbnail(path) is None:
+                    self.image_grid.add_image(path)
+            self.start_detection(files)
+
+    def export_toggled(self, checked):
+        """Ask where to write the report when exporting is switched on"""
+        if not checked:
+            self.export_path = None
+            self.export_checkbox.setToolTip(
+                "Write a record for every image to a report file while detection runs"
+            )
+            return
+
+        export_path, _ = QFileDialog.getSaveFileName(
+            self,
+            "Export Results",
+            "results.csv",
+            "CSV (*.csv);;JSON Lines (*.jsonl);;Parquet (*.parquet)",
+        )
+        if not export_path:
+            self.export_checkbox.setChecked(False)
+            return
+
+        self.export_path = export_path
+        self.export_checkbox.setToolTip("Exporting results to {}".format(export_path))
+
+    def start_detection(self, image_paths, priority=PRIORITY_NORMAL):
+        """Queue a detection job, starting the detection thread when idle"""
+        if not self.job_queue.add_job(image_paths, priority):
+            # The running thread picks the job up in priority order
+            self.promote_visible_images(self.image_grid.visible_image_paths())
+            self.statusBar.showMessage("Detection job queued")
+            return
+
+        # A thread that just ran out of work may still be finishing up
+        if self.detection_thread is not None:
+            self.detection_thread.wait()
+
+        # Open the report first so a bad export path does not start the run
+        result_sink = None
+        if self.export_path:
+            try:
+                result_sink = open_sink(self.export_path)
+            except Exception as e:
+                QMessageBox.warning(self, "Warning", f"Cannot export results: {e}")
+                self.job_queue = JobQueue()
+                if self.folder_walker is not None:
+                    self.folder_walker.stop()
+                    self.folder_walker = None
+                return
 
         # Clear previous results
-        self.watermarked_list.clear()
-        self.non_watermarked_list.clear()
-        self.error_list.clear()
+        self.pending_results.clear()
+        self.results_model.clear()
         self.summary_label.setText("Processing images...")
         self.summary_label.setStyleSheet(
             """
@@ -1151,98 +2199,197 @@ class WatermarkDetectorApp(QMainWindow):
         """
         )
 
-        # Disable buttons and show progress
-        self.detect_button.setEnabled(False)
-        self.select_button.setEnabled(False)
-        self.select_all_button.setEnabled(False)
-        self.deselect_all_button.setEnabled(False)
+        # Disable buttons and show progress; more jobs can still be queued
+        self.select_folder_button.setEnabled(False)
         self.clear_button.setEnabled(False)
+        self.find_similar_button.setEnabled(False)
 
-        # Show progress bar
+        # Show progress bar (a maximum of 0 shows a busy indicator)
         self.progress_label.setVisible(True)
         self.progress_bar.setVisible(True)
         self.progress_bar.setValue(0)
-        self.progress_bar.setMaximum(len(selected_paths))
+        self.progress_bar.setMaximum(self.job_queue.total)
+
+        # Open the input cache matching the chosen preprocessing on first use
+        fast_preprocess = self.fast_preprocess_checkbox.isChecked()
+        tensor_cache = None
+        if self.cache_checkbox.isChecked():
+            preprocessing = PREPROCESS_DEFINITION if fast_preprocess else transform
+            if (
+                self.tensor_cache is None
+                or self.tensor_cache.fingerprint != transform_fingerprint(preprocessing)
+            ):
+                if self.tensor_cache is not None:
+                    self.tensor_cache.close()
+                self.tensor_cache = TensorCache(preprocessing)
+            tensor_cache = self.tensor_cache
+
+        embedding_store = None
+        if self.embeddings_checkbox.isChecked():
+            embedding_store = self.open_embedding_store()
+
+        if self.leak_tracker is not None:
+            self.leak_tracker.before_job()
+
+        # Tuned threads per worker only fit the tuned number of workers
+        workers = self.workers_spin.value()
+        threads = None
+        if workers == self.tuning.get("workers"):
+            threads = self.tuning.get("threads")
 
         # Create and start the detection thread
-        self.detection_thread = WatermarkDetectionThread(selected_paths)
+        self.detection_thread = WatermarkDetectionThread(
+            self.job_queue,
+            tensor_cache,
+            fast_preprocess,
+            embedding_store,
+            result_sink,
+            workers,
+            self.tuning.get("batch_size", BATCH_SIZE),
+            threads=threads,
+        )
         self.detection_thread.result_ready.connect(self.handle_detection_result)
         self.detection_thread.error.connect(self.handle_detection_error)
+        self.detection_thread.skipped.connect(self.handle_detection_skipped)
         self.detection_thread.progress_update.connect(self.update_progress)
         self.detection_thread.all_completed.connect(self.detection_finished)
         self.detection_thread.start()
+        self.promote_visible_images(self.image_grid.visible_image_paths())
 
         # Update status
-        self.statusBar.showMessage(f"Processing {len(selected_paths)} images...")
+        total = self.job_queue.total
+        if total:
+            self.statusBar.showMessage(f"Processing {total} images...")
+        else:
+            self.statusBar.showMessage("Scanning folders and processing images...")
+
+    def result_thumbnail(self, image_path):
+        """Find the thumbnail for a result, adding one for early folder results
+
+        Images of a tar shown in the grid are only known once detection has
+        read them, so they get a thumbnail as their results come in too.
+        """
+        thumbnail = self.image_grid.find_thumbnail(image_path)
+        archive_path, member_name = split_member_path(image_path)
+        streamed = self.folder_walker is not None or (
+            member_name is not None
+            and self.image_grid.find_thumbnail(archive_path) is not None
+        )
+        if (
+            thumbnail is None
+            and streamed
+            and len(self.image_grid.get_all_thumbnails()) < MAX_STREAMED_THUMBNAILS
+        ):
+            thumbnail = self.image_grid.add_image(image_path)
+        return thumbnail
 
     def handle_detection_result(
         self, image_path, has_watermark, explanation, confidence
     ):
         """Handle the detection result for a single image"""
         # Find the thumbnail for this image
-        for thumbnail in self.image_grid.get_all_thumbnails():
-            if thumbnail.image_path == image_path:
-                thumbnail.set_result(has_watermark, explanation, confidence)
-
-                # Add to the appropriate list
-                if has_watermark:
-                    item_text = f"{os.path.basename(image_path)} - {explanation}"
-                    self.watermarked_list.addItem(item_text)
-                    # Store the full path as item data
-                    self.watermarked_list.item(
-                        self.watermarked_list.count() - 1
-                    ).setData(Qt.UserRole, image_path)
-                else:
-                    item_text = f"{os.path.basename(image_path)} - {explanation}"
-                    self.non_watermarked_list.addItem(item_text)
-                    # Store the full path as item data
-                    self.non_watermarked_list.item(
-                        self.non_watermarked_list.count() - 1
-                    ).setData(Qt.UserRole, image_path)
-                break
+        thumbnail = self.result_thumbnail(image_path)
+        if thumbnail is not None:
+            thumbnail.set_result(has_watermark, explanation, confidence)
+
+        # Queue for the results table
+        label = RESULT_WATERMARK if has_watermark else RESULT_NO_WATERMARK
+        self.queue_result((image_path, label, confidence, None))
 
     def handle_detection_error(self, image_path, error_message):
         """Handle detection error for a single image"""
         # Find the thumbnail for this image
-        for thumbnail in self.image_grid.get_all_thumbnails():
-            if thumbnail.image_path == image_path:
-                thumbnail.set_error(error_message)
-
-                # Add to the error list
-                item_text = f"{os.path.basename(image_path)} - Error: {error_message}"
-                self.error_list.addItem(item_text)
-                # Store the full path as item data
-                self.error_list.item(self.error_list.count() - 1).setData(
-                    Qt.UserRole, image_path
-                )
-                break
+        thumbnail = self.result_thumbnail(image_path)
+        if thumbnail is not None:
+            thumbnail.set_error(error_message)
+
+        # Queue for the results table
+        self.queue_result((image_path, RESULT_ERROR, 0.0, error_message))
+
+    def handle_detection_skipped(self, image_path, reason):
+        """Handle an image too large to classify"""
+        thumbnail = self.result_thumbnail(image_path)
+        if thumbnail is not None:
+            thumbnail.set_skipped(reason)
+
+        self.queue_result((image_path, RESULT_SKIPPED, 0.0, reason))
+
+    def queue_result(self, result):
+        """Buffer a result row until the next batched insert"""
+        self.pending_results.append(result)
+        if not self.results_flush_timer.isActive():
+            self.results_flush_timer.start()
+
+    def flush_pending_results(self):
+        """Insert all buffered result rows into the table in one batch"""
+        self.results_flush_timer.stop()
+        if self.pending_results:
+            self.results_model.append_results(self.pending_results)
+            self.pending_results = []
+
+    def apply_result_filter(self):
+        """Apply the filter controls to the results table"""
+        max_confidence = self.confidence_filter_spin.value()
+        self.results_proxy.set_filter(
+            label=self.result_filter_combo.currentData(),
+            max_confidence=max_confidence / 100 if max_confidence < 100 else None,
+            name=self.name_filter_edit.text(),
+        )
+
+    def promote_visible_images(self, image_paths):
+        """Let the images in view jump ahead of queued work"""
+        self.job_queue.promote(image_paths, PRIORITY_VISIBLE)
 
     def update_progress(self, current, total):
         """Update the progress bar"""
+        # Queued jobs grow the total while detection runs
+        self.progress_bar.setMaximum(total)
         self.progress_bar.setValue(current)
-        self.progress_label.setText(f"Processing image {current} of {total}...")
+        if total:
+            self.progress_label.setText(f"Processing image {current} of {total}...")
+        else:
+            self.progress_label.setText(f"Processing image {current}...")
 
     def detection_finished(self):
         """Clean up after detection is complete"""
+        # Ignore a finished thread that has already been replaced
+        if self.sender() is not self.detection_thread:
+            return
+
+        # Release the folder walk once everything it found has been processed
+        if self.folder_walker is not None:
+            self.folder_walker.stop()
+            self.folder_walker = None
+
         # Re-enable buttons
-        self.detect_button.setEnabled(True)
+        has_images = bool(self.image_grid.get_all_thumbnails())
+        self.detect_button.setEnabled(has_images)
         self.select_button.setEnabled(True)
-        self.select_all_button.setEnabled(True)
-        self.deselect_all_button.setEnabled(True)
+        self.select_folder_button.setEnabled(True)
+        self.select_all_button.setEnabled(has_images)
+        self.deselect_all_button.setEnabled(has_images)
+        self.heatmap_button.setEnabled(has_images)
         self.clear_button.setEnabled(True)
+        self.find_similar_button.setEnabled(has_images)
 
         # Hide progress
         self.progress_label.setVisible(False)
         self.progress_bar.setVisible(False)
 
         # Update summary
-        watermarked_count = self.watermarked_list.count()
-        non_watermarked_count = self.non_watermarked_list.count()
-        error_count = self.error_list.count()
-        total_count = watermarked_count + non_watermarked_count + error_count
+        self.flush_pending_results()
+        watermarked_count = self.results_model.count(RESULT_WATERMARK)
+        non_watermarked_count = self.results_model.count(RESULT_NO_WATERMARK)
+        error_count = self.results_model.count(RESULT_ERROR)
+        skipped_count = self.results_model.count(RESULT_SKIPPED)
+        total_count = (
+            watermarked_count + non_watermarked_count + error_count + skipped_count
+        )
 
         summary_text = f"Analysis complete: {total_count} images processed\n"
         summary_text += f"Watermarked: {watermarked_count} | Non-watermarked: {non_watermarked_count} | Errors: {error_count}"
+        if skipped_count:
+            summary_text += f" | Skipped: {skipped_count}"
 
         self.summary_label.setText(summary_text)
         self.summary_label.setStyleSheet(
@@ -1260,8 +2407,16 @@ class WatermarkDetectorApp(QMainWindow):
         # Update status
         self.statusBar.showMessage("Detection completed")
 
+        # The job's decoded images were freed on its thread; return the space
+        release_free_memory()
+        if self.leak_tracker is not None:
+            self.leak_tracker.after_job()
+
     def thumbnail_clicked(self, thumbnail):
         """Handle thumbnail click event"""
+        # A clicked image still waiting for detection is processed next
+        self.job_queue.promote([thumbnail.image_path], PRIORITY_INTERACTIVE)
+
         # Update status bar with information about the clicked thumbnail
         if thumbnail.has_watermark is not None:
             confidence_pct = thumbnail.confidence * 100
@@ -1271,7 +2426,7 @@ class WatermarkDetectorApp(QMainWindow):
             else:
                 status = "No Watermark (Confidence: {})".format(confidence_str)
             self.statusBar.showMessage(
-                "{}: {}".format(os.path.basename(thumbnail.image_path), status)
+                "{}: {}".format(display_name(thumbnail.image_path), status)
             )
 
     def select_all_images(self):
@@ -1286,11 +2441,12 @@ class WatermarkDetectorApp(QMainWindow):
         """Clear all images from the grid and results"""
         self.image_grid.clear()
         self.image_paths = []
+        # Once the thumbnails have been deleted by the event loop
+        QTimer.singleShot(0, release_free_memory)
 
-        # Clear results lists
-        self.watermarked_list.clear()
-        self.non_watermarked_list.clear()
-        self.error_list.clear()
+        # Clear results
+        self.pending_results.clear()
+        self.results_model.clear()
 
         # Reset summary
         self.summary_label.setText("No images analyzed yet")
@@ -1309,46 +2465,684 @@ class WatermarkDetectorApp(QMainWindow):
         self.detect_button.setEnabled(False)
         self.select_all_button.setEnabled(False)
         self.deselect_all_button.setEnabled(False)
+        self.heatmap_button.setEnabled(False)
         self.clear_button.setEnabled(False)
+        self.find_similar_button.setEnabled(False)
 
         # Update status
         self.statusBar.showMessage("All images cleared")
 
-    def result_item_clicked(self, item):
-        """Handle clicks on result list items"""
-        # Get the full path from the item data
-        image_path = item.data(Qt.UserRole)
+    def open_embedding_store(self):
+        """Open the embedding store for the current model on first use"""
+        if self.embedding_store is None:
+            self.embedding_store = EmbeddingStore(
+                model_fingerprint(MODEL_PATH), dim=model.fc.in_features
+            )
+        return self.embedding_store
+
+    def request_heatmaps(self, image_paths, priority=PRIORITY_NORMAL):
+        """Queue heatmaps, starting the heatmap thread when it is idle"""
+        if not self.heatmap_queue.add_job(list(image_paths), priority):
+            # The running thread picks them up in priority order
+            return
+
+        # A thread that just ran out of work may still be finishing up
+        if self.heatmap_thread is not None:
+            self.heatmap_thread.wait()
+        if self.heatmap_cache is None:
+            self.heatmap_cache = HeatmapCache(model_fingerprint(MODEL_PATH))
+
+        self.heatmap_thread = HeatmapThread(self.heatmap_queue, self.heatmap_cache)
+        self.heatmap_thread.heatmap_ready.connect(self.heatmap_ready)
+        self.heatmap_thread.error.connect(self.heatmap_error)
+        self.heatmap_thread.start()
+
+    def heatmap_ready(self, image_path, heatmap):
+        """Overlay a computed heatmap on the image's thumbnail"""
+        thumbnail = self.image_grid.find_thumbnail(image_path)
+        if thumbnail is not None:
+            thumbnail.set_heatmap(heatmap)
+
+    def heatmap_error(self, image_path, error_message):
+        """Report a heatmap that could not be computed"""
+        self.statusBar.showMessage(
+            "Heatmap of {} failed: {}".format(display_name(image_path), error_message)
+        )
+
+    def show_selected_heatmaps(self):
+        """Compute heatmaps for all selected images"""
+        selected_thumbnails = self.image_grid.get_selected_thumbnails()
+        if not selected_thumbnails:
+            QMessageBox.information(
+                self, "Show Heatmaps", "Select the images to show heatmaps for."
+            )
+            return
+
+        self.request_heatmaps(thumb.image_path for thumb in selected_thumbnails)
+        self.statusBar.showMessage(
+            "Computing heatmaps for {} images".format(len(selected_thumbnails))
+        )
+
+    def find_similar_images(self):
+        """Show the stored images most similar to the selected image"""
+        selected_thumbnails = self.image_grid.get_selected_thumbnails()
+        if len(selected_thumbnails) != 1:
+            QMessageBox.information(
+                self, "Find Similar", "Select exactly one image to search for."
+            )
+            return
+
+        image_path = selected_thumbnails[0].image_path
+        embedding_store = self.open_embedding_store()
+        if image_path not in embedding_store:
+            QMessageBox.information(
+                self,
+                "Find Similar",
+                "No embedding is stored for this image yet. Run detection with "
+                "Store embeddings enabled first.",
+            )
+            return
+
+        matches = embedding_store.search(
+            image_path, k=SIMILAR_IMAGES_LIMIT, min_similarity=SIMILARITY_THRESHOLD
+        )
+
+        # Highlight the matches that are shown in the grid
+        for match_path, _ in matches:
+            thumbnail = self.image_grid.find_thumbnail(match_path)
+            if thumbnail is not None:
+                thumbnail.set_selected(True)
+
+        self.statusBar.showMessage(
+            "{}: {} similar images found".format(display_name(image_path), len(matches))
+        )
+        SimilarImagesDialog(image_path, matches, self).exec_()
+
+    def result_item_clicked(self, index):
+        """Handle clicks on result table rows"""
+        # Get the full path from the row data
+        image_path = index.data(PathRole)
         if not image_path:
             return
 
+        # Show where the model sees a watermark, ahead of batch requests
+        self.request_heatmaps([image_path], PRIORITY_INTERACTIVE)
+
         # Find and highlight the corresponding thumbnail
-        for thumbnail in self.image_grid.get_all_thumbnails():
-            if thumbnail.image_path == image_path:
-                # Deselect all thumbnails first
-                self.image_grid.deselect_all()
-                # Select this thumbnail
-                thumbnail.set_selected(True)
+        thumbnail = self.image_grid.find_thumbnail(image_path)
+        if thumbnail is not None:
+            # Deselect all thumbnails first
+            self.image_grid.deselect_all()
+            # Select this thumbnail
+            thumbnail.set_selected(True)
 
-                # Update status bar
-                if thumbnail.has_watermark is not None:
-                    confidence_pct = thumbnail.confidence * 100
-                    confidence_str = "{:.1f}%".format(confidence_pct)
-                    if thumbnail.has_watermark:
-                        status = "Watermark Detected (Confidence: {})".format(
-                            confidence_str
-                        )
-                    else:
-                        status = "No Watermark (Confidence: {})".format(confidence_str)
-                    self.statusBar.showMessage(
-                        "{}: {}".format(os.path.basename(thumbnail.image_path), status)
+            # Update status bar
+            if thumbnail.has_watermark is not None:
+                confidence_pct = thumbnail.confidence * 100
+                confidence_str = "{:.1f}%".format(confidence_pct)
+                if thumbnail.has_watermark:
+                    status = "Watermark Detected (Confidence: {})".format(
+                        confidence_str
                     )
-                break
+                else:
+                    status = "No Watermark (Confidence: {})".format(confidence_str)
+                self.statusBar.showMessage(
+                    "{}: {}".format(display_name(thumbnail.image_path), status)
+                )
+
+
+def run_autotune(args):
+    """Calibrate batch size, workers and threads on a sample of the inputs"""
+    folder_walker = FolderWalker(args.inputs)
+    sample = list(itertools.islice(folder_walker, SAMPLE_SIZE))
+    folder_walker.stop()
+    print(f"Autotuning on {len(sample)} images...", file=sys.stderr)
+
+    def run_trial(config):
+        # In-process inference runs on this process's threads, pool workers
+        # are given theirs; trials use the run's watchdog settings
+        torch.set_num_threads(config["threads"])
+        detection_thread = WatermarkDetectionThread(
+            sample,
+            fast_preprocess=args.fast_preprocess,
+            workers=config["workers"],
+            batch_size=config["batch_size"],
+            decode_timeout=args.decode_timeout,
+            inference_timeout=args.inference_timeout,
+            threads=config["threads"],
+        )
+        detection_thread.run()
+        # Tars in the sample contribute all their images
+        return detection_thread.processed
+
+    memory_limit = args.memory_limit * 2**20 if args.memory_limit else None
+    return autotune(
+        run_trial,
+        memory_limit=memory_limit,
+        log=lambda message: print(message, file=sys.stderr),
+    )
+
+
+def reference_predictions(image_paths):
+    """Classify images one at a time with the eager model and its transform"""
+    predictions = {}
+    # Read like detection reads them, so archive members compare as well
+    for image_path, source, read_error in iter_image_sources(image_paths):
+        try:
+            if read_error is not None:
+                raise read_error
+            with Image.open(source) as image:
+                image_tensor = transform(image.convert("RGB"))
+            with torch.no_grad():
+                output = model(image_tensor.unsqueeze(0).to(device))
+                probabilities = torch.nn.functional.softmax(output, dim=1)
+                confidence, predicted = torch.max(probabilities, 1)
+            predictions[image_path] = (predicted.item() == 1, confidence.item())
+        except Exception as e:
+            predictions[image_path] = str(e)
+    return predictions
+
+
+def run_parity(args):
+    """Compare the configuration given on the command line with the reference"""
+    if args.inputs:
+        folder_walker = FolderWalker(args.inputs)
+        image_paths = list(folder_walker)
+        folder_walker.stop()
+    else:
+        directory = os.path.join(DEFAULT_PARITY_DIR, f"seed-{args.parity_seed}")
+        image_paths = generate_image_set(
+            directory, args.parity_images, args.parity_seed
+        )
+    print(f"Checking parity on {len(image_paths)} images...", file=sys.stderr)
+
+    batch_size = args.batch_size or BATCH_SIZE
+
+    def candidate_predictions(image_paths):
+        """Predictions of the configuration under test, by path"""
+        candidate = {}
+        detection_thread = WatermarkDetectionThread(
+            image_paths,
+            fast_preprocess=args.fast_preprocess,
+            workers=args.workers or 0,
+            batch_size=batch_size,
+            frame_stride=args.frame_stride,
+            frame_budget=args.frame_budget,
+            image_memory_limit=args.image_memory * 2**20,
+            decode_timeout=args.decode_timeout,
+            inference_timeout=args.inference_timeout,
+        )
+        detection_thread.result_ready.connect(
+            lambda image_path, has_watermark, _, confidence: candidate.__setitem__(
+                image_path, (has_watermark, confidence)
+            )
+        )
+        detection_thread.error.connect(candidate.__setitem__)
+        detection_thread.skipped.connect(candidate.__setitem__)
+        detection_thread.run()
+        return candidate
+
+    # Warm up both sides so neither pays for its first forward pass (or,
+    # on a GPU, for tuning kernels to the candidate's batch shape)
+    reference_predictions(image_paths[:1])
+    candidate_predictions(image_paths[:batch_size])
+
+    start = time.perf_counter()
+    reference = reference_predictions(image_paths)
+    reference_seconds = time.perf_counter() - start
+    start = time.perf_counter()
+    candidate = candidate_predictions(image_paths)
+    candidate_seconds = time.perf_counter() - start
+
+    report = compare(reference, candidate, reference_seconds, candidate_seconds)
+    for line in format_report(report):
+        print(line)
+    failures = parity_failures(report, args.max_flip_rate, args.max_probability_delta)
+    for failure in failures:
+        print(f"Parity check failed: {failure}", file=sys.stderr)
+    return 1 if failures else 0
+
+
+def print_summary(counts, elapsed):
+    """Print the totals of a run by label"""
+    total_count = sum(counts.values())
+    print(
+        f"Analysis complete: {total_count} images processed in {elapsed:.1f}s\n"
+        f"Watermarked: {counts.get(LABEL_WATERMARK, 0)} | "
+        f"Non-watermarked: {counts.get(LABEL_NO_WATERMARK, 0)} | "
+        f"Errors: {counts.get(LABEL_ERROR, 0)} | "
+        f"Skipped: {counts.get(LABEL_SKIPPED, 0)}",
+        file=sys.stderr,
+    )
+
+
+def run_merge(args):
+    """Combine the result files of sharded runs (or a work queue) into one report"""
+    if len(args.inputs) == 1 and is_queue_file(args.inputs[0]):
+        counts, elapsed, problems = export_results(args.inputs[0], args.output)
+    else:
+        counts, elapsed, problems = merge_shards(args.inputs, args.output)
+    if problems:
+        for problem in problems:
+            print(f"Cannot merge: {problem}", file=sys.stderr)
+        return 1
+    print(f"Merged {len(args.inputs)} result files into {args.output}", file=sys.stderr)
+    print_summary(counts, elapsed)
+    return 0
+
+
+def run_headless(args):
+    """Run detection without a window, streaming results to a report"""
+    print(startup_metrics(), file=sys.stderr)
+    if device.type != "cpu" and (args.decode_timeout or args.inference_timeout):
+        # A GPU is driven from the detection thread, which cannot be stopped
+        print(
+            "--decode-timeout and --inference-timeout have no effect on a GPU; "
+            "images are decoded and classified without a time limit",
+            file=sys.stderr,
+        )
+
+    # Use this machine's tuned settings, calibrating first when asked
+    model_key = model_fingerprint(MODEL_PATH)
+    tuning = load_tuning(model_key)
+    if args.autotune and (tuning is None or args.retune):
+        tuning = run_autotune(args)
+        save_tuning(model_key, tuning)
+        print(
+            "Tuned: batch size {batch_size}, {workers} workers, {threads} threads "
+            "({images_per_second:.1f} images/s)".format(**tuning),
+            file=sys.stderr,
+        )
+    tuning = tuning or {}
+    if "threads" in tuning:
+        torch.set_num_threads(tuning["threads"])
+    workers = args.workers if args.workers is not None else tuning.get("workers", 0)
+    # Tuned threads per worker only fit the tuned number of workers
+    pool_threads = tuning.get("threads") if workers == tuning.get("workers") else None
+    batch_size = args.batch_size or tuning.get("batch_size", BATCH_SIZE)
+    start_warm_up(batch_size, workers, args.decode_timeout, args.inference_timeout)
+
+    result_sink = open_sink(args.output) if args.output else None
+
+    # Sharded: walk everything, keep this shard's images and report them by
+    # their shard keys, the same on every machine
+    partition = None
+    if args.shard is not None:
+        partition = ShardPartition(args.shard, args.inputs)
+        result_sink = ShardSink(result_sink, partition)
+
+    # Distributed: claim images from a queue shared with other workers and
+    # store the results there
+    work_queue = None
+    if args.queue:
+        work_queue = SharedWorkQueue(args.queue, batch_size, args.lease)
+        work_queue.fill(args.inputs)
+        result_sink = QueueSink(work_queue)
+
+    tensor_cache = None
+    if args.cache:
+        tensor_cache = TensorCache(
+            PREPROCESS_DEFINITION if args.fast_preprocess else transform,
+            image_memory_limit=args.image_memory * 2**20,
+        )
+    embedding_store = None
+    if args.embeddings:
+        embedding_store = EmbeddingStore(
+            model_fingerprint(MODEL_PATH), dim=model.fc.in_features
+        )
+
+    # Expose throughput and errors to monitoring while the run goes on
+    metrics = None
+    metrics_outputs = []
+    if args.metrics_port is not None or args.metrics_file:
+        metrics = DetectorMetrics()
+        metrics.model_load_seconds.set(MODEL_LOAD_MS / 1000)
+    if args.metrics_port is not None:
+        metrics_outputs.append(MetricsServer(metrics.registry, args.metrics_port))
+        print(
+            "Serving metrics on http://127.0.0.1:{}/metrics".format(
+                metrics_outputs[-1].port
+            ),
+            file=sys.stderr,
+        )
+    if args.metrics_file:
+        metrics_outputs.append(TextfileExporter(metrics.registry, args.metrics_file))
+
+    # Remote storage: read files ahead so decoding does not wait on latency
+    read_ahead = None
+    if args.read_ahead:
+        read_ahead = ReadAhead(args.read_ahead, args.read_ahead_mb * 2**20)
+
+    # Inputs may be images, archives or folders; all are walked lazily
+    if work_queue is not None:
+        folder_walker = None
+        image_paths = work_queue.claimed_paths()
+    else:
+        folder_walker = FolderWalker(args.inputs, select=partition)
+        image_paths = folder_walker
+    counts = {
+        LABEL_WATERMARK: 0,
+        LABEL_NO_WATERMARK: 0,
+        LABEL_ERROR: 0,
+        LABEL_SKIPPED: 0,
+    }
+
+    def handle_result(image_path, has_watermark, explanation, confidence):
+        counts[LABEL_WATERMARK if has_watermark else LABEL_NO_WATERMARK] += 1
+        if result_sink is None:
+            print("{}: {}".format(display_name(image_path), explanation))
+
+    def handle_error(image_path, error_message):
+        counts[LABEL_ERROR] += 1
+        if result_sink is None:
+            print("{}: Error: {}".format(display_name(image_path), error_message))
+
+    def handle_skipped(image_path, reason):
+        counts[LABEL_SKIPPED] += 1
+        if result_sink is None:
+            print("{}: Skipped: {}".format(display_name(image_path), reason))
+
+    def handle_progress(current, total):
+        if result_sink is not None and current % 1000 == 0:
+            print(f"Processed {current} images...", file=sys.stderr)
+
+    detection_thread = WatermarkDetectionThread(
+        image_paths,
+        tensor_cache,
+        args.fast_preprocess,
+        embedding_store,
+        result_sink,
+        workers,
+        batch_size,
+        args.frame_stride,
+        args.frame_budget,
+        args.image_memory * 2**20,
+        args.decode_timeout,
+        args.inference_timeout,
+        metrics,
+        read_ahead,
+        pool_threads,
+    )
+    detection_thread.result_ready.connect(handle_result)
+    detection_thread.error.connect(handle_error)
+    detection_thread.skipped.connect(handle_skipped)
+    detection_thread.progress_update.connect(handle_progress)
+
+    # Without an event loop the detection simply runs in this thread
+    start = time.perf_counter()
+    detection_thread.run()
+    if work_queue is not None:
+        # Stay around while other workers hold images, in case one of them
+        # dies and its claims have to be taken over
+        while work_queue.wait_for_work():
+            detection_thread.image_paths = work_queue.claimed_paths()
+            detection_thread.run()
+        work_queue.close()
+    elapsed = time.perf_counter() - start
+    if folder_walker is not None:
+        folder_walker.stop()
+    for metrics_output in metrics_outputs:
+        metrics_output.close()
+
+    if partition is not None:
+        # Marks the shard as complete for --merge
+        write_manifest(args.output, partition, result_sink.count, elapsed)
+
+    print_summary(counts, elapsed)
+    if work_queue is not None:
+        print(
+            f"Claimed {work_queue.claimed} images from {args.queue}; every image "
+            f"in the queue is done",
+            file=sys.stderr,
+        )
+    if read_ahead is not None:
+        print(
+            "Read ahead {:.1f} MB from {} files at {:.1f} MB/s".format(
+                read_ahead.bytes_read / 2**20,
+                read_ahead.files_read,
+                read_ahead.mb_per_second,
+            ),
+            file=sys.stderr,
+        )
+    return 0
+
+
+def parse_args(argv):
+    """Parse command line options (unknown options are left for Qt)"""
+    parser = argparse.ArgumentParser(description="Detect watermarks in images.")
+    parser.add_argument(
+        "inputs", nargs="*", help="images, archives or folders to scan (headless)"
+    )
+    parser.add_argument(
+        "--headless", action="store_true", help="run without opening a window"
+    )
+    parser.add_argument(
+        "-o", "--output", help="stream results to a .csv, .jsonl or .parquet file"
+    )
+    parser.add_argument(
+        "--fast-preprocess",
+        action="store_true",
+        help="resize and convert images in vectorized batches",
+    )
+    parser.add_argument(
+        "--cache", action="store_true", help="use the preprocessed input cache"
+    )
+    parser.add_argument(
+        "--embeddings",
+        action="store_true",
+        help="store image embeddings for similarity search",
+    )
+    parser.add_argument(
+        "--workers",
+        type=int,
+        help="run inference in this many worker processes (0: in-process)",
+    )
+    parser.add_argument(
+        "--batch-size", type=int, help="images per forward pass (default: 32)"
+    )
+    parser.add_argument(
+        "--frame-stride",
+        type=int,
+        help="classify every Nth frame of animated and multi-page images "
+        "(default: spread the frame budget over all frames)",
+    )
+    parser.add_argument(
+        "--frame-budget",
+        type=int,
+        default=FRAME_BUDGET,
+        help="frames classified per animated or multi-page image at most "
+        "(default: {})".format(FRAME_BUDGET),
+    )
+    parser.add_argument(
+        "--image-memory",
+        type=int,
+        metavar="MB",
+        default=DEFAULT_MEMORY_LIMIT // 2**20,
+        help="memory one image may take while decoded; larger PNG, TIFF and "
+        "JPEG files are reduced while read, others are skipped (default: %(default)s)",
+    )
+    parser.add_argument(
+        "--decode-timeout",
+        type=float,
+        metavar="SECONDS",
+        nargs="?",
+        const=DECODE_TIMEOUT,
+        help="time one image may take to decode before its decoder process is "
+        "stopped and the image reported as timed out (default: no limit; "
+        "without SECONDS: {:.0f})".format(DECODE_TIMEOUT),
+    )
+    parser.add_argument(
+        "--inference-timeout",
+        type=float,
+        metavar="SECONDS",
+        nargs="?",
+        const=INFERENCE_TIMEOUT,
+        help="inference time per image before a batch's worker is stopped and "
+        "the batch reported as timed out (default: no limit; without "
+        "SECONDS: {:.0f})".format(INFERENCE_TIMEOUT),
+    )
+    parser.add_argument(
+        "--read-ahead",
+        type=int,
+        metavar="N",
+        default=0,
+        help="read up to N image files at once into memory ahead of decoding, "
+        "for network filesystems (default: 0, decoders open the files)",
+    )
+    parser.add_argument(
+        "--read-ahead-mb",
+        type=int,
+        metavar="MB",
+        default=DEFAULT_READ_AHEAD_BYTES // 2**20,
+        help="bytes read ahead and not yet decoded at most (default: %(default)s)",
+    )
+    parser.add_argument(
+        "--shard",
+        metavar="I/N",
+        help="process only shard I of N of the inputs (partitioned by path "
+        "hash), for splitting a scan across machines; needs --output",
+    )
+    parser.add_argument(
+        "--merge",
+        action="store_true",
+        help="combine the result files of all shards, given as inputs, into "
+        "the --output report",
+    )
+    parser.add_argument(
+        "--queue",
+        metavar="PATH",
+        help="claim images from the SQLite work queue at PATH, shared with "
+        "workers on other machines, and store the results there (the first "
+        "worker queues the inputs; export them with --merge PATH)",
+    )
+    parser.add_argument(
+        "--lease",
+        type=float,
+        metavar="SECONDS",
+        default=LEASE_SECONDS,
+        help="with --queue, time after which the claims of a worker that "
+        "crashed or produced no results are taken over (default: %(default)s)",
+    )
+    parser.add_argument(
+        "--autotune",
+        action="store_true",
+        help="calibrate batch size, workers and threads on a sample of the inputs "
+        "if this machine and model have not been tuned yet",
+    )
+    parser.add_argument(
+        "--retune", action="store_true", help="with --autotune, calibrate again"
+    )
+    parser.add_argument(
+        "--memory-limit",
+        type=int,
+        metavar="MB",
+        help="memory ceiling for autotuning (default: half of physical memory)",
+    )
+    parser.add_argument(
+        "--metrics-port",
+        type=int,
+        metavar="PORT",
+        help="serve Prometheus metrics on http://127.0.0.1:PORT/metrics "
+        "while running headless",
+    )
+    parser.add_argument(
+        "--metrics-file",
+        metavar="PATH",
+        help="write Prometheus metrics to PATH (for node_exporter's textfile "
+        "collector) during and after a headless run",
+    )
+    parser.add_argument(
+        "--parity",
+        action="store_true",
+        help="check that the configuration given by the other options classifies "
+        "a generated image set (or the inputs) like the reference eager model",
+    )
+    parser.add_argument(
+        "--parity-images",
+        type=int,
+        default=IMAGE_COUNT,
+        help="images in the generated parity set (default: %(default)s)",
+    )
+    parser.add_argument(
+        "--parity-seed",
+        type=int,
+        default=0,
+        help="seed of the generated parity set (default: %(default)s)",
+    )
+    parser.add_argument(
+        "--max-flip-rate",
+        type=float,
+        default=MAX_FLIP_RATE,
+        help="share of labels allowed to differ from the reference "
+        "(default: %(default)s)",
+    )
+    parser.add_argument(
+        "--max-probability-delta",
+        type=float,
+        default=MAX_PROBABILITY_DELTA,
+        help="largest allowed change of an image's watermark probability "
+        "(default: %(default)s)",
+    )
+    parser.add_argument(
+        "--diagnostics",
+        action="store_true",
+        help="log memory, Qt object and allocator use around every detection "
+        "job in the window, flagging growth between jobs",
+    )
+    # Used by build_app.py to time how long the window takes to appear
+    parser.add_argument(
+        "--startup-benchmark", action="store_true", help=argparse.SUPPRESS
+    )
+    args, _ = parser.parse_known_args(argv)
+    if args.headless and not args.inputs and not (args.parity or args.queue):
+        parser.error("--headless needs at least one input")
+    if args.shard is not None:
+        try:
+            args.shard = parse_shard(args.shard)
+            root_names(args.inputs)
+        except ValueError as e:
+            parser.error(str(e))
+    if (args.shard or args.merge) and not args.output:
+        parser.error("--shard and --merge need --output")
+    if (args.shard or args.queue) and not args.headless:
+        parser.error("--shard and --queue need --headless")
+    if args.queue and (args.shard or args.output):
+        parser.error(
+            "--queue stores the results in the queue; export them with --merge"
+        )
+    if args.merge and not args.inputs:
+        parser.error("--merge needs the result files of the shards")
+    return args
 
 
 def main():
+    # Spawned pool workers of a bundled build re-run the executable
+    torch.multiprocessing.freeze_support()
+
+    args = parse_args(sys.argv[1:])
+    if args.parity:
+        sys.exit(run_parity(args))
+    if args.merge:
+        sys.exit(run_merge(args))
+    if args.headless:
+        sys.exit(run_headless(args))
+
     app = QApplication(sys.argv)
     window = WatermarkDetectorApp()
+    if args.diagnostics:
+        window.leak_tracker = LeakTracker()
     window.show()
+    # The window runs detection without a watchdog
+    start_warm_up(
+        window.tuning.get("batch_size", BATCH_SIZE), window.workers_spin.value()
+    )
+    if args.startup_benchmark:
+        # Report once the event loop has shown the window, then exit
+        def window_ready():
+            print("window ready", flush=True)
+            app.quit()
+
+        QTimer.singleShot(0, window_ready)
     sys.exit(app.exec_())
 
 
@@ -0,0 +1,373 @@
+"""Work queue shared by detection workers on several machines.
+
+The queue is a SQLite database, on a shared filesystem (one that supports
+file locking) or on local disk to run several workers on one machine. No
+process coordinates the others: the first worker to open the queue walks
+the inputs into it, and every worker claims a batch of pending images at a
+time, classifies them and writes the results back into the queue.
+
+A claim is a lease. While a worker makes progress (claims images or
+produces results), a background thread renews the leases of its claimed
+images; when a worker crashes, or hangs for a whole lease, its leases run
+out and the images are claimed again by whichever worker asks next.
+Results are only accepted from the current holder of a claim, so every
+image ends up with exactly one result. An image whose claim keeps running
+out (say it crashes every worker that opens it) is given up after a few
+attempts and reported as an error.
+"""
+
+import os
+import socket
+import sqlite3
+import threading
+import time
+import uuid
+
+from image_sources import iter_folder_images
+from result_sinks import LABEL_ERROR, RESULT_FIELDS, ResultSink, open_sink
+
+# Seconds a claim stays valid without being renewed
+LEASE_SECONDS = 60.0
+
+# Seconds between checks for work while other workers hold all of it
+POLL_SECONDS = 1.0
+
+# Claims of an image that ran out before it is given up
+MAX_ATTEMPTS = 3
+
+# Paths inserted per transaction while the inputs are walked
+FILL_CHUNK = 1000
+
+QUEUE_EXTENSIONS = (".sqlite", ".sqlite3", ".db")
+
+# Image states
+PENDING = 0
+CLAIMED = 1
+DONE = 2
+
+SCHEMA = """
+CREATE TABLE IF NOT EXISTS images (
+    id INTEGER PRIMARY KEY,
+    path TEXT UNIQUE NOT NULL,
+    state INTEGER NOT NULL DEFAULT 0,
+    claim TEXT,
+    worker TEXT,
+    lease_until REAL,
+    attempts INTEGER NOT NULL DEFAULT 0,
+    finished REAL,
+    label TEXT,
+    confidence REAL,
+    decode_ms REAL,
+    inference_ms REAL,
+    error TEXT
+);
+CREATE INDEX IF NOT EXISTS images_state ON images (state, lease_until);
+CREATE INDEX IF NOT EXISTS images_worker ON images (worker, state);
+CREATE TABLE IF NOT EXISTS meta (key TEXT PRIMARY KEY, value);
+"""
+
+
+def is_queue_file(path):
+    return path.lower().endswith(QUEUE_EXTENSIONS)
+
+
+def _connect(path):
+    # Autocommit; transactions are opened explicitly with BEGIN IMMEDIATE
+    # so concurrent claims are serialized by the database lock
+    conn = sqlite3.connect(path, timeout=60, isolation_level=None)
+    conn.execute("PRAGMA synchronous = FULL")
+    return conn
+
+
+class _Transaction:
+    """BEGIN IMMEDIATE ... COMMIT, rolled back on an exception"""
+
+    def __init__(self, conn):
+        self.conn = conn
+
+    def __enter__(self):
+        self.conn.execute("BEGIN IMMEDIATE")
+        return self.conn
+
+    def __exit__(self, exc_type, *exc_info):
+        self.conn.execute("ROLLBACK" if exc_type else "COMMIT")
+
+
+class SharedWorkQueue:
+    """One worker's view of a shared work queue
+
+    ``claimed_paths`` yields image paths as they are claimed, a batch at a
+    time, and the results come back through ``complete`` (or a QueueSink).
+    """
+
+    def __init__(self, path, claim_size, lease_seconds=LEASE_SECONDS):
+        self.path = path
+        self.claim_size = claim_size
+        self.lease_seconds = lease_seconds
+        self.worker = "{}:{}:{}".format(
+            socket.gethostname(), os.getpid(), uuid.uuid4().hex[:8]
+        )
+        self.conn = _connect(path)
+        self.conn.executescript(SCHEMA)
+        # Claim of every image this worker holds and has not completed
+        self.claims = {}
+        self.claimed = 0
+        self.fill_thread = None
+        # When this worker last claimed images or produced a result
+        self.last_progress = time.monotonic()
+        self._stopped = threading.Event()
+        self._heartbeat = threading.Thread(target=self._renew_leases, daemon=True)
+        self._heartbeat.start()
+
+    def _meta(self, conn, key, default=None):
+        row = conn.execute("SELECT value FROM meta WHERE key = ?", (key,)).fetchone()
+        return row[0] if row else default
+
+    def _set_meta(self, conn, key, value):
+        conn.execute("INSERT OR REPLACE INTO meta VALUES (?, ?)", (key, value))
+
+    def fill(self, roots):
+        """Walk the inputs into the queue unless another worker does or did"""
+        if not roots:
+            return
+        now = time.time()
+        with _Transaction(self.conn) as conn:
+            if self._meta(conn, "populated"):
+                return
+            # A filler that stopped renewing its lease has died; take over
+            if self._meta(conn, "fill_lease", 0) > now:
+                return
+            self._set_meta(conn, "filler", self.worker)
+            self._set_meta(conn, "fill_lease", now + self.lease_seconds)
+            # For a worker taking over; paths must be the same on every machine
+            self._set_meta(conn, "roots", "\n".join(roots))
+            if self._meta(conn, "started") is None:
+                self._set_meta(conn, "started", now)
+        self.fill_thread = threading.Thread(
+            target=self._fill, args=(list(roots),), daemon=True
+        )
+        self.fill_thread.start()
+
+    def _fill(self, roots):
+        conn = _connect(self.path)
+        try:
+            chunk = []
+            for root in roots:
+                # Every image needs its own row and lease, so tars are listed
+                for image_path in iter_folder_images(root, list_tars=True):
+                    chunk.append((image_path,))
+                    if len(chunk) >= FILL_CHUNK:
+                        self._insert(conn, chunk)
+                        chunk = []
+            self._insert(conn, chunk, populated=True)
+        finally:
+            conn.close()
+
+    def _insert(self, conn, chunk, populated=False):
+        # Paths already queued by a previous, interrupted filler are ignored
+        with _Transaction(conn):
+            conn.executemany("INSERT OR IGNORE INTO images (path) VALUES (?)", chunk)
+            self._set_meta(conn, "fill_lease", time.time() + self.lease_seconds)
+            if populated:
+                self._set_meta(conn, "populated", 1)
+
+    @property
+    def populated(self):
+        return bool(self._meta(self.conn, "populated"))
+
+    def claim(self):
+        """Claim up to claim_size pending or abandoned images; return their paths"""
+        now = time.time()
+        claim = uuid.uuid4().hex
+        with _Transaction(self.conn) as conn:
+            # Give up images whose claims have run out too often
+            conn.execute(
+                "UPDATE images SET state = ?, label = ?, error = ?, finished = ? "
+                "WHERE state = ? AND lease_until < ? AND attempts >= ?",
+                (
+                    DONE,
+                    LABEL_ERROR,
+                    "Given up after {} attempts".format(MAX_ATTEMPTS),
+                    now,
+                    CLAIMED,
+                    now,
+                    MAX_ATTEMPTS,
+                ),
+            )
+            rows = conn.execute(
+                "SELECT id, path FROM images WHERE state = ? ORDER BY id LIMIT ?",
+                (PENDING, self.claim_size),
+            ).fetchall()
+            if len(rows) < self.claim_size:
+                rows += conn.execute(
+                    "SELECT id, path FROM images "
+                    "WHERE state = ? AND lease_until < ? LIMIT ?",
+                    (CLAIMED, now, self.claim_size - len(rows)),
+                ).fetchall()
+            conn.executemany(
+                "UPDATE images SET state = ?, claim = ?, worker = ?, "
+                "lease_until = ?, attempts = attempts + 1 WHERE id = ?",
+                [
+                    (CLAIMED, claim, self.worker, now + self.lease_seconds, row_id)
+                    for row_id, _ in rows
+                ],
+            )
+        for _, image_path in rows:
+            self.claims[image_path] = claim
+        self.claimed += len(rows)
+        self.progressed()
+        return [image_path for _, image_path in rows]
+
+    def claimed_paths(self):
+        """Yield paths as they are claimed until none can be claimed now
+
+        While the inputs are still being walked into the queue, waits for
+        more. Images other workers hold are left to them; see wait_for_work.
+        """
+        while True:
+            image_paths = self.claim()
+            if image_paths:
+                yield from image_paths
+            elif self.populated:
+                return
+            else:
+                self.fill_if_abandoned()
+                time.sleep(POLL_SECONDS)
+
+    def fill_if_abandoned(self):
+        """Take over walking the inputs from a filler that died"""
+        roots = self._meta(self.conn, "roots")
+        if roots is not None and self.fill_thread is None:
+            self.fill(roots.split("\n"))
+
+    def wait_for_work(self):
+        """Wait until images can be claimed (True) or all are done (False)"""
+        while True:
+            now = time.time()
+            pending, abandoned = self.conn.execute(
+                "SELECT SUM(state = ?), SUM(state = ? AND lease_until < ?) "
+                "FROM images",
+                (PENDING, CLAIMED, now),
+            ).fetchone()
+            if pending or abandoned:
+                return True
+            if self.populated and not self.remaining():
+                return False
+            self.fill_if_abandoned()
+            time.sleep(POLL_SECONDS)
+
+    def remaining(self):
+        """Images not done yet, by any worker"""
+        return self.conn.execute(
+            "SELECT COUNT(*) FROM images WHERE state != ?", (DONE,)
+        ).fetchone()[0]
+
+    def progressed(self):
+        """Note that this worker is alive, so its leases are renewed"""
+        self.last_progress = time.monotonic()
+
+    def complete(self, records):
+        """Store results, keeping only those of claims this worker still holds"""
+        self.progressed()
+        now = time.time()
+        rows = []
+        for record in records:
+            claim = self.claims.pop(record["path"], None)
+            if claim is None:
+                continue
+            rows.append(
+                tuple(record[field] for field in RESULT_FIELDS[1:])
+                + (now, DONE, record["path"], claim)
+            )
+        with _Transaction(self.conn) as conn:
+            conn.executemany(
+                "UPDATE images SET label = ?, confidence = ?, decode_ms = ?, "
+                "inference_ms = ?, error = ?, finished = ?, state = ? "
+                "WHERE path = ? AND claim = ?",
+                rows,
+            )
+
+    def _renew_leases(self):
+        """Heartbeat: extend the leases of this worker's claims
+
+        Leases are only extended while the worker made progress within the
+        last lease, so the claims of a worker stuck on an image run out.
+        """
+        conn = _connect(self.path)
+        try:
+            while not self._stopped.wait(self.lease_seconds / 3):
+                alive = time.monotonic() - self.last_progress < self.lease_seconds
+                with _Transaction(conn):
+                    if alive:
+                        conn.execute(
+                            "UPDATE images SET lease_until = ? "
+                            "WHERE worker = ? AND state = ?",
+                            (time.time() + self.lease_seconds, self.worker, CLAIMED),
+                        )
+                    if self.fill_thread is not None and self.fill_thread.is_alive():
+                        self._set_meta(
+                            conn, "fill_lease", time.time() + self.lease_seconds
+                        )
+        finally:
+            conn.close()
+
+    def close(self):
+        """Stop renewing leases; unfinished claims run out and are reclaimed"""
+        self._stopped.set()
+        self._heartbeat.join()
+        self.conn.close()
+
+
+class QueueSink(ResultSink):
+    """Write results back into the shared work queue, a claim at a time"""
+
+    def __init__(self, work_queue):
+        super().__init__(work_queue.path, work_queue.claim_size)
+        self.work_queue = work_queue
+
+    def write(self, record):
+        # Every result shows the worker is alive, not only every full buffer
+        self.work_queue.progressed()
+        super().write(record)
+
+    def write_batch(self, records):
+        self.work_queue.complete(records)
+
+
+def export_results(queue_path, output):
+    """Write the results in a queue to a report
+
+    Returns (counts by label, seconds from the moment the first worker
+    started filling the queue to the last result, problems), like
+    merge_shards. The report is only written when every image is done.
+    """
+    conn = _connect(queue_path)
+    try:
+        problems = []
+        row = conn.execute("SELECT value FROM meta WHERE key = 'populated'")
+        if row.fetchone() is None:
+            problems.append(f"{queue_path}: the inputs are still being queued")
+        remaining = conn.execute(
+            "SELECT COUNT(*) FROM images WHERE state != ?", (DONE,)
+        ).fetchone()[0]
+        if remaining:
+            problems.append(f"{queue_path}: {remaining} images not processed yet")
+        if problems:
+            return {}, 0, problems
+
+        counts = {}
+        with open_sink(output) as sink:
+            cursor = conn.execute(
+                "SELECT {} FROM images ORDER BY id".format(", ".join(RESULT_FIELDS))
+            )
+            for values in cursor:
+                record = dict(zip(RESULT_FIELDS, values))
+                counts[record["label"]] = counts.get(record["label"], 0) + 1
+                sink.write(record)
+        started, finished = conn.execute(
+            "SELECT (SELECT value FROM meta WHERE key = 'started'), MAX(finished) "
+            "FROM images"
+        ).fetchone()
+        return counts, (finished or 0) - (started or 0), problems
+    finally:
+        conn.close()